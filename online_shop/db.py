@@ -0,0 +1,66 @@
+from django.db import connections
+
+# Applied to every new SQLite connection. WAL lets readers run while a writer commits;
+# synchronous=NORMAL is durable across application crashes in WAL mode and only
+# fsyncs at checkpoints. Negative cache_size is in KiB. journal_mode=WAL is stored in the
+# database file, so the first connection rewrites its header; db.sqlite3 is therefore not tracked.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def pragmas(values):
+    return ';'.join(f'PRAGMA {name}={value}' for name, value in values.items())
+
+
+def sqlite_database(path, read_only=False, conn_max_age=60, timeout=5):
+    options = {
+        # seconds a writer waits for the lock instead of failing with "database is locked"
+        'timeout': timeout,
+    }
+    if read_only:
+        # the journal mode is a property of the file and cannot be set from a read-only connection
+        read_pragmas = {name: value for name, value in SQLITE_PRAGMAS.items() if name != 'journal_mode'}
+        options.update(init_command=pragmas({**read_pragmas, 'query_only': 1}), uri=True)
+        name = f'file:{path}?mode=ro'
+    else:
+        # take the write lock at BEGIN, so a transaction that reads and then writes
+        # waits for the lock up front instead of failing on upgrade
+        options.update(init_command=pragmas(SQLITE_PRAGMAS), transaction_mode='IMMEDIATE')
+        name = path
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'OPTIONS': options,
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'} if read_only else {},
+    }
+
+
+class ReadReplicaRouter:
+    # Catalog reads go to the replica; writes, every other model and reads made inside
+    # a transaction on the primary (which must see their own writes) stay on default.
+    replica = 'replica'
+    replica_models = {'store.category', 'store.subcategory', 'store.product', 'store.productimage',
+                      'store.review', 'store.tierprice'}
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower not in self.replica_models:
+            return None
+        if connections['default'].in_atomic_block:
+            return 'default'
+        return self.replica
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return {obj1._state.db, obj2._state.db} <= {'default', self.replica}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
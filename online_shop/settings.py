@@ -2,6 +2,10 @@ from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
 import os
+import sys
+
+from .db import sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -39,10 +43,12 @@ INSTALLED_APPS = [
     'allauth.socialaccount.providers.github',
     'allauth.socialaccount.providers.google',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
 ]
 
 
 MIDDLEWARE = [
+    'store.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,13 +83,125 @@ WSGI_APPLICATION = 'online_shop.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Connections are kept for DB_CONN_MAX_AGE seconds (use 0 under ASGI). Set
+# DATABASE_REPLICA_NAME to a replica file (or to db.sqlite3 itself for a read-only
+# connection) to send catalog reads there through online_shop.db.ReadReplicaRouter.
+
 DATABASES = {
+    'default': sqlite_database(os.getenv('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+                               conn_max_age=int(os.getenv('DB_CONN_MAX_AGE', 60))),
+}
+
+if os.getenv('DATABASE_REPLICA_NAME'):
+    DATABASES['replica'] = sqlite_database(os.getenv('DATABASE_REPLICA_NAME'), read_only=True,
+                                           conn_max_age=int(os.getenv('DB_CONN_MAX_AGE', 60)))
+    DATABASE_ROUTERS = ['online_shop.db.ReadReplicaRouter']
+
+
+# Cache
+# Set CATALOG_CACHE_URL (e.g. redis://127.0.0.1:6379/1) to share the catalog cache between processes,
+# and MEMBERSHIP_CACHE_URL for the membership cache (it falls back to CATALOG_CACHE_URL). With a local
+# memory cache each worker only drops its own copy of a user's flags when they change, so other workers
+# keep serving stale is_favorite / in_cart flags, ETags included, for up to MEMBERSHIP_CACHE_TIMEOUT.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CATALOG_CACHE_URL'),
+    } if os.getenv('CATALOG_CACHE_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    'membership': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('MEMBERSHIP_CACHE_URL') or os.getenv('CATALOG_CACHE_URL'),
+    } if os.getenv('MEMBERSHIP_CACHE_URL') or os.getenv('CATALOG_CACHE_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'membership',
+    },
 }
 
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_TIMEOUT = 60 * 60
+CATALOG_CACHE_MAX_ENTRY_SIZE = 256 * 1024
+
+# Per-user sets of favorite / in-cart product ids behind the is_favorite and in_cart flags.
+MEMBERSHIP_CACHE_ALIAS = 'membership'
+MEMBERSHIP_CACHE_TIMEOUT = 5 * 60
+
+
+# Serve category, subcategory and product list/detail with native async views
+# (store.async_views). Only worth it under ASGI; compare with `manage.py benchmark_catalog`.
+ASYNC_CATALOG_VIEWS = os.getenv('ASYNC_CATALOG_VIEWS') == '1'
+
+
+# Request instrumentation (store.instrumentation): queries, SQL and serializer time and
+# response size per view, served as Prometheus text at /metrics/ to Bearer METRICS_TOKEN
+# (open without a token in DEBUG, 404 otherwise). Server-Timing headers are added when
+# SERVER_TIMING is on.
+SERVER_TIMING = DEBUG or os.getenv('SERVER_TIMING') == '1'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+REQUEST_DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+
+# Most queries a request to each view may run (authenticated, a full page of data, every filter, cold caches,
+# the first visit that creates the cart or favorite). A number covers every method; a dict budgets each
+# method on its own (HEAD as GET) and leaves the others unbudgeted, so reads and writes get their own limits.
+# Over budget is logged as a warning, or raises QueryBudgetExceeded with QUERY_BUDGET_MODE = 'raise',
+# the default under `manage.py test` so a change that breaks a budget fails the suite.
+QUERY_BUDGETS = {
+    'category_list': 1,
+    'category_detail': 2,
+    'sub_category_list': 1,
+    'sub_category_detail': 5,
+    'product_list': 7,
+    'product_detail': 4,
+    'product_search': 7,
+    'product_facets': 2,
+    'product_reviews': 1,
+    'productimage-list': {'GET': 1},
+    'productimage-detail': {'GET': 1},
+    'review-list': {'GET': 1},
+    'review-detail': {'GET': 1, 'PUT': 7, 'PATCH': 7, 'DELETE': 3},
+    'cart_detail': 7,
+    'cartitem-list': {'GET': 5, 'POST': 11},
+    'cartitem-detail': {'GET': 5, 'PUT': 13, 'PATCH': 13, 'DELETE': 4},
+    'cart_items_list': {'GET': 10, 'POST': 11},
+    # moving a line onto another product merges the two
+    'cart_items_detail': {'PUT': 13, 'DELETE': 4},
+    'cart_batch': 15,
+    'favorite_detail': 7,
+    'favorite_item_list': {'GET': 7, 'POST': 9},
+    'favorite_item_detail': {'PUT': 8, 'DELETE': 4},
+    'userprofile-list': 3,
+    'userprofile-detail': {'GET': 1, 'PUT': 3, 'PATCH': 3, 'DELETE': 13},
+    'login_list': 2,
+    'register_list': 2,
+    'token_refresh': 2,
+    'logout_list': 6,
+}
+QUERY_BUDGET_MODE = os.getenv('QUERY_BUDGET_MODE', 'raise' if sys.argv[1:2] == ['test'] else 'log')
+
+
+# Product search
+# Use 'store.search.SimpleSearchBackend' on databases without SQLite FTS5.
+
+PRODUCT_SEARCH_BACKEND = 'store.search.SQLiteFTS5Backend'
+
+
+# Lower bounds of the price ranges counted by /product/facets/; the last range is open-ended.
+
+PRODUCT_PRICE_BUCKETS = [0, 500, 1000, 2500, 5000, 10000]
+
+
+# Catalog export (/product/export/, export_catalog): the cursor trails the clock by this many
+# seconds, so rows stamped by transactions still open during an export reach the next run.
+
+PRODUCT_EXPORT_CURSOR_LAG = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -133,6 +251,23 @@ STATIC_URL = 'static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Media is served by store.media.serve_media. Content-hashed names (image derivatives)
+# are cached forever; set MEDIA_ACCEL_REDIRECT_PREFIX (e.g. /protected-media/) to let
+# nginx send the bytes via X-Accel-Redirect.
+MEDIA_IMMUTABLE_PATTERN = r'-[0-9a-f]{16}-\d+w\.'
+MEDIA_CACHE_MAX_AGE = 60 * 60
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv('MEDIA_ACCEL_REDIRECT_PREFIX', '')
+
+# Resized WebP/AVIF copies of uploaded images, built off-request by a worker pool
+# and exposed as `srcset` by the API.
+
+IMAGE_DERIVATIVE_DIR = 'derivatives'
+IMAGE_DERIVATIVE_WIDTHS = [320, 640, 1280, 1920]
+IMAGE_DERIVATIVE_FORMATS = ['webp', 'avif']
+IMAGE_DERIVATIVE_QUALITY = 80
+IMAGE_DERIVATIVE_WORKERS = 2
+IMAGE_DERIVATIVES_ASYNC = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -145,7 +280,7 @@ AUTH_USER_MODEL = 'store.UserProfile'
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication',
     )
 }
 
@@ -168,4 +303,13 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
     "ROTATE_REFRESH_TOKENS": False,
     "BLACKLIST_AFTER_ROTATION": False,
-}
\ No newline at end of file
+    # request.user is built from the token claims; no UserProfile query per request
+    "TOKEN_USER_CLASS": "store.authentication.StoreTokenUser",
+}
+
+# In-process cache behind StoreTokenUser.get_user() for views that need the full model.
+USER_CACHE_SIZE = 1024
+USER_CACHE_TIMEOUT = 60
+
+# How often each process picks up refresh tokens revoked by other processes.
+TOKEN_BLACKLIST_SYNC_INTERVAL = 5
@@ -1,11 +1,17 @@
+import re
+
 from django.conf.urls.i18n import i18n_patterns
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from store.instrumentation import metrics_view
+from store.media import serve_media
 
 urlpatterns = i18n_patterns(
     path('', include('store.urls')),
     path('admin/', admin.site.urls),
     path('accounts/', include('allauth.urls')),
-)+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+)+ [
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+    path('metrics/', metrics_view, name='metrics'),
+]
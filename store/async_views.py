@@ -0,0 +1,148 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.shortcuts import aget_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views.decorators.http import require_safe
+from django_filters.filters import ModelChoiceFilter
+from django_filters.utils import translate_validation
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .cache import acatalog_version, aget_cached, aset_cached, catalog_cache_key, catalog_etag
+from .filters import ProductFilter
+from .membership import aget_membership
+from .models import Category, Product, SubCategory
+from .pagination import ProductPagination
+from .pricing import request_status
+from .serializers import (CategoryListSerializer, CategoryDetailSerializer, SubCategoryListSerializer,
+                          SubCategoryDetailSerializer, ProductListSerializer, ProductDetailSerializer)
+from .views import product_etag, product_list_etag
+
+# Async counterparts of the read-only catalog views, enabled by ASYNC_CATALOG_VIEWS.
+# They return the same JSON as the DRF views; the authentication classes must not
+# touch the database (JWTStatelessUserAuthentication), and every serializer must be
+# fully served by its query plan, since the ORM is only awaited before serializing.
+
+
+def render(data, status=200, etag=None):
+    response = HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+    if etag is not None:
+        response['ETag'] = etag
+    return response
+
+
+def catalog_view(view):
+    @require_safe
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        request = Request(request, authenticators=authenticators)
+        try:
+            request.user
+            return await view(request, *args, **kwargs)
+        except Http404 as error:
+            return render({'detail': str(error)}, 404)
+        except exceptions.APIException as error:
+            detail = error.detail if isinstance(error.detail, (list, dict)) else {'detail': error.detail}
+            response = render(detail, error.status_code)
+            if isinstance(error, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)) and authenticators:
+                response['WWW-Authenticate'] = authenticators[0].authenticate_header(request)
+            return response
+    return wrapper
+
+
+def context(request):
+    return {'request': request, 'format': None, 'view': None}
+
+
+async def catalog_response(request, load):
+    # ConditionalGetMixin + CatalogCacheMixin for data versioned by the catalog counter
+    version = await acatalog_version()
+    etag = catalog_etag(version)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    key = catalog_cache_key(request, version)
+    data = await aget_cached(key)
+    if data is None:
+        data = await load()
+        await aset_cached(key, data)
+    return render(data, etag=etag)
+
+
+@catalog_view
+async def category_list(request):
+    async def load():
+        categories = [category async for category in CategoryListSerializer.query_plan(Category.objects.all())]
+        return CategoryListSerializer(categories, many=True, context=context(request)).data
+    return await catalog_response(request, load)
+
+
+@catalog_view
+async def category_detail(request, pk):
+    async def load():
+        category = await aget_object_or_404(CategoryDetailSerializer.query_plan(Category.objects.all()), pk=pk)
+        return CategoryDetailSerializer(category, context=context(request)).data
+    return await catalog_response(request, load)
+
+
+@catalog_view
+async def sub_category_list(request):
+    async def load():
+        queryset = SubCategoryListSerializer.query_plan(SubCategory.objects.all())
+        subcategories = [subcategory async for subcategory in queryset]
+        return SubCategoryListSerializer(subcategories, many=True, context=context(request)).data
+    return await catalog_response(request, load)
+
+
+@catalog_view
+async def sub_category_detail(request, pk):
+    await aget_membership(request)
+    queryset = SubCategoryDetailSerializer.query_plan(SubCategory.objects.all())
+    subcategory = await aget_object_or_404(queryset, pk=pk)
+    return render(SubCategoryDetailSerializer(subcategory, context=context(request)).data)
+
+
+@catalog_view
+async def product_list(request):
+    status = request_status(request)
+    filterset = ProductFilter(request.query_params, queryset=Product.objects.with_effective_price(status),
+                              request=request)
+    # model choice filters (subcategory) look their value up while validating
+    lookups = any(isinstance(filterset.filters.get(name), ModelChoiceFilter) for name in request.query_params)
+    valid = await sync_to_async(filterset.is_valid)() if lookups else filterset.is_valid()
+    if not valid:
+        raise translate_validation(filterset.errors)
+    paginator = ProductPagination()
+    page_queryset = paginator.get_page_queryset(filterset.qs, request)
+
+    membership = await aget_membership(request)
+    etag = product_list_etag([row async for row in page_queryset.values_list('id', 'version')], membership, status)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is None:
+        rows = paginator.get_page([product async for product in ProductListSerializer.query_plan(page_queryset)])
+        data = ProductListSerializer(rows, many=True, context=context(request)).data
+        response = render(paginator.get_paginated_response(data).data, etag=etag)
+    else:
+        response = not_modified
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+@catalog_view
+async def product_detail(request, pk):
+    status = request_status(request)
+    version = await Product.objects.filter(pk=pk).values_list('version', flat=True).afirst()
+    if version is None:
+        raise Http404('No Product matches the given query.')
+    etag = product_etag(pk, version, status, await acatalog_version())
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    queryset = ProductDetailSerializer.query_plan(Product.objects.with_effective_price(status))
+    product = await aget_object_or_404(queryset, pk=pk)
+    return render(ProductDetailSerializer(product, context=context(request)).data, etag=etag)
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .blacklist import revoked_tokens
+from .models import UserProfile
+
+
+class UserCache:
+    # small per-process LRU with a TTL; other processes only see changes once the TTL runs out
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(user_id)
+                return entry[1]
+        user = UserProfile.objects.filter(pk=user_id).first()
+        if user is not None:
+            with self.lock:
+                self.entries[user_id] = (now + self.timeout, user)
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TIMEOUT)
+
+
+class StoreRefreshToken(RefreshToken):
+    # claims set here are copied into every access token minted from this refresh token
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['username'] = user.username
+        token['status'] = user.status
+        token['is_staff'] = user.is_staff
+        return token
+
+    def check_blacklist(self):
+        if self.payload[api_settings.JTI_CLAIM] in revoked_tokens:
+            raise TokenError('Токен отозван')
+
+    def blacklist(self):
+        result = super().blacklist()
+        revoked_tokens.add(self.payload[api_settings.JTI_CLAIM], datetime_from_epoch(self.payload['exp']))
+        return result
+
+
+class StoreTokenUser(TokenUser):
+    @cached_property
+    def id(self):
+        # for_user() writes the claim as a string
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def status(self):
+        return self.token.get('status', 'simple')
+
+    def get_user(self):
+        return user_cache.get(self.id)
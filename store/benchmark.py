@@ -0,0 +1,217 @@
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, Client
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from .authentication import StoreRefreshToken
+from .export import format_cursor
+from .models import CartItem, FavoriteItem, Product, ProductImage, Review, SubCategory, UserProfile
+from .synthetic import SYNTHETIC_PASSWORD
+
+# Every route in store/urls.py as one or more scenarios, sent in-process through the whole
+# middleware stack. Writes are undone outside the timed section, so repeated runs see the same data.
+
+
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+class Scenario:
+    def __init__(self, name, path, method='GET', data=None, auth=True, prepare=None, cleanup=None):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.data = data
+        self.auth = auth
+        # prepare(index) returns path / data overrides for one request, cleanup(response) undoes a write
+        self.prepare = prepare
+        self.cleanup = cleanup
+
+    def request(self, index):
+        request = {'path': self.path, 'data': self.data}
+        if self.prepare:
+            request.update(self.prepare(index))
+        return request
+
+
+def url(name, *args, query=''):
+    with translation.override('en'):
+        return reverse(name, args=args) + (f'?{query}' if query else '')
+
+
+def auth_headers(user):
+    return {'authorization': f'Bearer {StoreRefreshToken.for_user(user).access_token}'}
+
+
+def build_scenarios(user, seed=1):
+    rng = random.Random(seed)
+    product = Product.objects.order_by('id')[rng.randrange(Product.objects.count())]
+    subcategory = SubCategory.objects.get(pk=product.subcategory_id)
+    review = Review.objects.order_by('id').first()
+    image = ProductImage.objects.order_by('id').first()
+    cart_items = list(CartItem.objects.filter(cart__user=user).order_by('id'))
+    word = product.product_name_en.split()[1]
+    next_page = Client(headers=auth_headers(user)).get(url('product_list')).json()['next']
+
+    def favorite_to_delete(index):
+        favorite = FavoriteItem.objects.create(favorite=user.favorite, product=product)
+        return {'path': url('favorite_item_detail', favorite.pk)}
+
+    def refresh_token(index):
+        return {'data': {'refresh': str(StoreRefreshToken.for_user(user))}}
+
+    def new_user(index):
+        return {'data': {'username': f'bench-{uuid.uuid4().hex[:12]}', 'password': SYNTHETIC_PASSWORD,
+                         'phone_number': '+996555000000'}}
+
+    def delete_favorite(response):
+        if response.status_code == 201:
+            FavoriteItem.objects.filter(pk=response.json()['id']).delete()
+
+    def delete_user(response):
+        if response.status_code == 201:
+            UserProfile.objects.filter(username=response.json()['username']).delete()
+
+    scenarios = [
+        Scenario('category_list', url('category_list')),
+        Scenario('category_detail', url('category_detail', subcategory.category_id)),
+        Scenario('sub_category_list', url('sub_category_list')),
+        Scenario('sub_category_detail', url('sub_category_detail', subcategory.pk)),
+        Scenario('product_list', url('product_list')),
+        Scenario('product_list anonymous', url('product_list'), auth=False),
+        Scenario('product_list subcategory', url('product_list', query=f'subcategory={subcategory.pk}')),
+        Scenario('product_list article_number', url('product_list', query=f'article_number={product.article_number}')),
+        Scenario('product_list product_type', url('product_list', query='product_type=true')),
+        Scenario('product_list price range', url('product_list', query='price__gt=1000&price__lt=5000')),
+        Scenario('product_list ordering=price', url('product_list', query='ordering=price')),
+        Scenario('product_list ordering=-price', url('product_list', query='ordering=-price')),
+        Scenario('product_detail', url('product_detail', product.pk)),
+        Scenario('product_search', url('product_search', query=f'q={word}')),
+        Scenario('product_facets', url('product_facets', query=f'subcategory={subcategory.pk}')),
+        Scenario('product_reviews', url('product_reviews', product.pk)),
+        Scenario('product_export since', url('product_export', query=f'since={format_cursor(timezone.now())}')),
+        Scenario('productimage-list', url('productimage-list')),
+        Scenario('productimage-detail', url('productimage-detail', image.pk)),
+        Scenario('review-list', url('review-list')),
+        Scenario('review-detail', url('review-detail', review.pk)),
+        Scenario('userprofile-list', url('userprofile-list')),
+        Scenario('cart_detail', url('cart_detail')),
+        Scenario('cartitem-list', url('cartitem-list')),
+        Scenario('cart_items_list', url('cart_items_list')),
+        Scenario('favorite_detail', url('favorite_detail')),
+        Scenario('favorite_item_list', url('favorite_item_list')),
+        Scenario('favorite_item_list add', url('favorite_item_list'), 'POST', {'product_id': product.pk},
+                 cleanup=delete_favorite),
+        Scenario('favorite_item_detail delete', None, 'DELETE', prepare=favorite_to_delete),
+        Scenario('login_list', url('login_list'), 'POST', {'username': user.username, 'password': SYNTHETIC_PASSWORD},
+                 auth=False),
+        Scenario('token_refresh', url('token_refresh'), 'POST', auth=False, prepare=refresh_token),
+        Scenario('logout_list', url('logout_list'), 'POST', prepare=refresh_token),
+        Scenario('register_list', url('register_list'), 'POST', auth=False, prepare=new_user, cleanup=delete_user),
+    ]
+    if next_page:
+        scenarios.insert(6, Scenario('product_list page 2', urlsplit(next_page)._replace(scheme='', netloc='').geturl()))
+    if cart_items:
+        # the same lines and quantities are written back, so the cart does not grow
+        item = cart_items[0]
+        scenarios += [
+            Scenario('cart_items_list add', url('cart_items_list'), 'POST', {'product_id': item.product_id, 'quantity': 0}),
+            Scenario('cart_items_detail', url('cart_items_detail', item.pk), 'PUT',
+                     {'product_id': item.product_id, 'quantity': item.quantity}),
+            Scenario('cart_batch', url('cart_batch'), 'POST',
+                     {'operations': [{'op': 'set', 'product_id': line.product_id, 'quantity': line.quantity}
+                                     for line in cart_items]}),
+        ]
+    return scenarios
+
+
+def summarize(samples):
+    # samples: (seconds, queries, status) per timed request
+    latencies = sorted(seconds for seconds, queries, status in samples)
+    return {
+        'requests': len(samples),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        # one client sending requests back to back
+        'throughput': round(len(latencies) / sum(latencies), 1),
+        'queries': max(queries for seconds, queries, status in samples),
+        'statuses': {str(status): count for status, count in sorted(Counter(status for *rest, status in samples).items())},
+    }
+
+
+def send(client, method, path, data, headers):
+    # headers go with each request: AsyncClient(headers=...) leaves them out of the ASGI scope
+    if method == 'GET':
+        return client.get(path, headers=headers)
+    return client.generic(method, path, json.dumps(data or {}), content_type='application/json', headers=headers)
+
+
+def run_scenario(scenario, user, requests, warmup):
+    client = Client()
+    headers = auth_headers(user) if scenario.auth else {}
+    samples = []
+    for index in range(warmup + requests):
+        request = scenario.request(index)
+        started = time.perf_counter()
+        response = send(client, scenario.method, request['path'], request['data'], headers)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = time.perf_counter() - started
+        if scenario.cleanup:
+            scenario.cleanup(response)
+        if index >= warmup:
+            samples.append((elapsed, response.wsgi_request.request_stats.queries, response.status_code))
+    return summarize(samples)
+
+
+async def arun_scenario(scenario, user, requests, warmup):
+    client = AsyncClient()
+    headers = await sync_to_async(auth_headers)(user) if scenario.auth else {}
+    samples = []
+    for index in range(warmup + requests):
+        request = await sync_to_async(scenario.request)(index)
+        started = time.perf_counter()
+        response = await send(client, scenario.method, request['path'], request['data'], headers)
+        if response.streaming and response.is_async:
+            [chunk async for chunk in response.streaming_content]
+        elif response.streaming:
+            # as the ASGI handler does, a sync iterator (which may query) runs in a thread
+            await sync_to_async(b''.join)(response.streaming_content)
+        elapsed = time.perf_counter() - started
+        if scenario.cleanup:
+            await sync_to_async(scenario.cleanup)(response)
+        if index >= warmup:
+            samples.append((elapsed, response.asgi_request.request_stats.queries, response.status_code))
+    return summarize(samples)
+
+
+def compare(results, baseline, tolerance=0.25, min_delta_ms=1.0):
+    # returns (lines, regressions): any extra query is a regression, and so is a p50 beyond the
+    # relative tolerance and min_delta_ms; p99 of a short run is too noisy to fail on and is only shown
+    lines, regressions = [], []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            lines.append(f'{name:32} new')
+            continue
+        lines.append(f'{name:32} {delta(previous["p50_ms"], current["p50_ms"]):>8} '
+                     f'{delta(previous["p99_ms"], current["p99_ms"]):>8} '
+                     f'{delta(previous["throughput"], current["throughput"]):>8} '
+                     f'{current["queries"] - previous["queries"]:+7}')
+        if current['queries'] > previous['queries']:
+            regressions.append(f'{name}: queries {previous["queries"]} -> {current["queries"]}')
+        if (current['p50_ms'] > previous['p50_ms'] * (1 + tolerance)
+                and current['p50_ms'] - previous['p50_ms'] > min_delta_ms):
+            regressions.append(f'{name}: p50 {previous["p50_ms"]} ms -> {current["p50_ms"]} ms')
+    return lines, regressions
+
+
+def delta(previous, current):
+    return f'{(current - previous) / previous:+.0%}' if previous else 'n/a'
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class RevokedTokens:
+    # JTIs of blacklisted refresh tokens that have not expired yet. Loaded once, then
+    # topped up with rows newer than the last seen id, at most every sync_interval seconds,
+    # so a revocation check is a set lookup instead of a join on the blacklist tables.
+    def __init__(self, sync_interval):
+        self.sync_interval = sync_interval
+        self.expiry = {}
+        self.last_id = None
+        self.synced_at = None
+        self.lock = threading.Lock()
+
+    def sync(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.synced_at is not None and now - self.synced_at < self.sync_interval:
+                return
+            self.synced_at = now
+            rows = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+            if self.last_id is not None:
+                rows = rows.filter(id__gt=self.last_id)
+            for pk, jti, expires_at in rows.order_by('id').values_list('id', 'token__jti', 'token__expires_at'):
+                self.expiry[jti] = expires_at
+                self.last_id = pk
+            self.discard_expired()
+
+    def discard_expired(self):
+        now = timezone.now()
+        self.expiry = {jti: expires_at for jti, expires_at in self.expiry.items() if expires_at > now}
+
+    def add(self, jti, expires_at):
+        with self.lock:
+            self.expiry[jti] = expires_at
+
+    def __contains__(self, jti):
+        self.sync()
+        return jti in self.expiry
+
+    def reset(self):
+        with self.lock:
+            self.expiry, self.last_id, self.synced_at = {}, None, None
+
+
+revoked_tokens = RevokedTokens(settings.TOKEN_BLACKLIST_SYNC_INTERVAL)
+
+
+def prune_expired_tokens(batch_size=1000):
+    # deleting outstanding rows cascades to their blacklist rows; batches keep each DELETE short
+    deleted = 0
+    while True:
+        ids = list(OutstandingToken.objects.filter(expires_at__lte=timezone.now())
+                   .order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        OutstandingToken.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
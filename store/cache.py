@@ -0,0 +1,75 @@
+import pickle
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+VERSION_KEY = 'catalog:version'
+
+
+def catalog_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def catalog_version():
+    cache = catalog_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # a lost counter restarts from the clock, so old keys are never reused
+        cache.add(VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def acatalog_version():
+    cache = catalog_cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache = catalog_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        catalog_version()
+
+
+def catalog_etag(version=None):
+    # async callers pass the version they awaited
+    version = catalog_version() if version is None else version
+    return f'W/"catalog-{version}"'
+
+
+def catalog_cache_key(request, version=None):
+    version = catalog_version() if version is None else version
+    return f'catalog:{version}:{request.LANGUAGE_CODE}:{request.get_host()}:{request.get_full_path()}'
+
+
+def get_cached(key):
+    return catalog_cache().get(key)
+
+
+async def aget_cached(key):
+    return await catalog_cache().aget(key)
+
+
+def fits_cache(data):
+    return len(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)) <= settings.CATALOG_CACHE_MAX_ENTRY_SIZE
+
+
+def set_cached(key, data):
+    if not fits_cache(data):
+        return False
+    catalog_cache().set(key, data, settings.CATALOG_CACHE_TIMEOUT)
+    return True
+
+
+async def aset_cached(key, data):
+    if not fits_cache(data):
+        return False
+    await catalog_cache().aset(key, data, settings.CATALOG_CACHE_TIMEOUT)
+    return True
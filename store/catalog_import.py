@@ -0,0 +1,236 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import translation
+
+from .models import Product, ProductImage, SubCategory, TierPrice
+from .search import get_search_backend
+
+LANGUAGES = [code for code, name in settings.LANGUAGES]
+TRANSLATED_FIELDS = ['product_name', 'description']
+MAX_SMALL_INT = 32767
+MAX_INT = 2147483647
+UPDATE_FIELDS = ['subcategory', 'price', 'product_type', 'image', 'video'] + [
+    f'{field}{suffix}' for field in TRANSLATED_FIELDS for suffix in [''] + [f'_{code}' for code in LANGUAGES]
+]
+EXISTING_FIELDS = ['id', 'article_number'] + [field for field in UPDATE_FIELDS if field != 'subcategory'] + ['subcategory_id']
+# set by auto_now on every row written, so updated products show up in export_catalog --since
+UPDATE_FIELDS += ['updated_date']
+
+
+def subcategory_map():
+    # every translated name -> (subcategory id, category id), plus category names -> id
+    subcategories, categories = {}, {}
+    names = [f'subcategory_name_{code}' for code in LANGUAGES] + [f'category__category_name_{code}' for code in LANGUAGES]
+    for row in SubCategory.objects.values('id', 'category_id', *names):
+        for code in LANGUAGES:
+            if row[f'subcategory_name_{code}']:
+                subcategories[row[f'subcategory_name_{code}'].strip().lower()] = (row['id'], row['category_id'])
+            if row[f'category__category_name_{code}']:
+                categories[row[f'category__category_name_{code}'].strip().lower()] = row['category_id']
+    return subcategories, categories
+
+
+def bounded_int(value, name, maximum=MAX_SMALL_INT):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an integer, got {value!r}')
+    if not 0 <= number <= maximum:
+        raise ValueError(f'{name} {number} is out of range')
+    return number
+
+
+def parse_bool(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in ('1', 'true', 'yes'):
+        return True
+    if str(value).strip().lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f'product_type must be a boolean, got {value!r}')
+
+
+def image_list(value):
+    if not value:
+        return None if value is None else []
+    if isinstance(value, list):
+        return [str(name).strip() for name in value if str(name).strip()]
+    return [name.strip() for name in str(value).split('|') if name.strip()]
+
+
+class CatalogImporter:
+    def __init__(self, images_dir=None, link=False, workers=8):
+        self.images_dir = images_dir
+        self.link = link
+        self.workers = workers
+        self.subcategories, self.categories = subcategory_map()
+        self.stats = dict.fromkeys(['rows', 'created', 'updated', 'rejected', 'images_stored', 'image_rows'], 0)
+
+    def clean_row(self, row):
+        if not isinstance(row, dict):
+            raise ValueError('not a JSON object')
+        article_number = bounded_int(row.get('article_number'), 'article_number', MAX_INT)
+        name = str(row.get('subcategory') or '').strip().lower()
+        if name not in self.subcategories:
+            raise ValueError(f'unknown subcategory {row.get("subcategory")!r}')
+        subcategory_id, category_id = self.subcategories[name]
+        if row.get('category'):
+            if self.categories.get(str(row['category']).strip().lower()) != category_id:
+                raise ValueError(f'subcategory {row["subcategory"]!r} is not in category {row["category"]!r}')
+
+        values = {'article_number': article_number, 'subcategory_id': subcategory_id,
+                  'price': bounded_int(row.get('price'), 'price')}
+        if 'product_type' in row:
+            values['product_type'] = parse_bool(row['product_type'])
+        for field in TRANSLATED_FIELDS:
+            for code in LANGUAGES:
+                if row.get(f'{field}_{code}'):
+                    values[f'{field}_{code}'] = row[f'{field}_{code}']
+            # an untranslated column fills the default language
+            default = f'{field}_{settings.MODELTRANSLATION_DEFAULT_LANGUAGE}'
+            if row.get(field) and default not in values:
+                values[default] = row[field]
+        for field in ('image', 'video'):
+            if row.get(field):
+                values[field] = str(row[field]).strip()
+        return values, image_list(row.get('images'))
+
+    def source_path(self, name):
+        return os.path.join(self.images_dir, name) if self.images_dir else name
+
+    def store_file(self, name, upload_to='image'):
+        # content-addressed, so importing the same feed twice stores nothing new
+        source = self.source_path(name)
+        if not os.path.isfile(source):
+            if default_storage.exists(name):
+                return name, False
+            raise ValueError(f'file not found: {name}')
+        digest = hashlib.blake2b(digest_size=8)
+        with open(source, 'rb') as stream:
+            for block in iter(lambda: stream.read(1024 * 1024), b''):
+                digest.update(block)
+        stem, ext = os.path.splitext(os.path.basename(source))
+        target = f'{upload_to}/{stem}-{digest.hexdigest()}{ext.lower()}'
+        if default_storage.exists(target):
+            return target, False
+        if self.link:
+            try:
+                os.makedirs(os.path.dirname(default_storage.path(target)), exist_ok=True)
+                os.link(source, default_storage.path(target))
+                return target, True
+            except (NotImplementedError, OSError):
+                pass
+        with open(source, 'rb') as stream:
+            return default_storage.save(target, File(stream)), True
+
+    def store_files(self, names):
+        # {feed name: stored name or ValueError}
+        def store(item):
+            name, upload_to = item
+            try:
+                return name, self.store_file(name, upload_to)
+            except ValueError as error:
+                return name, error
+        stored = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for name, result in pool.map(store, names.items()):
+                if isinstance(result, ValueError):
+                    stored[name] = result
+                else:
+                    stored[name], copied = result
+                    self.stats['images_stored'] += copied
+        return stored
+
+    def import_chunk(self, chunk):
+        # returns [(line, message), ...] for rejected rows
+        errors, rows = [], {}
+        for line, row in chunk:
+            self.stats['rows'] += 1
+            try:
+                values, images = self.clean_row(row)
+            except ValueError as error:
+                errors.append((line, str(error)))
+                continue
+            # a repeated article number in one chunk: the last row wins
+            rows[values['article_number']] = (line, values, images)
+
+        files = {}
+        for line, values, images in rows.values():
+            for name in [values.get('image')] + (images or []):
+                if name:
+                    files[name] = 'image'
+            if values.get('video'):
+                files[values['video']] = 'video'
+        stored = self.store_files(files)
+
+        existing = {row['article_number']: row
+                    for row in Product.objects.filter(article_number__in=list(rows)).values(*EXISTING_FIELDS)}
+        products, gallery = [], {}
+        for article_number, (line, values, images) in list(rows.items()):
+            missing = [name for name in [values.get('image'), values.get('video')] + (images or [])
+                       if name and isinstance(stored[name], ValueError)]
+            current = existing.get(article_number)
+            if missing:
+                errors.append((line, str(stored[missing[0]])))
+                continue
+            if current is None and not any(values.get(f'product_name_{code}') for code in LANGUAGES):
+                errors.append((line, 'product_name is required for a new product'))
+                continue
+            for field in ('image', 'video'):
+                if values.get(field):
+                    values[field] = stored[values[field]]
+            # columns missing from the feed keep their stored values
+            merged = {**{key: value for key, value in (current or {}).items() if key != 'id'}, **values}
+            for field in TRANSLATED_FIELDS:
+                # the untranslated column mirrors the default language, which must not be empty
+                default = f'{field}_{settings.MODELTRANSLATION_DEFAULT_LANGUAGE}'
+                if not merged.get(default):
+                    merged[default] = next((merged[f'{field}_{code}'] for code in LANGUAGES
+                                            if merged.get(f'{field}_{code}')), '')
+            product = Product(**{key: value for key, value in merged.items()
+                                 if key not in TRANSLATED_FIELDS})
+            products.append(product)
+            if images is not None:
+                gallery[article_number] = [stored[name] for name in images]
+            self.stats['updated' if current else 'created'] += 1
+
+        with transaction.atomic(), translation.override(settings.MODELTRANSLATION_DEFAULT_LANGUAGE):
+            Product.objects.bulk_create(products, update_conflicts=True, unique_fields=['article_number'],
+                                        update_fields=UPDATE_FIELDS, batch_size=500)
+            ids = dict(Product.objects.filter(article_number__in=[product.article_number for product in products])
+                       .values_list('article_number', 'id'))
+            for product in products:
+                product.pk = ids[product.article_number]
+            self.sync_gallery({ids[article_number]: names for article_number, names in gallery.items()})
+            # bulk_create skips the post_save handlers, so their work is done per chunk here
+            TierPrice.refresh(products)
+            get_search_backend().index_products(products)
+            Product.touch(pk__in=list(ids.values()))
+        self.stats['rejected'] += len(errors)
+        return errors
+
+    def sync_gallery(self, gallery):
+        # only the difference is written, so re-importing an unchanged feed touches no rows
+        if not gallery:
+            return
+        current = {}
+        for pk, product_id, image in ProductImage.objects.filter(product_id__in=list(gallery)).values_list(
+                'pk', 'product_id', 'image'):
+            current.setdefault(product_id, {})[image] = pk
+        removed, added = [], []
+        for product_id, names in gallery.items():
+            have = current.get(product_id, {})
+            removed += [pk for image, pk in have.items() if image not in names]
+            added += [ProductImage(product_id=product_id, image=name) for name in dict.fromkeys(names)
+                      if name not in have]
+        ProductImage.objects.filter(pk__in=removed).delete()
+        ProductImage.objects.bulk_create(added, batch_size=500)
+        self.stats['image_rows'] += len(added) + len(removed)
@@ -0,0 +1,142 @@
+import datetime
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .feeds import chunked
+from .models import RATING_FIELDS, DeletedProduct, Product, ProductImage, SubCategory, TierPrice
+
+LANGUAGES = [code for code, name in settings.LANGUAGES]
+TRANSLATED_FIELDS = ['product_name', 'description']
+PRODUCT_FIELDS = ['id', 'article_number', 'subcategory_id', 'price', 'product_type', 'image', 'video',
+                  'created_date', 'updated_date', 'version'] + RATING_FIELDS + [
+    f'{field}_{code}' for field in TRANSLATED_FIELDS for code in LANGUAGES
+]
+
+
+def parse_since(value):
+    # ISO 8601; a naive value is read as UTC
+    if not value:
+        return None
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError(f'invalid since {value!r}')
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, datetime.timezone.utc)
+    return since
+
+
+def export_until():
+    # updated_date is stamped before the transaction commits, so a row stamped just before now
+    # may still be invisible; everything up to now - lag is assumed committed
+    return timezone.now() - datetime.timedelta(seconds=settings.PRODUCT_EXPORT_CURSOR_LAG)
+
+
+def format_cursor(value):
+    return value.astimezone(datetime.timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def export_queryset(until, since=None):
+    # products changed in [since, until], oldest change first; since is inclusive, so a
+    # product saved at the previous cursor is sent twice rather than missed
+    queryset = Product.objects.filter(updated_date__lte=until)
+    if since is not None:
+        queryset = queryset.filter(updated_date__gte=since)
+    return queryset.order_by('updated_date', 'id')
+
+
+def translations(row, field):
+    return {code: row[f'{field}_{code}'] for code in LANGUAGES}
+
+
+def subcategory_records():
+    names = [f'subcategory_name_{code}' for code in LANGUAGES] + [f'category__category_name_{code}' for code in LANGUAGES]
+    return {
+        row['id']: {
+            'category': {'id': row['category_id'], 'name': translations(row, 'category__category_name')},
+            'subcategory': {'id': row['id'], 'name': translations(row, 'subcategory_name')},
+        }
+        for row in SubCategory.objects.values('id', 'category_id', *names)
+    }
+
+
+def product_record(row, subcategories, images, tier_prices, url):
+    review_count = row['review_count']
+    return {
+        'id': row['id'],
+        'article_number': row['article_number'],
+        'product_name': translations(row, 'product_name'),
+        'description': translations(row, 'description'),
+        **subcategories[row['subcategory_id']],
+        'price': row['price'],
+        'tier_prices': tier_prices.get(row['id'], {}),
+        'product_type': row['product_type'],
+        'image': url(row['image']),
+        'video': url(row['video']),
+        'images': [url(name) for name in images.get(row['id'], [])],
+        # Product.avg_rating() / rating_histogram() on the raw columns
+        'rating': {'avg': round(row['stars_sum'] / review_count, 1) if review_count else 0, 'count': review_count,
+                   'histogram': {stars: row[f'stars_{stars}'] for stars in range(1, 6)}},
+        'created_date': row['created_date'].isoformat() if row['created_date'] else None,
+        'updated_date': row['updated_date'].isoformat(),
+        'version': row['version'],
+    }
+
+
+def export_lines(queryset, chunk_size=1000, absolute_url=None):
+    # NDJSON, one block per chunk: plain rows plus one images and one tier price query per
+    # chunk, so neither the catalog nor the output is ever held in memory
+    def url(name):
+        if not name:
+            return None
+        return absolute_url(default_storage.url(name)) if absolute_url else default_storage.url(name)
+
+    subcategories = subcategory_records()
+    for rows in chunked(queryset.values(*PRODUCT_FIELDS).iterator(chunk_size=chunk_size), chunk_size):
+        ids = [row['id'] for row in rows]
+        images, tier_prices = {}, {}
+        for product_id, name in ProductImage.objects.filter(product_id__in=ids).order_by('id').values_list(
+                'product_id', 'image'):
+            images.setdefault(product_id, []).append(name)
+        for product_id, status, price in TierPrice.objects.filter(product_id__in=ids).values_list(
+                'product_id', 'status', 'price'):
+            tier_prices.setdefault(product_id, {})[status] = price
+        yield ''.join(
+            json.dumps(product_record(row, subcategories, images, tier_prices, url), ensure_ascii=False,
+                       separators=(',', ':')) + '\n'
+            for row in rows
+        ).encode()
+
+
+def deleted_lines(until, since, chunk_size=1000):
+    # one {"id", "deleted": true} line per product deleted in [since, until]
+    queryset = DeletedProduct.objects.filter(deleted_date__gte=since, deleted_date__lte=until).order_by(
+        'deleted_date', 'product_id').values_list('product_id', 'deleted_date')
+    for rows in chunked(queryset.iterator(chunk_size=chunk_size), chunk_size):
+        yield ''.join(
+            json.dumps({'id': product_id, 'deleted': True, 'deleted_date': deleted_date.isoformat()},
+                       separators=(',', ':')) + '\n'
+            for product_id, deleted_date in rows
+        ).encode()
+
+
+def export_catalog(until, since=None, chunk_size=1000, absolute_url=None):
+    # a full export replaces the consumer's copy; an incremental one first lists the products deleted
+    # in the window, so a product deleted and then re-created is not lost
+    if since is not None:
+        yield from deleted_lines(until, since, chunk_size)
+    yield from export_lines(export_queryset(until, since), chunk_size, absolute_url)
+
+
+async def aiterate(blocks):
+    # under ASGI a sync iterator is read into a list before the first byte is sent; this pulls
+    # one block at a time from the thread the queries run in
+    while True:
+        block = await sync_to_async(next, thread_sensitive=True)(blocks, None)
+        if block is None:
+            return
+        yield block
@@ -0,0 +1,83 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Case, CharField, Count, F, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce
+from django_filters.constants import EMPTY_VALUES
+from modeltranslation.utils import get_language
+
+# Facets are disjunctive: each one is counted with every filter but its own, so picking a
+# subcategory still shows how many products the other subcategories would have.
+FACET_FILTERS = {
+    'subcategory': {'subcategory'},
+    'product_type': {'product_type'},
+    'price': {'price__gt', 'price__lt'},
+}
+
+
+def price_bucket_expression(edges, field='price'):
+    whens = [When(**{f'{field}__lt': upper}, then=Value(index)) for index, upper in enumerate(edges[1:])]
+    return Case(*whens, default=Value(len(edges) - 1), output_field=IntegerField())
+
+
+def filter_conditions(filterset):
+    # one Q per active filter, the lookup Filter.filter() would apply
+    conditions = {}
+    for name, value in filterset.form.cleaned_data.items():
+        if value in EMPTY_VALUES:
+            continue
+        field = filterset.filters[name]
+        conditions[name] = Q(**{f'{field.field_name}__{field.lookup_expr}': value})
+    return conditions
+
+
+def count_where(conditions):
+    condition = Q()
+    for value in conditions:
+        condition &= value
+    return Count('id', filter=condition) if condition else Count('id')
+
+
+def product_facets(filterset, edges=None):
+    # filterset: a validated ProductFilter. One GROUP BY over every facet dimension at once,
+    # with a conditional count per facet; the rows are rolled up per facet here
+    edges = edges or settings.PRODUCT_PRICE_BUCKETS
+    language = get_language()
+    default_language = settings.MODELTRANSLATION_DEFAULT_LANGUAGE
+    queryset = filterset.queryset
+    conditions = filter_conditions(filterset)
+    faceted = set().union(*FACET_FILTERS.values())
+    for name, condition in conditions.items():
+        if name not in faceted:
+            queryset = queryset.filter(condition)
+    counts = {'count': count_where(condition for name, condition in conditions.items() if name in faceted)}
+    for facet, names in FACET_FILTERS.items():
+        counts[f'{facet}_count'] = count_where(condition for name, condition in conditions.items()
+                                               if name in faceted - names)
+
+    # buckets follow the tier price when the queryset carries one (the view adds it)
+    price_field = 'effective_price' if 'effective_price' in queryset.query.annotations else 'price'
+    rows = (queryset.order_by()
+            .annotate(price_bucket=price_bucket_expression(edges, price_field),
+                      subcategory_title=Coalesce(F(f'subcategory__subcategory_name_{language}'),
+                                                 F(f'subcategory__subcategory_name_{default_language}'),
+                                                 output_field=CharField()))
+            .values('subcategory', 'subcategory_title', 'product_type', 'price_bucket')
+            .annotate(**counts))
+
+    total, subcategories, titles, product_types, buckets = 0, Counter(), {}, Counter(), Counter()
+    for row in rows:
+        total += row['count']
+        subcategories[row['subcategory']] += row['subcategory_count']
+        titles[row['subcategory']] = row['subcategory_title']
+        product_types[row['product_type']] += row['product_type_count']
+        buckets[row['price_bucket']] += row['price_count']
+
+    return {
+        'count': total,
+        'subcategory': [{'id': pk, 'subcategory_name': titles[pk], 'count': count}
+                        for pk, count in subcategories.most_common() if count],
+        'product_type': [{'value': value, 'count': count} for value, count in product_types.most_common() if count],
+        'price': [{'min': lower, 'max': upper, 'count': buckets[index]}
+                  for index, (lower, upper) in enumerate(zip(edges, list(edges[1:]) + [None]))],
+    }
@@ -0,0 +1,25 @@
+import csv
+import json
+from itertools import islice
+
+
+def read_rows(path, fmt=None):
+    # yields (line number, row) without loading the file; unparseable JSONL lines yield None
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as stream:
+        if fmt == 'csv':
+            yield from enumerate(csv.DictReader(stream), start=2)
+            return
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                yield line, json.loads(text)
+            except ValueError:
+                yield line, None
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
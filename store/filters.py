@@ -1,13 +1,22 @@
-from django_filters import FilterSet
+from django_filters import FilterSet, NumberFilter
 from  .models import Product
+from .pricing import request_status
 
 
 class ProductFilter(FilterSet):
+    # price bounds apply to the caller's tier price
+    price__gt = NumberFilter(field_name='effective_price', lookup_expr='gt')
+    price__lt = NumberFilter(field_name='effective_price', lookup_expr='lt')
+
     class Meta:
         model = Product
         fields = {
             'subcategory': ['exact'],
-            'price': ['gt', 'lt'],
             'article_number': ['exact'],
             'product_type': ['exact']
-        }
\ No newline at end of file
+        }
+
+    def filter_queryset(self, queryset):
+        if 'effective_price' not in queryset.query.annotations:
+            queryset = queryset.with_effective_price(request_status(self.request))
+        return super().filter_queryset(queryset)
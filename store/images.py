@@ -0,0 +1,94 @@
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .cache import bump_catalog_version
+from .models import Category, Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+                                       thread_name_prefix='image-derivatives')
+    return _executor
+
+
+def derivative_formats():
+    Image.init()
+    return [fmt for fmt in settings.IMAGE_DERIVATIVE_FORMATS if fmt.upper() in Image.SAVE]
+
+
+def derivative_widths(original_width):
+    # never upscale; an image narrower than every width still gets one derivative
+    widths = [width for width in settings.IMAGE_DERIVATIVE_WIDTHS if width < original_width]
+    return widths or [original_width]
+
+
+def build_derivatives(name):
+    with default_storage.open(name, 'rb') as source:
+        data = source.read()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(name))[0]
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+    result = {'source': name, 'width': image.width, 'formats': {}}
+    for fmt in derivative_formats():
+        entries = []
+        for width in derivative_widths(image.width):
+            path = f'{settings.IMAGE_DERIVATIVE_DIR}/{stem}-{digest}-{width}w.{fmt}'
+            if not default_storage.exists(path):
+                resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+                buffer = io.BytesIO()
+                resized.save(buffer, fmt.upper(), quality=settings.IMAGE_DERIVATIVE_QUALITY)
+                path = default_storage.save(path, ContentFile(buffer.getvalue()))
+            entries.append([path, width])
+        result['formats'][fmt] = entries
+    return result
+
+
+def generate_derivatives(model, pk, field, name):
+    try:
+        derivatives = build_derivatives(name)
+        # guarded by the file name so a newer upload is never overwritten by a slower job
+        updated = model.objects.filter(pk=pk, **{field: name}).update(**{f'{field}_derivatives': derivatives})
+        if updated and model is Category:
+            transaction.on_commit(bump_catalog_version)
+        elif updated and model is Product:
+            Product.touch(pk=pk)
+        elif updated and model is ProductImage:
+            Product.touch(product_image__pk=pk)
+        return derivatives
+    except Exception:
+        logger.exception('Could not build derivatives for %s', name)
+
+
+def generate_in_worker(*args):
+    try:
+        return generate_derivatives(*args)
+    finally:
+        connections.close_all()
+
+
+def schedule_derivatives(instance, field):
+    name = getattr(instance, field).name
+    if not name or getattr(instance, f'{field}_derivatives', {}).get('source') == name:
+        return
+    args = (type(instance), instance.pk, field, name)
+    if settings.IMAGE_DERIVATIVES_ASYNC:
+        transaction.on_commit(lambda: executor().submit(generate_in_worker, *args))
+    else:
+        transaction.on_commit(lambda: generate_derivatives(*args))
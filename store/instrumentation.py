@@ -0,0 +1,261 @@
+import hmac
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+# Per-request numbers live in a context variable, so sync_to_async threads (the async
+# views' ORM calls) report into the request that started them.
+current_stats = ContextVar('request_stats', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        self.statements = Counter()
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_time += time.perf_counter() - started
+        stats.queries += 1
+        stats.statements[sql] += 1
+
+
+def install_query_recorder(connection):
+    connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializer_span():
+    # serializers rendered inside another one's .data are part of the outer span
+    stats = current_stats.get()
+    if stats is None or stats.serializing:
+        yield
+        return
+    stats.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_time += time.perf_counter() - started
+        stats.serializing = False
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with serializer_span():
+            return super().data
+
+
+class TimedSerializerMixin:
+    # many=True instances get TimedListSerializer unless the Meta names another list class
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = cls.__dict__.get('Meta')
+        if meta is not None and not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = TimedListSerializer
+
+    @property
+    def data(self):
+        with serializer_span():
+            return super().data
+
+
+class TimedSerializer(TimedSerializerMixin, serializers.Serializer):
+    pass
+
+
+class TimedModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    pass
+
+
+class ViewMetrics:
+    def __init__(self, buckets):
+        self.buckets = [0] * len(buckets)
+        self.requests = Counter()
+        self.duration = 0.0
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.response_bytes = 0
+        self.over_budget = 0
+
+
+class MetricsRegistry:
+    # process-local; every worker process serves its own numbers at /metrics/
+    def __init__(self, buckets):
+        self.bucket_bounds = list(buckets)
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def record(self, view, method, status, duration, stats, size, over_budget):
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = ViewMetrics(self.bucket_bounds)
+            metrics.requests[method, status] += 1
+            for index, bound in enumerate(self.bucket_bounds):
+                if duration <= bound:
+                    metrics.buckets[index] += 1
+            metrics.duration += duration
+            metrics.queries += stats.queries
+            metrics.sql_time += stats.sql_time
+            metrics.serializer_time += stats.serializer_time
+            metrics.response_bytes += size
+            metrics.over_budget += over_budget
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+    def render(self):
+        with self.lock:
+            views = sorted(self.views.items())
+            lines = [
+                '# HELP store_requests_total Requests handled, by view, method and status.',
+                '# TYPE store_requests_total counter',
+            ]
+            for view, metrics in views:
+                for (method, status), count in sorted(metrics.requests.items()):
+                    lines.append(f'store_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+
+            lines += [
+                '# HELP store_request_duration_seconds Time spent in the view and the middleware below it.',
+                '# TYPE store_request_duration_seconds histogram',
+            ]
+            for view, metrics in views:
+                count = sum(metrics.requests.values())
+                for bound, bucket in zip(self.bucket_bounds, metrics.buckets):
+                    lines.append(f'store_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {bucket}')
+                lines += [
+                    f'store_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {count}',
+                    f'store_request_duration_seconds_sum{{view="{view}"}} {metrics.duration:.6f}',
+                    f'store_request_duration_seconds_count{{view="{view}"}} {count}',
+                ]
+
+            for name, kind, help_text, attr in [
+                ('store_db_queries_total', 'counter', 'Database queries.', 'queries'),
+                ('store_db_seconds_total', 'counter', 'Time spent executing SQL.', 'sql_time'),
+                ('store_serializer_seconds_total', 'counter', 'Time spent in serializer .data.', 'serializer_time'),
+                ('store_response_bytes_total', 'counter', 'Response body bytes (streaming responses excluded).',
+                 'response_bytes'),
+                ('store_query_budget_exceeded_total', 'counter', 'Requests over the QUERY_BUDGETS entry of their view.',
+                 'over_budget'),
+            ]:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                for view, metrics in views:
+                    value = getattr(metrics, attr)
+                    lines.append(f'{name}{{view="{view}"}} {value:.6f}' if isinstance(value, float)
+                                 else f'{name}{{view="{view}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry(settings.REQUEST_DURATION_BUCKETS)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+def query_budget(view, method):
+    # an entry is one budget for every method, or a dict of them; HEAD is budgeted as GET
+    budget = settings.QUERY_BUDGETS.get(view)
+    if isinstance(budget, dict):
+        return budget.get('GET' if method == 'HEAD' else method)
+    return budget
+
+
+def budget_overrun(view, method, stats):
+    budget = query_budget(view, method)
+    if budget is None or stats.queries <= budget:
+        return None
+    sql, repeats = stats.statements.most_common(1)[0]
+    return (f'{method} {view} ran {stats.queries} queries, over its budget of {budget}; '
+            f'most repeated ({repeats}x): {sql}')
+
+
+def server_timing(stats, duration):
+    return (f'db;dur={stats.sql_time * 1000:.1f};desc="{stats.queries} queries", '
+            f'serializer;dur={stats.serializer_time * 1000:.1f}, total;dur={duration * 1000:.1f}')
+
+
+class InstrumentationMiddleware:
+    # outermost middleware: query count, SQL and serializer time, response size per view
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = request.request_stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        stats = request.request_stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - started)
+
+    def finish(self, request, response, stats, duration):
+        # queries a streaming response runs while it is being sent are not counted
+        view = view_name(request)
+        overrun = budget_overrun(view, request.method, stats)
+        registry.record(view, request.method, response.status_code, duration, stats,
+                        0 if response.streaming else len(response.content), overrun is not None)
+        if overrun is not None:
+            if settings.QUERY_BUDGET_MODE == 'raise':
+                raise QueryBudgetExceeded(overrun)
+            logger.warning(overrun)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = server_timing(stats, duration)
+        return response
+
+
+def metrics_view(request):
+    # fails closed: without a METRICS_TOKEN the endpoint only exists in DEBUG
+    if not settings.METRICS_TOKEN:
+        if not settings.DEBUG:
+            return HttpResponseNotFound()
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from store.benchmark import arun_scenario, build_scenarios, compare, run_scenario
+from store.models import Product, UserProfile
+from store.synthetic import SYNTHETIC_USER
+
+
+class Command(BaseCommand):
+    help = ('Sends every API route in-process and reports p50/p99 latency, queries per request and throughput; '
+            'run it against a generate_catalog database, since the write scenarios touch carts, favorites and users')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--client', choices=['wsgi', 'asgi'], default='wsgi',
+                            help='django.test.Client or the in-process ASGI AsyncClient')
+        parser.add_argument('--only', action='append', default=[], help='Run scenarios whose name contains this')
+        parser.add_argument('--user', default=SYNTHETIC_USER)
+        parser.add_argument('--seed', type=int, default=1, help='Picks the product, subcategory and filters used')
+        parser.add_argument('--baseline', help='JSON written by --save-baseline to compare against')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative p50 increase')
+
+    def handle(self, *args, **options):
+        user = UserProfile.objects.filter(username=options['user']).first()
+        if user is None or not Product.objects.exists():
+            raise CommandError(f'No products or no user {options["user"]!r}; run generate_catalog first')
+        scenarios = [scenario for scenario in build_scenarios(user, options['seed'])
+                     if not options['only'] or any(part in scenario.name for part in options['only'])]
+
+        results = {}
+        started = time.perf_counter()
+        self.stdout.write(f'{"scenario":32} {"p50 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>7}  statuses')
+        for scenario in scenarios:
+            if options['client'] == 'asgi':
+                result = asyncio.run(arun_scenario(scenario, user, options['requests'], options['warmup']))
+            else:
+                result = run_scenario(scenario, user, options['requests'], options['warmup'])
+            results[scenario.name] = result
+            line = (f'{scenario.name:32} {result["p50_ms"]:8.2f} {result["p99_ms"]:8.2f} {result["throughput"]:8.1f} '
+                    f'{result["queries"]:7}  {result["statuses"]}')
+            failed = any(int(status) >= 400 for status in result['statuses'])
+            self.stdout.write(self.style.ERROR(line) if failed else line)
+        total = sum(result['requests'] for result in results.values())
+        self.stdout.write(f'{total} requests in {time.perf_counter() - started:.1f}s')
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as stream:
+                json.dump({'client': options['client'], 'products': Product.objects.count(), 'scenarios': results},
+                          stream, indent=2)
+            self.stdout.write(f'Saved baseline to {options["save_baseline"]}')
+        if options['baseline']:
+            with open(options['baseline']) as stream:
+                baseline = json.load(stream)
+            lines, regressions = compare(results, baseline['scenarios'], options['tolerance'])
+            self.stdout.write(f'\nAgainst {options["baseline"]}:')
+            self.stdout.write(f'{"scenario":32} {"p50":>8} {"p99":>8} {"req/s":>8} {"queries":>7}')
+            for line in lines:
+                self.stdout.write(line)
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}'))
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from store.benchmark import percentile
+from store.models import Category, Product, SubCategory
+
+
+class Command(BaseCommand):
+    help = ('Load-tests the catalog endpoints in-process through the WSGI and the ASGI handler stack '
+            'and compares throughput; set ASYNC_CATALOG_VIEWS=1 to measure the async views')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Defaults to the category, subcategory and product endpoints')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=64)
+        parser.add_argument('--mode', choices=['wsgi', 'asgi', 'both'], default='both')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--token', help='JWT access token sent as a Bearer header')
+
+    def default_paths(self):
+        paths = ['/en/category/', '/en/sub_category/', '/en/product/', '/en/product/?ordering=price']
+        for model, template in [(Category, '/en/category/{}/'), (SubCategory, '/en/sub_category/{}/'),
+                                (Product, '/en/product/{}/')]:
+            pk = model.objects.values_list('pk', flat=True).first()
+            if pk is not None:
+                paths.append(template.format(pk))
+        return paths
+
+    def run_wsgi(self, paths, total, concurrency, headers):
+        local = threading.local()
+
+        def request(index):
+            if not hasattr(local, 'client'):
+                local.client = Client(headers=headers)
+            start = time.perf_counter()
+            status = local.client.get(paths[index % len(paths)]).status_code
+            return time.perf_counter() - start, status
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(request, range(len(paths))))
+            start = time.perf_counter()
+            results = list(pool.map(request, range(total)))
+        return time.perf_counter() - start, results
+
+    async def run_asgi(self, paths, total, concurrency, headers):
+        client = AsyncClient(headers=headers)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request(index):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(paths[index % len(paths)])
+                return time.perf_counter() - start, response.status_code
+
+        await asyncio.gather(*(request(index) for index in range(len(paths))))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(request(index) for index in range(total)))
+        return time.perf_counter() - start, results
+
+    def report(self, mode, elapsed, results):
+        latencies = sorted(latency for latency, status in results)
+        statuses = Counter(status for latency, status in results)
+        self.stdout.write(
+            f'{mode}: {len(results) / elapsed:.0f} req/s, p50 {percentile(latencies, 0.5) * 1000:.1f} ms, '
+            f'p99 {percentile(latencies, 0.99) * 1000:.1f} ms, statuses {dict(statuses)}'
+        )
+        return len(results) / elapsed
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self.default_paths()
+        headers = {'host': options['host']}
+        if options['token']:
+            headers['authorization'] = f'Bearer {options["token"]}'
+        total, concurrency = options['requests'], options['concurrency']
+        self.stdout.write(f'{total} requests, concurrency {concurrency}, '
+                          f'ASYNC_CATALOG_VIEWS={settings.ASYNC_CATALOG_VIEWS}, paths: {", ".join(paths)}')
+
+        throughput = {}
+        if options['mode'] in ('wsgi', 'both'):
+            throughput['wsgi'] = self.report('wsgi', *self.run_wsgi(paths, total, concurrency, headers))
+        if options['mode'] in ('asgi', 'both'):
+            throughput['asgi'] = self.report('asgi', *asyncio.run(self.run_asgi(paths, total, concurrency, headers)))
+        if len(throughput) == 2:
+            self.stdout.write(self.style.SUCCESS(f'asgi/wsgi throughput: {throughput["asgi"] / throughput["wsgi"]:.2f}x'))
@@ -0,0 +1,25 @@
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+from store.images import executor, generate_in_worker
+from store.models import Category, Product, ProductImage
+
+IMAGE_FIELDS = [(Category, 'category_image'), (Product, 'image'), (ProductImage, 'image')]
+
+
+class Command(BaseCommand):
+    help = 'Builds missing or outdated responsive derivatives for every uploaded image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild derivatives that are already up to date')
+
+    def handle(self, *args, **options):
+        jobs = []
+        for model, field in IMAGE_FIELDS:
+            rows = model.objects.exclude(**{field: ''}).values_list('pk', field, f'{field}_derivatives')
+            for pk, name, derivatives in rows.iterator():
+                if options['force'] or (derivatives or {}).get('source') != name:
+                    jobs.append(executor().submit(generate_in_worker, model, pk, field, name))
+        wait(jobs)
+        built = sum(1 for job in jobs if job.result())
+        self.stdout.write(self.style.SUCCESS(f'Built derivatives for {built} of {len(jobs)} images'))
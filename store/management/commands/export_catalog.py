@@ -0,0 +1,46 @@
+import gzip
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from store.export import export_catalog, export_until, format_cursor, parse_since
+
+
+class Command(BaseCommand):
+    help = ('Writes the catalog as NDJSON, one product per line; --since limits it to products changed since '
+            'a cursor, preceded by one {"id", "deleted": true} line per product deleted since then')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help='File to write, "-" for stdout')
+        parser.add_argument('--since', help='ISO 8601 cursor printed by the previous run')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--base-url', default='', help='Prefix for media URLs, e.g. https://shop.example.com')
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_since(options['since'])
+        except ValueError as error:
+            raise CommandError(error)
+        until = export_until()
+        base_url = options['base_url'].rstrip('/')
+        lines = export_catalog(until, since, options['chunk_size'], (lambda url: base_url + url) if base_url else None)
+
+        started = time.perf_counter()
+        exported = 0
+        stream = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            output = gzip.GzipFile(fileobj=stream, mode='wb') if options['gzip'] else stream
+            for block in lines:
+                output.write(block)
+                # json.dumps escapes newlines inside values, so every newline ends a record
+                exported += block.count(b'\n')
+            if output is not stream:
+                output.close()
+        finally:
+            if stream is not sys.stdout.buffer:
+                stream.close()
+        self.stderr.write(self.style.SUCCESS(
+            f'Exported {exported} records in {time.perf_counter() - started:.1f}s; '
+            f'next run: --since {format_cursor(until)}'
+        ))
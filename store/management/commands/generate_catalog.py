@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from store.models import Product, UserProfile
+from store.synthetic import SYNTHETIC_PASSWORD, SYNTHETIC_USER, generate_catalog
+
+
+class Command(BaseCommand):
+    help = ('Fills an empty database with a seeded synthetic catalog, users, carts and favorites for benchmarks, '
+            'e.g. DATABASE_NAME=bench.sqlite3 manage.py migrate && DATABASE_NAME=bench.sqlite3 manage.py generate_catalog')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--subcategories', type=int, default=10, help='Per category')
+        parser.add_argument('--reviews', type=int, default=8, help='Mean reviews per product (long-tailed)')
+        parser.add_argument('--images', type=int, default=3, help='Mean gallery images per product')
+        parser.add_argument('--cart-items', type=int, default=5, help='Cart lines per user')
+        parser.add_argument('--favorites', type=int, default=5, help='Favorites per user')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if Product.objects.exists() or UserProfile.objects.filter(username=SYNTHETIC_USER).exists():
+            raise CommandError('The database already has a catalog; point DATABASE_NAME at a new one')
+        started = time.perf_counter()
+
+        def progress(done, total):
+            self.stdout.write(f'{done}/{total} products ({done / (time.perf_counter() - started):.0f}/s)')
+
+        counts = generate_catalog(
+            products=options['products'], users=options['users'], categories=options['categories'],
+            subcategories=options['subcategories'], reviews=options['reviews'], images=options['images'],
+            cart_items=options['cart_items'], favorites=options['favorites'], seed=options['seed'],
+            batch_size=options['batch_size'], progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated in {time.perf_counter() - started:.1f}s: ' + ', '.join(f'{count} {name}' for name, count in counts.items())
+        ))
+        self.stdout.write(f'Users are user0..user{counts["users"] - 1} with the password {SYNTHETIC_PASSWORD!r}')
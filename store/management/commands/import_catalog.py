@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from store.catalog_import import CatalogImporter
+from store.feeds import chunked, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Upserts products (by article_number), their translations and images from a CSV or JSONL feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Guessed from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--images-dir', help='Directory that image and video names in the feed are relative to')
+        parser.add_argument('--link', action='store_true', help='Hard-link files into MEDIA_ROOT instead of copying')
+        parser.add_argument('--workers', type=int, default=8, help='Threads copying image files')
+
+    def handle(self, *args, **options):
+        importer = CatalogImporter(images_dir=options['images_dir'], link=options['link'], workers=options['workers'])
+        stats = importer.stats
+        started = time.perf_counter()
+        for chunk in chunked(read_rows(options['path'], options['format']), options['batch_size']):
+            for line, message in importer.import_chunk(chunk):
+                self.stderr.write(f'line {line}: {message}')
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{stats["rows"]} rows ({stats["rows"] / elapsed:.0f}/s): {stats["created"]} created, '
+                              f'{stats["updated"]} updated, {stats["rejected"]} rejected, '
+                              f'{stats["images_stored"]} files stored')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {stats["created"] + stats["updated"]} products in {elapsed:.1f}s, rejected {stats["rejected"]} rows, '
+            f'stored {stats["images_stored"]} files, changed {stats["image_rows"]} gallery rows'
+        ))
+        if stats['images_stored']:
+            self.stdout.write('Run build_image_derivatives to create the responsive image sizes')
@@ -0,0 +1,37 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from store.feeds import chunked, read_rows
+from store.user_import import import_batch, init_worker
+
+
+class Command(BaseCommand):
+    help = 'Imports users from a CSV or JSONL file, with their carts and favorites, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Guessed from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes hashing plain-text passwords; 1 hashes in this process')
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        pool = None
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                       initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'online_shop.settings'),))
+        created = skipped = 0
+        try:
+            for chunk in chunked(read_rows(options['path'], options['format']), options['batch_size']):
+                users, errors = import_batch(chunk, pool, workers)
+                created += len(users)
+                skipped += len(errors)
+                for line, message in errors:
+                    self.stderr.write(f'line {line}: {message}')
+                self.stdout.write(f'{created} users imported')
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(f'Imported {created} users, skipped {skipped} rows'))
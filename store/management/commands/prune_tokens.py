@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.blacklist import prune_expired_tokens
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired refresh tokens from the outstanding and blacklist tables (run it on a schedule)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = prune_expired_tokens(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired tokens'))
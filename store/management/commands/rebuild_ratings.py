@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the denormalized rating summary of every product from its reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        changed = rebuild_ratings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Updated rating summary for {changed} products'))
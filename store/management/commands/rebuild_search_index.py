@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from store.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product full-text search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search index with {type(backend).__name__}'))
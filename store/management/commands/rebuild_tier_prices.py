@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.pricing import rebuild_tier_prices
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-status price table from the current product prices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_tier_prices(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed tier prices for {count} products'))
@@ -0,0 +1,119 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(stat):
+    # from the stat alone, like nginx's: a replaced or rewritten file gets a new inode, mtime or
+    # size, and nothing is read before the body is handed to the proxy
+    return f'"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def cache_control(path):
+    if re.search(settings.MEDIA_IMMUTABLE_PATTERN, posixpath.basename(path)):
+        return 'public, max-age=31536000, immutable'
+    return f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+
+def parse_range(header, size):
+    # only a single byte range is honoured; anything else falls back to the full body
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def if_range_matches(request, etag, mtime):
+    value = request.headers.get('If-Range')
+    if value is None:
+        return True
+    if value.startswith('"'):
+        return value == etag
+    modified = parse_http_date_safe(value)
+    return modified is not None and int(mtime) <= modified
+
+
+def stream_range(path, start, end):
+    with open(path, 'rb') as stream:
+        stream.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = stream.read(min(CHUNK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, posixpath.normpath(path).lstrip('/'))
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    stat = os.stat(full_path)
+    etag = file_etag(stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control(full_path),
+        'Accept-Ranges': 'bytes',
+    }
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified.headers[header] = value
+        return not_modified
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    if settings.MEDIA_ACCEL_REDIRECT_PREFIX:
+        # the front proxy sends the file (and handles Range) itself
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + posixpath.normpath(path).lstrip('/')
+    else:
+        byte_range = None
+        if 'Range' in request.headers and if_range_matches(request, etag, stat.st_mtime):
+            byte_range = parse_range(request.headers['Range'], stat.st_size)
+        if byte_range is False:
+            return HttpResponse(status=416, headers={'Content-Range': f'bytes */{stat.st_size}'})
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(stream_range(full_path, start, end), status=206,
+                                             content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            # FileResponse lets the WSGI server use wsgi.file_wrapper (sendfile) for the body
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import CartItem, FavoriteItem
+
+EMPTY_MEMBERSHIP = {'favorites': frozenset(), 'cart': frozenset()}
+
+
+def membership_cache():
+    # shared between workers when MEMBERSHIP_CACHE_URL points at Redis; a write in one worker
+    # must drop the flags every worker serves
+    return caches[settings.MEMBERSHIP_CACHE_ALIAS]
+
+
+def membership_key(user_id):
+    return f'membership:{user_id}'
+
+
+def membership_querysets(user_id):
+    return {
+        'favorites': FavoriteItem.objects.filter(favorite__user_id=user_id).values_list('product_id', flat=True),
+        'cart': CartItem.objects.filter(cart__user_id=user_id).values_list('product_id', flat=True),
+    }
+
+
+def load_membership(user_id):
+    key = membership_key(user_id)
+    membership = membership_cache().get(key)
+    if membership is None:
+        membership = {name: frozenset(queryset) for name, queryset in membership_querysets(user_id).items()}
+        membership_cache().set(key, membership, settings.MEMBERSHIP_CACHE_TIMEOUT)
+    return membership
+
+
+async def aload_membership(user_id):
+    key = membership_key(user_id)
+    membership = await membership_cache().aget(key)
+    if membership is None:
+        membership = {name: frozenset([pk async for pk in queryset])
+                      for name, queryset in membership_querysets(user_id).items()}
+        await membership_cache().aset(key, membership, settings.MEMBERSHIP_CACHE_TIMEOUT)
+    return membership
+
+
+def get_membership(request):
+    # memoized on the request, so a listing reads the cache once however many rows it has
+    if request is None or not request.user.is_authenticated:
+        return EMPTY_MEMBERSHIP
+    if not hasattr(request, '_membership'):
+        request._membership = load_membership(request.user.id)
+    return request._membership
+
+
+async def aget_membership(request):
+    if request is None or not request.user.is_authenticated:
+        return EMPTY_MEMBERSHIP
+    if not hasattr(request, '_membership'):
+        request._membership = await aload_membership(request.user.id)
+    return request._membership
+
+
+def invalidate_membership(user_id):
+    membership_cache().delete(membership_key(user_id))
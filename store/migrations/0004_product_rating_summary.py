@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:45
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_rating_summary(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Review = apps.get_model('store', 'Review')
+    histogram = {f'stars_{i}': Count('id', filter=Q(stars=i)) for i in range(1, 6)}
+    totals = (Review.objects.order_by().values('product_id')
+              .annotate(review_count=Count('id'), stars_sum=Sum('stars'), **histogram))
+    for row in totals:
+        Product.objects.filter(pk=row.pop('product_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_alter_cartitem_cart_alter_review_product_favorite_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rating_summary, migrations.RunPython.noop),
+    ]
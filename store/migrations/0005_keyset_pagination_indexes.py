@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_product_rating_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_date', 'id'], name='store_produ_created_a5565e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='store_produ_price_aba1d8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['subcategory', 'created_date', 'id'], name='store_produ_subcate_5396cb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['subcategory', 'price', 'id'], name='store_produ_subcate_c93f02_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['created_date', 'id'], name='store_revie_created_788286_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+import itertools
+import re
+
+from django.db import migrations
+
+LANGUAGES = ('en', 'ru')
+TOKENIZERS = {
+    'en': 'porter unicode61 remove_diacritics 2',
+    'ru': 'unicode61 remove_diacritics 2',
+}
+
+# A frozen copy of the tokenizer store.search used when this migration was written, so the
+# initial fill does not change with the app code; later rebuilds are `manage.py rebuild_search_index`.
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ией', 'ей', 'ой', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее',
+    'ие', 'ые', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ую', 'юю', 'ом', 'ем', 'ам', 'ям', 'ов',
+    'ев', 'ию', 'ью', 'ия', 'ья', 'ать', 'ять', 'ить', 'еть', 'ешь', 'ет', 'ют', 'ут', 'ит', 'ат',
+    'ят', 'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+
+
+def stem_ru(word):
+    word = word.replace('ё', 'е')
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text, language):
+    tokens = TOKEN_RE.findall((text or '').lower())
+    return ' '.join(stem_ru(token) for token in tokens) if language == 'ru' else ' '.join(tokens)
+
+
+def create_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for language in LANGUAGES:
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS store_product_fts_{language} '
+            f"USING fts5(product_name, description, tokenize='{TOKENIZERS[language]}')"
+        )
+    Product = apps.get_model('store', 'Product')
+    fields = ['id'] + [f'{field}_{language}' for field in ('product_name', 'description') for language in LANGUAGES]
+    rows = Product.objects.values(*fields).iterator(chunk_size=1000)
+    with schema_editor.connection.cursor() as cursor:
+        while chunk := list(itertools.islice(rows, 1000)):
+            for language in LANGUAGES:
+                cursor.executemany(
+                    f'INSERT INTO store_product_fts_{language} (rowid, product_name, description) VALUES (%s, %s, %s)',
+                    [(row['id'], tokenize(row[f'product_name_{language}'] or row['product_name_en'], language),
+                      tokenize(row[f'description_{language}'] or row['description_en'], language)) for row in chunk],
+                )
+
+
+def drop_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for language in LANGUAGES:
+        schema_editor.execute(f'DROP TABLE IF EXISTS store_product_fts_{language}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_tables, drop_search_tables),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_product_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'created_date', 'id'], name='store_revie_product_b7ed95_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'stars', 'id'], name='store_revie_product_66ab81_idx'),
+        ),
+    ]
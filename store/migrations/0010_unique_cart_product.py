@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:55
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+MAX_QUANTITY = 32767
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    CartItem = apps.get_model('store', 'CartItem')
+    duplicates = (CartItem.objects.order_by().values('cart_id', 'product_id')
+                  .annotate(lines=Count('id'), keep=Min('id'), quantity=Sum('quantity'))
+                  .filter(lines__gt=1))
+    for row in duplicates:
+        lines = CartItem.objects.filter(cart_id=row['cart_id'], product_id=row['product_id'])
+        lines.filter(pk=row['keep']).update(quantity=min(row['quantity'], MAX_QUANTITY))
+        lines.exclude(pk=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_product_review_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
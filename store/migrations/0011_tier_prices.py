@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+DISCOUNTS = {'gold': 75, 'silver': 50, 'bronze': 25}
+
+
+def fill_tier_prices(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    TierPrice = apps.get_model('store', 'TierPrice')
+    rows = []
+    for pk, price in Product.objects.values_list('pk', 'price').iterator(chunk_size=1000):
+        rows.extend(TierPrice(product_id=pk, status=status, price=(price * (100 - discount) + 50) // 100)
+                    for status, discount in DISCOUNTS.items())
+        if len(rows) >= 3000:
+            TierPrice.objects.bulk_create(rows)
+            rows = []
+    TierPrice.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_unique_cart_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TierPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('gold', 'gold'), ('silver', 'silver'), ('bronze', 'bronze'), ('simple', 'simple')], max_length=32)),
+                ('price', models.PositiveSmallIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tier_prices', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'price'], name='store_tierp_status_f2e1f6_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'status'), name='unique_product_status')],
+            },
+        ),
+        migrations.RunPython(fill_tier_prices, migrations.RunPython.noop),
+    ]
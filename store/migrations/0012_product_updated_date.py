@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_tier_prices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='updated_date',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_date', 'id'], name='store_produ_updated_bec03d_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:10
+
+from django.db import migrations
+from django.db.models import F
+
+
+def fill_created_date(apps, schema_editor):
+    # products from before 0002 have no created_date; the keyset pagination leaves NULL keys out
+    Product = apps.get_model('store', 'Product')
+    Product.objects.filter(created_date__isnull=True).update(created_date=F('updated_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_product_updated_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_created_date, migrations.RunPython.noop),
+    ]
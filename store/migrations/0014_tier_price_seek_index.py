@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_backfill_product_created_date'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='tierprice',
+            name='store_tierp_status_f2e1f6_idx',
+        ),
+        migrations.AddIndex(
+            model_name='tierprice',
+            index=models.Index(fields=['status', 'price', 'product'], name='store_tierp_status_b2d5a3_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:19
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_tier_price_seek_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField()),
+                ('deleted_date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['deleted_date', 'product_id'], name='store_delet_deleted_23d8f5_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_deleted_product'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='article_number',
+            field=models.PositiveIntegerField(unique=True),
+        ),
+    ]
@@ -1,6 +1,10 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import ExpressionWrapper, F, FilteredRelation, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
 
@@ -15,6 +19,7 @@ class UserProfile(AbstractUser):
         ('bronze', 'bronze'), #25%
         ('simple', 'simple') #0%
     )
+    DISCOUNTS = {'gold': 75, 'silver': 50, 'bronze': 25, 'simple': 0}
     status = models.CharField(max_length=32, choices=STATUS_CHOICE, default='simple')
     created_date = models.DateField(auto_now_add=True)
 
@@ -22,13 +27,32 @@ class UserProfile(AbstractUser):
         return f'{self.first_name}-{self.last_name}'
 
 
+def save_renaming(instance, field, products, save, *args, **kwargs):
+    # products embed their (sub)category names in the detail view and the export, so renaming
+    # one in any language touches them; saves that leave the names alone cost no extra query
+    names = [f'{field}_{code}' for code, name in settings.LANGUAGES]
+    update_fields = kwargs.get('update_fields')
+    if instance.pk is None or (update_fields is not None and not {field, *names} & set(update_fields)):
+        save(*args, **kwargs)
+        return
+    with transaction.atomic():
+        previous = type(instance).objects.filter(pk=instance.pk).values(*names).first()
+        save(*args, **kwargs)
+        if previous and any(previous[name] != getattr(instance, name) for name in names):
+            Product.touch(**{products: instance.pk})
+
+
 class Category(models.Model):
     category_image = models.ImageField(upload_to="category_image/")
     category_name = models.CharField(max_length=64, unique=True)
+    category_image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.category_name
 
+    def save(self, *args, **kwargs):
+        save_renaming(self, 'category_name', 'subcategory__category_id', super().save, *args, **kwargs)
+
 
 class SubCategory(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='sub_categories')
@@ -37,37 +61,176 @@ class SubCategory(models.Model):
     def __str__(self):
         return self.subcategory_name
 
+    def save(self, *args, **kwargs):
+        save_renaming(self, 'subcategory_name', 'subcategory_id', super().save, *args, **kwargs)
+
+
+def tier_price_alias(status, prefix=''):
+    # a join to the caller's TierPrice row through the (product, status) unique index;
+    # at most one row matches, so the join never multiplies the products
+    if not UserProfile.DISCOUNTS.get(status):
+        return {}
+    condition = Q(**{f'{prefix}tier_prices__status': status})
+    return {'tier_price': FilteredRelation(f'{prefix}tier_prices', condition=condition)}
+
+
+def effective_price(status, prefix=''):
+    # the precomputed tier price, or the list price itself for tiers without a discount;
+    # the queryset must carry tier_price_alias(status, prefix)
+    price = F(f'{prefix}price')
+    if not UserProfile.DISCOUNTS.get(status):
+        return price
+    return Coalesce(F('tier_price__price'), price)
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_effective_price(self, status):
+        # the catalog inner-joins the caller's TierPrice row (TierPrice.refresh keeps one per product and
+        # discounted tier), so ordering, seeking and price filters run on the (status, price, product)
+        # index; price_id breaks ties on the column the index carries
+        if not UserProfile.DISCOUNTS.get(status):
+            return self.annotate(effective_price=F('price'), price_id=F('id'))
+        return self.alias(**tier_price_alias(status)).filter(tier_price__isnull=False).annotate(
+            effective_price=F('tier_price__price'), price_id=F('tier_price__product_id'))
+
+
+RATING_FIELDS = ['review_count', 'stars_sum', 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5']
+
 
 class Product(models.Model):
     subcategory = models.ForeignKey(SubCategory, on_delete=models.CASCADE, related_name='products')
     product_name = models.CharField(max_length=56)
     price = models.PositiveSmallIntegerField()
-    article_number = models.PositiveSmallIntegerField(unique=True)
+    article_number = models.PositiveIntegerField(unique=True)
     description = models.TextField()
     image = models.ImageField(upload_to='image/')
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     video = models.FileField(upload_to='video/', null=True, blank=True)
     product_type = models.BooleanField(null=True, blank=True)
     created_date = models.DateTimeField(auto_now_add=True,  null=True, blank=True)
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    stars_sum = models.PositiveIntegerField(default=0, editable=False)
+    stars_1 = models.PositiveIntegerField(default=0, editable=False)
+    stars_2 = models.PositiveIntegerField(default=0, editable=False)
+    stars_3 = models.PositiveIntegerField(default=0, editable=False)
+    stars_4 = models.PositiveIntegerField(default=0, editable=False)
+    stars_5 = models.PositiveIntegerField(default=0, editable=False)
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # bumped together with version; the export's "since" cursor reads it
+    updated_date = models.DateTimeField(auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_date', 'id']),
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['subcategory', 'created_date', 'id']),
+            models.Index(fields=['subcategory', 'price', 'id']),
+            models.Index(fields=['updated_date', 'id']),
+        ]
 
     def __str__(self):
         return f'{self.product_name}-{self.price}'
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        # add_rating, touch and the image jobs bump the stored version; an update bumps that one
+        # rather than the copy in memory, so no two payloads share a number
+        self.version = (self.version or 0) + 1 if adding else F('version') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_date'}
+        elif not self._state.adding and not kwargs.get('force_insert'):
+            # the rating summary is kept in the database by add_rating; an instance loaded before a
+            # review changed would otherwise write its stale copy back
+            kwargs['update_fields'] = {
+                field.attname for field in self._meta.concrete_fields if not field.primary_key
+            } - self.get_deferred_fields() - set(RATING_FIELDS)
+        super().save(*args, **kwargs)
+        if not adding:
+            # deferred: read back from the database on first access
+            del self.version
+
     def avg_rating(self):
-        ratings = self.reviews.all()
-        if ratings.exists():
-           return round(sum([i.stars for i in ratings]) / ratings.count(), 1)
+        if self.review_count:
+            return round(self.stars_sum / self.review_count, 1)
         return 0
 
     def count_people(self):
-        ratings = self.reviews.all()
-        return ratings.count()
+        return self.review_count
+
+    def rating_histogram(self):
+        return {stars: getattr(self, f'stars_{stars}') for stars in range(1, 6)}
+
+    @staticmethod
+    def add_rating(product_id, stars, count=1):
+        # count=-1 removes a rating; the row is updated in place without reading it
+        Product.objects.filter(pk=product_id).update(
+            version=F('version') + 1,
+            updated_date=timezone.now(),
+            review_count=F('review_count') + count,
+            stars_sum=F('stars_sum') + count * stars,
+            **{f'stars_{stars}': F(f'stars_{stars}') + count},
+        )
+
+    @staticmethod
+    def touch(**lookup):
+        # invalidates the ETag of products whose nested data (images, ratings) changed
+        Product.objects.filter(**lookup).update(version=F('version') + 1, updated_date=timezone.now())
+
+
+class TierPrice(models.Model):
+    # one row per product and discounted status; 'simple' customers pay Product.price
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='tier_prices')
+    status = models.CharField(max_length=32, choices=UserProfile.STATUS_CHOICE)
+    price = models.PositiveSmallIntegerField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'status'], name='unique_product_status'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'price', 'product']),
+        ]
 
+    def __str__(self):
+        return f'{self.product_id}-{self.status}-{self.price}'
+
+    @staticmethod
+    def discounted(price, status):
+        return (price * (100 - UserProfile.DISCOUNTS.get(status, 0)) + 50) // 100
+
+    @staticmethod
+    def refresh(products):
+        # writes only the rows whose price differs; returns the ids of the products they belong to
+        current = {(product_id, status): price for product_id, status, price in TierPrice.objects.filter(
+            product_id__in=[product.pk for product in products]).values_list('product_id', 'status', 'price')}
+        rows = [TierPrice(product_id=product.pk, status=status, price=TierPrice.discounted(product.price, status))
+                for product in products for status, discount in UserProfile.DISCOUNTS.items() if discount]
+        rows = [row for row in rows if current.get((row.product_id, row.status)) != row.price]
+        TierPrice.objects.bulk_create(rows, update_conflicts=True, unique_fields=['product', 'status'],
+                                      update_fields=['price'])
+        return {row.product_id for row in rows}
+
+
+class DeletedProduct(models.Model):
+    # tombstones for the incremental export: a since= run cannot see rows that no longer exist
+    product_id = models.BigIntegerField()
+    deleted_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_date', 'product_id']),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}-{self.deleted_date}'
 
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='product_image')
     image = models.ImageField(upload_to='image/')
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
 
 class Review(models.Model):
@@ -77,18 +240,119 @@ class Review(models.Model):
     stars = models.PositiveIntegerField(choices=[(i, str(i)) for i in range(1, 6)])
     created_date = models.DateField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_date', 'id']),
+            models.Index(fields=['product', 'created_date', 'id']),
+            models.Index(fields=['product', 'stars', 'id']),
+        ]
+
     def __str__(self):
         return f'{self.comment}-{self.stars}'
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Review.objects.filter(pk=self.pk).values('product_id', 'stars').first()
+            super().save(*args, **kwargs)
+            current = {'product_id': self.product_id, 'stars': self.stars}
+            if previous != current:
+                if previous:
+                    Product.add_rating(previous['product_id'], previous['stars'], -1)
+                Product.add_rating(self.product_id, self.stars)
+            else:
+                # product detail embeds the latest reviews, so a comment edit must change its ETag too
+                Product.touch(pk=self.product_id)
+
+
+def line_total(prefix='', status='simple'):
+    return ExpressionWrapper(F(f'{prefix}quantity') * effective_price(status, f'{prefix}product__'),
+                             output_field=models.PositiveIntegerField())
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self, status='simple'):
+        return self.alias(**tier_price_alias(status, 'items__product__')).annotate(
+            total_price=Coalesce(Sum(line_total('items__', status)), Value(0)))
+
 
 class Cart(models.Model):
     user = models.OneToOneField(UserProfile, on_delete=models.CASCADE)
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.user}'
 
-    def get_total_price(self):
-        return sum([i.get_total_price() for i in self.items.all()])
+    def get_total_price(self, status='simple'):
+        if 'total_price' in self.__dict__:
+            return self.total_price
+        return self.items.with_totals(status).aggregate(total=Coalesce(Sum('line_total'), Value(0)))['total']
+
+    def apply_operations(self, operations):
+        # operations: dicts with op ('add', 'set', 'remove'), product_id and quantity;
+        # they are folded in memory and written with at most three statements
+        product_ids = {operation['product_id'] for operation in operations}
+        with transaction.atomic():
+            items = {item.product_id: item
+                     for item in self.items.select_for_update().filter(product_id__in=product_ids)}
+            quantities = {product_id: item.quantity for product_id, item in items.items()}
+            for operation in operations:
+                product_id = operation['product_id']
+                if operation['op'] == 'add':
+                    quantities[product_id] = quantities.get(product_id, 0) + operation.get('quantity', 1)
+                elif operation['op'] == 'set':
+                    quantities[product_id] = operation['quantity']
+                else:
+                    quantities[product_id] = 0
+
+            created, updated, deleted = [], [], []
+            for product_id, quantity in quantities.items():
+                quantity = min(quantity, CartItem.MAX_QUANTITY)
+                item = items.get(product_id)
+                if quantity <= 0:
+                    if item is not None:
+                        deleted.append(item.pk)
+                elif item is None:
+                    created.append(CartItem(cart=self, product_id=product_id, quantity=quantity))
+                elif item.quantity != quantity:
+                    item.quantity = quantity
+                    updated.append(item)
+            # a line inserted concurrently since the read above is overwritten, not duplicated
+            CartItem.objects.bulk_create(created, update_conflicts=True,
+                                         unique_fields=['cart', 'product'], update_fields=['quantity'])
+            CartItem.objects.bulk_update(updated, ['quantity'])
+            CartItem.objects.filter(pk__in=deleted).delete()
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self, status='simple'):
+        return self.alias(**tier_price_alias(status, 'product__')).annotate(line_total=line_total(status=status))
+
+    def add_quantity(self, cart_id, product_id, quantity=1):
+        # a single upsert statement: concurrent adds merge into one line and never lose an increment
+        connection = connections[self.db]
+        if connection.vendor in ('sqlite', 'postgresql'):
+            table = connection.ops.quote_name(self.model._meta.db_table)
+            merged = f'{table}.quantity + EXCLUDED.quantity'
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES (%s, %s, %s) '
+                    f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = '
+                    f'CASE WHEN {merged} > %s THEN %s ELSE {merged} END RETURNING id',
+                    [cart_id, product_id, quantity, CartItem.MAX_QUANTITY, CartItem.MAX_QUANTITY],
+                )
+                return cursor.fetchone()[0]
+
+        lookup = {'cart_id': cart_id, 'product_id': product_id}
+        if not self.filter(**lookup).update(quantity=F('quantity') + quantity):
+            try:
+                with transaction.atomic(using=self.db):
+                    return self.create(quantity=quantity, **lookup).pk
+            except IntegrityError:
+                self.filter(**lookup).update(quantity=F('quantity') + quantity)
+        return self.filter(**lookup).values_list('pk', flat=True).get()
 
 
 class CartItem(models.Model):
@@ -96,11 +360,27 @@ class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     quantity = models.PositiveSmallIntegerField(default=1)
 
+    objects = CartItemQuerySet.as_manager()
+
+    MAX_QUANTITY = 32767
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     def __str__(self):
         return f'{self.product}, {self.quantity}'
 
-    def get_total_price(self):
-        return self.quantity * self.product.price
+    def save(self, *args, **kwargs):
+        # a total computed by the query that loaded this row is stale once it is written
+        self.__dict__.pop('line_total', None)
+        super().save(*args, **kwargs)
+
+    def get_total_price(self, status='simple'):
+        if 'line_total' in self.__dict__:
+            return self.line_total
+        return self.quantity * TierPrice.discounted(self.product.price, status)
 
 
 class Favorite(models.Model):
@@ -0,0 +1,197 @@
+import base64
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Seek pagination: every page is "WHERE (key) > (cursor) ORDER BY key LIMIT n",
+    # so deep pages cost the same as the first one and no COUNT(*) is issued.
+    # Every ordering must end with a unique column so the key is strict.
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    orderings = {'newest': ('-created_date', '-id')}
+    default_ordering = 'newest'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.get_page(list(self.get_page_queryset(queryset, request)))
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering_name = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        if self.ordering_name not in self.orderings:
+            self.ordering_name = self.default_ordering
+        fields = self.ordering_fields(queryset)
+        self.cursor = self.decode_cursor(request, fields)
+
+        ordering = self.get_ordering()
+        # a NULL key cannot be compared, so rows with one (legacy products without created_date) are left out
+        queryset = queryset.filter(**{f'{name.lstrip("-")}__isnull': False
+                                      for name, field in zip(ordering, fields) if field.null})
+        if self.cursor is not None:
+            key, reverse = self.cursor
+            queryset = queryset.filter(self.seek_filter(key, reverse))
+            if reverse:
+                ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in ordering]
+        return queryset.order_by(*ordering)[:self.page_size + 1]
+
+    def get_page(self, rows):
+        reverse = self.cursor is not None and self.cursor[1]
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self):
+        return self.orderings[self.ordering_name]
+
+    def ordering_fields(self, queryset):
+        # the model field, or the annotation's output field, behind each column of the ordering
+        fields = []
+        for name in self.get_ordering():
+            annotation = queryset.query.annotations.get(name.lstrip('-'))
+            fields.append(annotation.output_field if annotation is not None
+                          else queryset.model._meta.get_field(name.lstrip('-')))
+        return fields
+
+    def seek_filter(self, key, reverse=False):
+        condition = Q()
+        equal = Q()
+        for name, value in zip(self.get_ordering(), key):
+            descending = name.startswith('-')
+            field = name.lstrip('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def get_key(self, row):
+        return [getattr(row, name.lstrip('-')) for name in self.get_ordering()]
+
+    def encode_cursor(self, row, reverse=False):
+        payload = {'o': self.ordering_name, 'k': self.get_key(row), 'r': reverse}
+        data = json.dumps(payload, default=self.encode_value, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    @staticmethod
+    def encode_value(value):
+        # full precision: DjangoJSONEncoder would cut datetimes to milliseconds
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        return str(value)
+
+    def decode_cursor(self, request, fields):
+        # every key value is parsed by its column's field, so nothing malformed reaches the query
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            key, reverse = payload['k'], payload['r']
+            if (payload['o'] != self.ordering_name or not isinstance(key, list) or len(key) != len(fields)
+                    or not isinstance(reverse, bool)):
+                raise NotFound(self.invalid_cursor_message)
+            key = [self.decode_value(field, value) for field, value in zip(fields, key)]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return key, reverse
+
+    @staticmethod
+    def decode_value(field, value):
+        if value is None or isinstance(value, (bool, list, dict)):
+            raise ValueError(f'invalid key {value!r}')
+        value = field.to_python(value)
+        if value is None:
+            raise ValueError('invalid key')
+        return value
+
+    def get_link(self, row, reverse=False):
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(row, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.get_link(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.get_link(self.page[0], reverse=True)
+
+    def get_link_after(self, request, url, row, ordering=None):
+        # next-page link for a first page that was loaded outside the paginator (e.g. a prefetch)
+        self.base_url = request.build_absolute_uri(url) if request else url
+        self.ordering_name = ordering or self.default_ordering
+        return self.get_link(row)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class ProductPagination(KeysetPagination):
+    orderings = {
+        'newest': ('-created_date', '-id'),
+        # effective_price is the caller's tier price and price_id the product id read from the same
+        # row (ProductQuerySet.with_effective_price)
+        'price': ('effective_price', 'price_id'),
+        '-price': ('-effective_price', '-price_id'),
+    }
+
+
+class ReviewPagination(KeysetPagination):
+    orderings = {'newest': ('-created_date', '-id')}
+
+
+class ProductReviewPagination(KeysetPagination):
+    orderings = {
+        'newest': ('-created_date', '-id'),
+        'stars': ('stars', 'id'),
+        '-stars': ('-stars', '-id'),
+    }
+
+
+class ProductImagePagination(KeysetPagination):
+    orderings = {'id': ('id',)}
+    default_ordering = 'id'
@@ -0,0 +1,29 @@
+from .models import Product, TierPrice
+
+
+def request_status(request):
+    # anonymous callers and tokens issued before the status claim pay the list price
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return 'simple'
+    return getattr(user, 'status', None) or 'simple'
+
+
+def refresh_tier_prices(products):
+    # a changed tier price changes what the product costs, so its ETag and export cursor move too
+    changed = TierPrice.refresh(products)
+    if changed:
+        Product.touch(pk__in=changed)
+
+
+def rebuild_tier_prices(batch_size=1000):
+    count = 0
+    batch = []
+    for product in Product.objects.only('id', 'price').iterator(chunk_size=batch_size):
+        batch.append(product)
+        if len(batch) >= batch_size:
+            refresh_tier_prices(batch)
+            count += len(batch)
+            batch = []
+    refresh_tier_prices(batch)
+    return count + len(batch)
@@ -0,0 +1,36 @@
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+from .models import RATING_FIELDS, Product, Review
+
+
+def review_totals():
+    histogram = {f'stars_{i}': Count('id', filter=Q(stars=i)) for i in range(1, 6)}
+    return (Review.objects.order_by().values('product_id')
+            .annotate(review_count=Count('id'), stars_sum=Sum('stars'), **histogram))
+
+
+def rebuild_ratings(batch_size=500):
+    totals = {row.pop('product_id'): row for row in review_totals()}
+    empty = dict.fromkeys(RATING_FIELDS, 0)
+    changed = 0
+    with transaction.atomic():
+        batch = []
+        products = Product.objects.select_for_update().only('id', 'version', *RATING_FIELDS)
+        for product in products.iterator(chunk_size=batch_size):
+            values = totals.get(product.id, empty)
+            if all(getattr(product, field) == values[field] for field in RATING_FIELDS):
+                continue
+            for field in RATING_FIELDS:
+                setattr(product, field, values[field])
+            product.version = F('version') + 1
+            product.updated_date = timezone.now()
+            batch.append(product)
+            if len(batch) >= batch_size:
+                Product.objects.bulk_update(batch, RATING_FIELDS + ['version', 'updated_date'])
+                changed += len(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_update(batch, RATING_FIELDS + ['version', 'updated_date'])
+            changed += len(batch)
+    return changed
@@ -0,0 +1,154 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ией', 'ей', 'ой', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее',
+    'ие', 'ые', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ую', 'юю', 'ом', 'ем', 'ам', 'ям', 'ов',
+    'ев', 'ию', 'ью', 'ия', 'ья', 'ать', 'ять', 'ить', 'еть', 'ешь', 'ет', 'ют', 'ут', 'ит', 'ат',
+    'ят', 'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+
+
+def stem_ru(word):
+    # light suffix stripping; FTS5 ships no Russian stemmer
+    word = word.replace('ё', 'е')
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+STEMMERS = {
+    'ru': stem_ru,
+}
+
+
+def tokenize(text, language):
+    stem = STEMMERS.get(language)
+    tokens = TOKEN_RE.findall((text or '').lower())
+    return [stem(token) for token in tokens] if stem else tokens
+
+
+def translated_text(product, field, language):
+    return getattr(product, f'{field}_{language}', None) or getattr(product, f'{field}_{settings.MODELTRANSLATION_DEFAULT_LANGUAGE}', None) or ''
+
+
+class SearchBackend:
+    languages = [code for code, name in settings.LANGUAGES]
+
+    def index_products(self, products):
+        pass
+
+    def remove_products(self, product_ids):
+        pass
+
+    def rebuild(self, chunk_size=1000, queryset=None):
+        pass
+
+    def search(self, query, language, limit=20, candidates=None):
+        # candidates: an optional product queryset (e.g. the filtered listing) the hits must belong to
+        raise NotImplementedError
+
+
+class SimpleSearchBackend(SearchBackend):
+    # fallback for databases without a full-text engine: an unindexed LIKE scan
+    def search(self, query, language, limit=20, candidates=None):
+        terms = TOKEN_RE.findall(query)
+        if not terms:
+            return []
+        condition = Q()
+        for term in terms:
+            condition &= (Q(**{f'product_name_{language}__icontains': term})
+                          | Q(**{f'description_{language}__icontains': term}))
+        queryset = Product.objects.all() if candidates is None else candidates
+        return list(queryset.filter(condition).order_by('-created_date', '-id')
+                    .values_list('id', flat=True)[:limit])
+
+
+class SQLiteFTS5Backend(SearchBackend):
+    # one FTS5 table per language, rowid = product id; columns are weighted for bm25()
+    table_template = 'store_product_fts_{language}'
+    weights = (10.0, 1.0)
+
+    def table(self, language):
+        return self.table_template.format(language=language)
+
+    def rows(self, products, language):
+        for product in products:
+            yield (
+                product.pk,
+                ' '.join(tokenize(translated_text(product, 'product_name', language), language)),
+                ' '.join(tokenize(translated_text(product, 'description', language), language)),
+            )
+
+    def index_products(self, products):
+        products = list(products)
+        if not products:
+            return
+        self.remove_products([product.pk for product in products])
+        with connection.cursor() as cursor:
+            for language in self.languages:
+                cursor.executemany(
+                    f'INSERT INTO {self.table(language)} (rowid, product_name, description) VALUES (%s, %s, %s)',
+                    list(self.rows(products, language)),
+                )
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            for language in self.languages:
+                cursor.execute(f'DELETE FROM {self.table(language)} WHERE rowid IN ({placeholders})', product_ids)
+
+    def rebuild(self, chunk_size=1000, queryset=None):
+        with connection.cursor() as cursor:
+            for language in self.languages:
+                cursor.execute(f'DELETE FROM {self.table(language)}')
+        fields = ['id'] + [f'{field}_{language}' for field in ('product_name', 'description') for language in self.languages]
+        queryset = Product.objects.all() if queryset is None else queryset
+        chunk = []
+        for product in queryset.only(*fields).iterator(chunk_size=chunk_size):
+            chunk.append(product)
+            if len(chunk) >= chunk_size:
+                self.index_products(chunk)
+                chunk = []
+        self.index_products(chunk)
+
+    def match_expression(self, query, language):
+        # every term must match, each as a prefix so half-typed words autocomplete
+        terms = tokenize(query, language)
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def search(self, query, language, limit=20, candidates=None):
+        expression = self.match_expression(query, language)
+        if not expression:
+            return []
+        table = self.table(language)
+        rank = f'bm25({table}, {", ".join(str(weight) for weight in self.weights)})'
+        condition, params = '', []
+        if candidates is not None:
+            # the filters run inside the ranked query, so LIMIT counts only products that pass them
+            subquery, params = candidates.order_by().values('pk').query.sql_with_params()
+            condition, params = f' AND rowid IN ({subquery})', list(params)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {table} WHERE {table} MATCH %s{condition} ORDER BY {rank} LIMIT %s',
+                [expression, *params, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    return import_string(settings.PRODUCT_SEARCH_BACKEND)()
@@ -1,15 +1,39 @@
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch
 from rest_framework import serializers
-from .models import (UserProfile, Cart, Category, SubCategory,
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .models import (UserProfile, Cart, Category, SubCategory, TierPrice,
                      Product, Review, ProductImage, CartItem, FavoriteItem, Favorite)
-from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import StoreRefreshToken, user_cache
 from django.contrib.auth import authenticate
-
-
-class UserSerializer(serializers.ModelSerializer):
+from django.urls import reverse
+from .pagination import ProductPagination, ProductReviewPagination
+from .instrumentation import TimedModelSerializer, TimedSerializer
+from .membership import get_membership
+from .pricing import request_status
+
+
+class SrcsetField(serializers.ReadOnlyField):
+    def to_representation(self, value):
+        request = self.context.get('request')
+        srcset = {}
+        for fmt, entries in (value or {}).get('formats', {}).items():
+            urls = [default_storage.url(path) for path, width in entries]
+            if request is not None:
+                urls = [request.build_absolute_uri(url) for url in urls]
+            srcset[fmt] = ', '.join(f'{url} {width}w' for url, (path, width) in zip(urls, entries))
+        return srcset
+
+
+class UserSerializer(TimedModelSerializer):
     class Meta:
         model = UserProfile
         fields = ['username', 'email', 'password', 'first_name', 'last_name', 'age',
                   'phone_number', 'status']
+        # the loyalty tier prices the whole catalog; only staff change it, through the admin
+        read_only_fields = ['status']
         extra_kwargs = {'password': {'write_only': True}}
 
     def create(self, validated_data):
@@ -17,7 +41,7 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class LoginSerializer(serializers.Serializer):
+class LoginSerializer(TimedSerializer):
     username = serializers.CharField()
     password = serializers.CharField(write_only=True)
 
@@ -28,7 +52,7 @@ class LoginSerializer(serializers.Serializer):
         raise serializers.ValidationError("Неверные учетные данные")
 
     def to_representation(self, instance):
-        refresh = RefreshToken.for_user(instance)
+        refresh = StoreRefreshToken.for_user(instance)
         return {
             'user': {
                 'username': instance.username,
@@ -39,52 +63,119 @@ class LoginSerializer(serializers.Serializer):
         }
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class TokenRefreshSerializer(TimedSerializer):
+    refresh = serializers.CharField()
+    access = serializers.CharField(read_only=True)
+
+    def validate(self, attrs):
+        try:
+            refresh = StoreRefreshToken(attrs['refresh'])
+        except TokenError as error:
+            raise InvalidToken(error.args[0])
+        user = user_cache.get(int(refresh[api_settings.USER_ID_CLAIM]))
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed('Учетная запись не найдена или отключена', 'no_active_account')
+
+        # claims are re-read from the user, so a status change reaches the next access token
+        access = refresh.access_token
+        access['username'] = user.username
+        access['status'] = user.status
+        access['is_staff'] = user.is_staff
+        data = {'access': str(access)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh'] = str(refresh)
+        return data
+
+
+class UserProfileSerializer(TimedModelSerializer):
     class Meta:
         model = UserProfile
-        fields = '__all__'
+        # no password or permission flags: is_staff and is_superuser reach the export and the admin
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'age', 'phone_number', 'status',
+                  'created_date']
+        read_only_fields = ['status']
 
 
-class UserProfileReviewSerializer(serializers.ModelSerializer):
+class UserProfileReviewSerializer(TimedModelSerializer):
     class Meta:
         model = UserProfile
         fields = ['first_name']
 
 
-class CategoryListSerializer(serializers.ModelSerializer):
+class CategoryListSerializer(TimedModelSerializer):
+    srcset = SrcsetField(source='category_image_derivatives')
+
     class Meta:
         model = Category
-        fields = ['id','category_image', 'category_name']
+        fields = ['id','category_image', 'srcset', 'category_name']
 
+    @staticmethod
+    def query_plan(queryset):
+        return queryset.only('id', 'category_image', 'category_image_derivatives', 'category_name')
 
-class SubCategoryListSerializer(serializers.ModelSerializer):
+
+class SubCategoryListSerializer(TimedModelSerializer):
     class Meta:
         model = SubCategory
         fields = ['id', 'subcategory_name']
 
+    @staticmethod
+    def query_plan(queryset):
+        return queryset.only('id', 'subcategory_name', 'category')
+
 
-class CategoryDetailSerializer(serializers.ModelSerializer):
+class CategoryDetailSerializer(TimedModelSerializer):
     sub_categories = SubCategoryListSerializer(many=True, read_only=True)
 
     class Meta:
         model = Category
         fields = ['category_name', 'sub_categories']
 
+    @staticmethod
+    def query_plan(queryset):
+        return queryset.only('id', 'category_name').prefetch_related(
+            Prefetch('sub_categories', queryset=SubCategoryListSerializer.query_plan(SubCategory.objects.all())),
+        )
+
+
+class ProductImageSerializer(TimedModelSerializer):
+    srcset = SrcsetField(source='image_derivatives')
 
-class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
-        fields = ['image']
+        fields = ['image', 'srcset']
+
+    @staticmethod
+    def query_plan(queryset):
+        return queryset.only('id', 'product', 'image', 'image_derivatives')
+
 
+def get_effective_price(product, request):
+    # annotated by the views; products nested elsewhere get the same rounding in Python
+    if 'effective_price' in product.__dict__:
+        return product.effective_price
+    return TierPrice.discounted(product.price, request_status(request))
 
-class ProductListSerializer(serializers.ModelSerializer):
+
+class ProductListSerializer(TimedModelSerializer):
     product_image = ProductImageSerializer(many=True, read_only=True)
     avg_rating = serializers.SerializerMethodField()
     count_people = serializers.SerializerMethodField()
+    effective_price = serializers.SerializerMethodField()
+    is_favorite = serializers.SerializerMethodField()
+    in_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['id', 'product_name', 'price', 'product_image', 'product_type', 'avg_rating', 'count_people']
+        fields = ['id', 'product_name', 'price', 'effective_price', 'product_image', 'product_type', 'avg_rating',
+                  'count_people', 'is_favorite', 'in_cart']
 
     def avg_rating(self, obj):
         return obj.avg_rating()
@@ -92,37 +183,86 @@ class ProductListSerializer(serializers.ModelSerializer):
     def count_people(self, obj):
         return obj.count_people()
 
+    def get_effective_price(self, obj):
+        return get_effective_price(obj, self.context.get('request'))
+
+    def get_is_favorite(self, obj):
+        return obj.pk in get_membership(self.context.get('request'))['favorites']
+
+    def get_in_cart(self, obj):
+        return obj.pk in get_membership(self.context.get('request'))['cart']
+
+    @staticmethod
+    def query_plan(queryset):
+        return queryset.only(
+            'id', 'subcategory', 'product_name', 'price', 'product_type', 'created_date',
+            'review_count', 'stars_sum',
+        ).prefetch_related(
+            Prefetch('product_image', queryset=ProductImageSerializer.query_plan(ProductImage.objects.all())),
+        )
 
-class SubCategoryDetailSerializer(serializers.ModelSerializer):
-    products = ProductListSerializer(many=True, read_only=True)
+
+class SubCategoryDetailSerializer(TimedModelSerializer):
+    products = serializers.SerializerMethodField()
+    next_products = serializers.SerializerMethodField()
 
     class Meta:
         model = SubCategory
-        fields = ['subcategory_name', 'products']
+        fields = ['subcategory_name', 'products', 'next_products']
+
+    def get_products(self, obj):
+        products = obj.first_products[:ProductPagination.page_size]
+        return ProductListSerializer(products, many=True, context=self.context).data
+
+    def get_next_products(self, obj):
+        if len(obj.first_products) <= ProductPagination.page_size:
+            return None
+        url = f"{reverse('product_list')}?subcategory={obj.pk}"
+        last = obj.first_products[ProductPagination.page_size - 1]
+        return ProductPagination().get_link_after(self.context.get('request'), url, last)
+
+    @staticmethod
+    def query_plan(queryset):
+        products = Product.objects.order_by(*ProductPagination.orderings[ProductPagination.default_ordering])
+        return queryset.only('id', 'subcategory_name').prefetch_related(
+            Prefetch('products', to_attr='first_products',
+                     queryset=ProductListSerializer.query_plan(products)[:ProductPagination.page_size + 1]),
+        )
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(TimedModelSerializer):
     created_date = serializers.DateField(format('%d-%m-%Y'))
     user = UserProfileReviewSerializer()
     class Meta:
         model = Review
         fields = ['id', 'user', 'comment', 'stars', 'created_date']
 
+    @staticmethod
+    def query_plan(queryset):
+        return queryset.select_related('user').only(
+            'id', 'product', 'comment', 'stars', 'created_date', 'user', 'user__first_name',
+        )
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+
+class ProductDetailSerializer(TimedModelSerializer):
     product_image = ProductImageSerializer(many=True, read_only=True)
     subcategory = SubCategoryListSerializer()
     created_date = serializers.DateTimeField(format='%d-%m-%Y %H:%M')
-    reviews = ReviewSerializer(many=True, read_only=True)
+    reviews = ReviewSerializer(many=True, read_only=True, source='latest_reviews')
+    reviews_url = serializers.SerializerMethodField()
+    rating = serializers.SerializerMethodField()
     avg_rating = serializers.SerializerMethodField()
     count_people = serializers.SerializerMethodField()
+    effective_price = serializers.SerializerMethodField()
+    review_preview_size = 3
 
 
     class Meta:
         model = Product
-        fields = ['product_name', 'subcategory', 'price', 'article_number',
+        fields = ['product_name', 'subcategory', 'price', 'effective_price', 'article_number',
                   'description', 'product_image', 'video', 'image',
-                  'product_type', 'created_date', 'reviews', 'avg_rating', 'count_people']
+                  'product_type', 'created_date', 'reviews', 'reviews_url', 'rating',
+                  'avg_rating', 'count_people']
 
     def avg_rating(self, obj):
         return obj.avg_rating()
@@ -130,9 +270,37 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     def count_people(self, obj):
         return obj.count_people()
 
+    def get_effective_price(self, obj):
+        return get_effective_price(obj, self.context.get('request'))
+
+    def get_reviews_url(self, obj):
+        url = reverse('product_reviews', kwargs={'pk': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_rating(self, obj):
+        return {
+            'avg': obj.avg_rating(),
+            'count': obj.count_people(),
+            'histogram': obj.rating_histogram(),
+        }
+
+    @classmethod
+    def query_plan(cls, queryset):
+        reviews = Review.objects.order_by(*ProductReviewPagination.orderings[ProductReviewPagination.default_ordering])
+        return queryset.select_related('subcategory').only(
+            'id', 'product_name', 'subcategory', 'subcategory__subcategory_name', 'price', 'article_number',
+            'description', 'video', 'image', 'product_type', 'created_date', 'review_count', 'stars_sum',
+            'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5',
+        ).prefetch_related(
+            Prefetch('product_image', queryset=ProductImageSerializer.query_plan(ProductImage.objects.all())),
+            Prefetch('reviews', to_attr='latest_reviews',
+                     queryset=ReviewSerializer.query_plan(reviews)[:cls.review_preview_size]),
+        )
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+
+class CartItemSerializer(TimedModelSerializer):
     product = ProductListSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(),
                                                     write_only=True,
@@ -144,10 +312,15 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'product_id', 'quantity', 'total_price']
 
     def get_total_price(self, obj):
-        return obj.get_total_price()
+        return obj.get_total_price(request_status(self.context.get('request')))
+
+    @staticmethod
+    def query_plan(queryset, status='simple'):
+        products = ProductListSerializer.query_plan(Product.objects.with_effective_price(status))
+        return queryset.with_totals(status).prefetch_related(Prefetch('product', queryset=products))
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(TimedModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
 
@@ -156,10 +329,34 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'items', 'total_price']
 
     def get_total_price(self, obj):
-        return obj.get_total_price()
+        return obj.get_total_price(request_status(self.context.get('request')))
 
+    @staticmethod
+    def query_plan(queryset, status='simple'):
+        return queryset.with_totals(status).prefetch_related(
+            Prefetch('items', queryset=CartItemSerializer.query_plan(CartItem.objects.all(), status)),
+        )
 
-class FavoriteItemSerializer(serializers.ModelSerializer):
+
+class CartOperationSerializer(TimedSerializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0, max_value=CartItem.MAX_QUANTITY, default=1)
+
+
+class CartBatchSerializer(TimedSerializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_operations(self, operations):
+        product_ids = {operation['product_id'] for operation in operations}
+        existing = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        missing = sorted(product_ids - existing)
+        if missing:
+            raise serializers.ValidationError(f'Товары не найдены: {missing}')
+        return operations
+
+
+class FavoriteItemSerializer(TimedModelSerializer):
     product = ProductListSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(),
                                                     write_only=True,
@@ -169,15 +366,24 @@ class FavoriteItemSerializer(serializers.ModelSerializer):
         model = FavoriteItem
         fields = ['id', 'product', 'product_id', ]
 
+    @staticmethod
+    def query_plan(queryset, status='simple'):
+        products = ProductListSerializer.query_plan(Product.objects.with_effective_price(status))
+        return queryset.prefetch_related(Prefetch('product', queryset=products))
 
 
-
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(TimedModelSerializer):
     favorites = FavoriteItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = Favorite
         fields = ['id', 'user', 'favorites']
 
+    @staticmethod
+    def query_plan(queryset, status='simple'):
+        return queryset.prefetch_related(
+            Prefetch('favorites', queryset=FavoriteItemSerializer.query_plan(FavoriteItem.objects.all(), status)),
+        )
+
 
 
@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import bump_catalog_version
+from .authentication import user_cache
+from .images import schedule_derivatives
+from .instrumentation import install_query_recorder
+from .models import Category, SubCategory, Product, DeletedProduct, ProductImage, Review, TierPrice, UserProfile
+from .search import get_search_backend
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    Product.add_rating(instance.product_id, instance.stars, -1)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=SubCategory)
+def catalog_changed(sender, **kwargs):
+    # after commit: a read between the bump and the commit would cache the old tree under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, update_fields=None, **kwargs):
+    get_search_backend().index_products([instance])
+    if update_fields is None or 'price' in update_fields:
+        TierPrice.refresh([instance])
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+    DeletedProduct.objects.create(product_id=instance.pk)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, **kwargs):
+    Product.touch(pk=instance.product_id)
+
+
+@receiver(post_save, sender=Category)
+def category_image_saved(sender, instance, **kwargs):
+    schedule_derivatives(instance, 'category_image')
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def product_image_saved(sender, instance, **kwargs):
+    schedule_derivatives(instance, 'image')
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def user_changed(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # every connection, on every alias, reports its queries to the request being served
+    install_query_recorder(connection)
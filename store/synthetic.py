@@ -0,0 +1,134 @@
+import datetime
+import random
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import translation
+
+from .cache import bump_catalog_version
+from .models import (Cart, CartItem, Category, Favorite, FavoriteItem, Product, ProductImage, Review, SubCategory,
+                     TierPrice, UserProfile)
+from .search import get_search_backend
+
+# Seeded synthetic data for benchmarks: the same arguments always produce the same catalog.
+SYNTHETIC_PASSWORD = 'benchmark-password'
+SYNTHETIC_USER = 'user0'
+
+ADJECTIVES = [('Classic', 'Классический'), ('Light', 'Легкий'), ('Warm', 'Теплый'), ('Compact', 'Компактный'),
+              ('Smart', 'Умный'), ('Soft', 'Мягкий'), ('Sport', 'Спортивный'), ('Wireless', 'Беспроводной')]
+NOUNS = [('jacket', 'пиджак'), ('kettle', 'чайник'), ('backpack', 'рюкзак'), ('lamp', 'светильник'),
+         ('speaker', 'динамик'), ('sweater', 'свитер'), ('blender', 'блендер'), ('watch', 'будильник')]
+COMMENTS = ['Great quality', 'Fits as expected', 'Arrived quickly', 'Not worth the price',
+            'Exactly as in the picture', 'Would buy again', 'Average', 'Отличный товар', 'Не понравился']
+# share of reviews with 1..5 stars, and of users per status
+STAR_WEIGHTS = [5, 5, 10, 25, 55]
+STATUS_WEIGHTS = {'simple': 70, 'bronze': 15, 'silver': 10, 'gold': 5}
+
+
+def review_count(rng, mean):
+    # long-tailed like real shops: most products have a few reviews, some have many
+    if not mean:
+        return 0
+    return min(int(rng.expovariate(1 / mean)), mean * 20)
+
+
+def insert_rows(model, columns, rows):
+    # plain executemany for the biggest tables; building model instances costs more than the insert
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = ', '.join(connection.ops.quote_name(column) for column in columns)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {table} ({names}) VALUES ({", ".join(["%s"] * len(columns))})', rows)
+    return len(rows)
+
+
+def generate_catalog(products=1000, users=100, categories=10, subcategories=10, reviews=8, images=3,
+                     cart_items=5, favorites=5, seed=1, batch_size=1000, progress=None):
+    rng = random.Random(seed)
+    default = settings.MODELTRANSLATION_DEFAULT_LANGUAGE
+    counts = dict.fromkeys(['users', 'categories', 'subcategories', 'products', 'reviews', 'images',
+                            'cart_items', 'favorites'], 0)
+
+    with translation.override(default):
+        password = make_password(SYNTHETIC_PASSWORD)
+        user_ids = []
+        for start in range(0, users, batch_size):
+            # SYNTHETIC_USER (user0) is staff, so the benchmark can run the staff-only export
+            batch = [UserProfile(username=f'user{index}', password=password, first_name=f'User{index}',
+                                 phone_number=f'+996555{index % 1000000:06d}', is_staff=index == 0,
+                                 status=rng.choices(list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values()))[0])
+                     for index in range(start, min(start + batch_size, users))]
+            user_ids += [user.pk for user in UserProfile.objects.bulk_create(batch)]
+        counts['users'] = len(user_ids)
+
+        # bulk_create skips the post_save handlers: there are no image files to build derivatives from
+        category_list = Category.objects.bulk_create([
+            Category(category_name_en=f'Category {index}', category_name_ru=f'Категория {index}',
+                     category_image=f'category_image/synthetic-{index % 5}.jpg')
+            for index in range(categories)
+        ])
+        subcategory_ids = [subcategory.pk for subcategory in SubCategory.objects.bulk_create([
+            SubCategory(category=category, subcategory_name_en=f'Subcategory {index}.{number}',
+                        subcategory_name_ru=f'Подкатегория {index}.{number}')
+            for index, category in enumerate(category_list) for number in range(subcategories)
+        ])]
+        counts['categories'], counts['subcategories'] = categories, len(subcategory_ids)
+
+        product_ids = []
+        today = datetime.date.today()
+        backend = get_search_backend()
+        for start in range(0, products, batch_size):
+            batch, stars = [], []
+            for index in range(start, min(start + batch_size, products)):
+                (adjective_en, adjective_ru), (noun_en, noun_ru) = rng.choice(ADJECTIVES), rng.choice(NOUNS)
+                ratings = rng.choices(range(1, 6), STAR_WEIGHTS, k=review_count(rng, reviews))
+                # the rating summary is written with the product instead of replaying Review.save()
+                batch.append(Product(
+                    subcategory_id=rng.choice(subcategory_ids), article_number=index + 1,
+                    product_name_en=f'{adjective_en} {noun_en} {index}',
+                    product_name_ru=f'{adjective_ru} {noun_ru} {index}',
+                    description_en=f'{adjective_en} {noun_en} for every day.',
+                    description_ru=f'{adjective_ru} {noun_ru} на каждый день.',
+                    price=rng.randint(1, 300) * 100 - 1, product_type=rng.choice([True, False, None]),
+                    image=f'image/synthetic-{index % 50}.jpg',
+                    review_count=len(ratings), stars_sum=sum(ratings),
+                    **{f'stars_{number}': ratings.count(number) for number in range(1, 6)},
+                ))
+                stars.append(ratings)
+            with transaction.atomic():
+                Product.objects.bulk_create(batch)
+                images_added = insert_rows(ProductImage, ['product_id', 'image', 'image_derivatives'], [
+                    (product.pk, f'image/synthetic-{rng.randrange(50)}.jpg', '{}')
+                    for product in batch for number in range(rng.randint(0, 2 * images) if images else 0)
+                ])
+                reviews_added = insert_rows(Review, ['product_id', 'user_id', 'comment', 'stars', 'created_date'], [
+                    (product.pk, rng.choice(user_ids), rng.choice(COMMENTS), value, today)
+                    for product, ratings in zip(batch, stars) for value in ratings
+                ]) if user_ids else 0
+                TierPrice.refresh(batch)
+                backend.index_products(batch)
+            product_ids += [product.pk for product in batch]
+            counts['products'] += len(batch)
+            counts['images'] += images_added
+            counts['reviews'] += reviews_added
+            if progress:
+                progress(counts['products'], products)
+
+        with transaction.atomic():
+            carts = Cart.objects.bulk_create([Cart(user_id=user_id) for user_id in user_ids], batch_size=batch_size)
+            lists = Favorite.objects.bulk_create([Favorite(user_id=user_id) for user_id in user_ids],
+                                                 batch_size=batch_size)
+            for start in range(0, len(user_ids), batch_size):
+                items = [CartItem(cart=cart, product_id=product_id, quantity=rng.randint(1, 3))
+                         for cart in carts[start:start + batch_size]
+                         for product_id in rng.sample(product_ids, min(cart_items, len(product_ids)))]
+                liked = [FavoriteItem(favorite=favorite, product_id=product_id)
+                         for favorite in lists[start:start + batch_size]
+                         for product_id in rng.sample(product_ids, min(favorites, len(product_ids)))]
+                CartItem.objects.bulk_create(items)
+                FavoriteItem.objects.bulk_create(liked)
+                counts['cart_items'] += len(items)
+                counts['favorites'] += len(liked)
+
+    transaction.on_commit(bump_catalog_version)
+    return counts
@@ -1,3 +1,1486 @@
-from django.test import TestCase
+import base64
+import gzip
+import importlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.utils import ConnectionHandler
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone, translation
+from PIL import Image
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from online_shop.db import SQLITE_PRAGMAS, ReadReplicaRouter, sqlite_database
+
+from . import urls as store_urls
+from .benchmark import auth_headers, build_scenarios, compare, run_scenario, send, url
+from .models import (Cart, CartItem, Category, Favorite, FavoriteItem, Product, ProductImage, Review, SubCategory,
+                     TierPrice, UserProfile)
+from .authentication import StoreRefreshToken, UserCache, user_cache
+from .blacklist import RevokedTokens, revoked_tokens
+from .cache import VERSION_KEY, catalog_cache, catalog_version
+from .export import parse_since
+from .images import build_derivatives, generate_derivatives
+from .instrumentation import QueryBudgetExceeded, registry
+from .membership import membership_key
+from .ratings import rebuild_ratings
+from .search import get_search_backend
+from .serializers import (CategoryDetailSerializer, ProductDetailSerializer, ProductListSerializer,
+                          SubCategoryDetailSerializer)
+from .synthetic import SYNTHETIC_USER, generate_catalog
+
+
+def create_user(username='buyer', status='simple', **fields):
+    return UserProfile.objects.create(username=username, status=status, phone_number='+996555000000', **fields)
+
+
+def create_product(subcategory, article_number, price=1000, **fields):
+    fields.setdefault('product_name', f'Kettle {article_number}')
+    fields.setdefault('description', 'Electric kettle')
+    if 'image' not in fields:
+        # a placeholder whose derivatives count as built, so no job is scheduled for the missing file
+        fields.update(image='image/test.jpg', image_derivatives={'source': 'image/test.jpg'})
+    return Product.objects.create(subcategory=subcategory, article_number=article_number, price=price, **fields)
+
+
+class StoreTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(category_name='Kitchen', category_image='category_image/kitchen.jpg',
+                                               category_image_derivatives={'source': 'category_image/kitchen.jpg'})
+        cls.subcategory = SubCategory.objects.create(category=cls.category, subcategory_name='Kettles')
+        cls.user = create_user()
+
+    def setUp(self):
+        # caches outlive the per-test transaction
+        for cache in caches.all():
+            cache.clear()
+        user_cache.clear()
+        revoked_tokens.reset()
+
+    def client_for(self, user):
+        return Client(headers=auth_headers(user))
+
+
+class RatingSummaryTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(self.subcategory, 1)
+        self.other = create_product(self.subcategory, 2)
+
+    def summary(self, product):
+        product.refresh_from_db()
+        return product.review_count, product.stars_sum, product.rating_histogram()
+
+    def test_create_update_and_delete_keep_the_summary(self):
+        review = Review.objects.create(product=self.product, user=self.user, comment='Good', stars=4)
+        Review.objects.create(product=self.product, user=self.user, comment='Great', stars=5)
+        self.assertEqual(self.summary(self.product), (2, 9, {1: 0, 2: 0, 3: 0, 4: 1, 5: 1}))
+        self.assertEqual(self.product.avg_rating(), 4.5)
+
+        review.stars = 2
+        review.save()
+        self.assertEqual(self.summary(self.product), (2, 7, {1: 0, 2: 1, 3: 0, 4: 0, 5: 1}))
+
+        review.product = self.other
+        review.save()
+        self.assertEqual(self.summary(self.product), (1, 5, {1: 0, 2: 0, 3: 0, 4: 0, 5: 1}))
+        self.assertEqual(self.summary(self.other), (1, 2, {1: 0, 2: 1, 3: 0, 4: 0, 5: 0}))
+
+        review.delete()
+        self.assertEqual(self.summary(self.other), (0, 0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}))
+        self.assertEqual(self.other.avg_rating(), 0)
+
+    def test_saving_a_stale_product_keeps_the_summary(self):
+        product = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, user=self.user, comment='Good', stars=5)
+        product.price = 200
+        product.save()
+        self.assertEqual(self.summary(product), (1, 5, {1: 0, 2: 0, 3: 0, 4: 0, 5: 1}))
+        self.assertEqual(product.price, 200)
+
+    def test_rebuild_ratings_repairs_drift(self):
+        Review.objects.create(product=self.product, user=self.user, comment='Good', stars=3)
+        Product.objects.filter(pk=self.product.pk).update(review_count=10, stars_sum=1, stars_3=0)
+        self.assertEqual(rebuild_ratings(), 1)
+        self.assertEqual(self.summary(self.product), (1, 3, {1: 0, 2: 0, 3: 1, 4: 0, 5: 0}))
+        self.assertEqual(rebuild_ratings(), 0)
+
+
+class QueryPlanTest(StoreTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for number in range(1, 6):
+            product = create_product(cls.subcategory, number)
+            ProductImage.objects.bulk_create([ProductImage(product=product, image='image/test.jpg') for index in range(2)])
+            Review.objects.create(product=product, user=cls.user, comment='Good', stars=5)
+
+    def test_nested_serializers_load_in_fixed_queries(self):
+        # products, then their images
+        with self.assertNumQueries(2):
+            data = ProductListSerializer(ProductListSerializer.query_plan(Product.objects.all()), many=True).data
+        self.assertEqual([len(row['product_image']) for row in data], [2] * 5)
+        # product with its subcategory, then images, then the latest reviews with their users
+        product = Product.objects.first()
+        with self.assertNumQueries(3):
+            data = ProductDetailSerializer(ProductDetailSerializer.query_plan(Product.objects.all()).get(
+                pk=product.pk)).data
+        self.assertEqual(data['subcategory']['subcategory_name'], 'Kettles')
+        self.assertEqual(data['reviews'][0]['user']['first_name'], '')
+        # category, then its subcategories
+        with self.assertNumQueries(2):
+            data = CategoryDetailSerializer(CategoryDetailSerializer.query_plan(Category.objects.all()).get()).data
+        self.assertEqual(data['sub_categories'], [{'id': self.subcategory.pk, 'subcategory_name': 'Kettles'}])
+        # subcategory, then its first page of products, then their images
+        with self.assertNumQueries(3):
+            data = SubCategoryDetailSerializer(SubCategoryDetailSerializer.query_plan(SubCategory.objects.all()).get(),
+                                               context={'request': None}).data
+        self.assertEqual(len(data['products']), 5)
+        self.assertIsNone(data['next_products'])
+
+
+class KeysetPaginationTest(StoreTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.products = [create_product(cls.subcategory, number, price=100 * (number % 4 + 1)) for number in range(1, 8)]
+
+    def pages(self, query):
+        ids, link = [], url('product_list', query=query)
+        while link:
+            response = self.client.get(link)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            link = response.data['next']
+        return ids
+
+    def cursor(self, payload):
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def test_pages_cover_every_product_once_in_order(self):
+        expected = [product.pk for product in sorted(self.products, key=lambda product: (product.price, product.pk))]
+        self.assertEqual(self.pages('ordering=price&page_size=3'), expected)
+        self.assertEqual(self.pages('ordering=-price&page_size=3'), expected[::-1])
+        self.assertEqual(self.pages('page_size=2'), [product.pk for product in reversed(self.products)])
+
+    def test_previous_link_returns_the_page_before(self):
+        first = self.client.get(url('product_list', query='ordering=price&page_size=3')).data
+        second = self.client.get(first['next']).data
+        self.assertEqual(self.client.get(second['previous']).data['results'], first['results'])
+
+    def test_malformed_cursors_are_not_found(self):
+        for cursor in ['not-base64!', self.cursor([1, 2]), self.cursor({'o': 'price', 'k': ['abc', 5], 'r': False}),
+                       self.cursor({'o': 'price', 'k': [None, 5], 'r': False}),
+                       self.cursor({'o': 'price', 'k': [[1], 5], 'r': False}),
+                       self.cursor({'o': 'price', 'k': [100], 'r': False}),
+                       self.cursor({'o': 'newest', 'k': ['yesterday', 5], 'r': False}),
+                       self.cursor({'o': 'newest', 'k': ['2026-01-01T00:00:00+00:00', 5], 'r': 'yes'}),
+                       self.cursor({'o': 'newest', 'k': ['2026-01-01T00:00:00+00:00', 5], 'r': False})]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(url('product_list', query=f'ordering=price&cursor={cursor}'))
+                self.assertEqual(response.status_code, 404)
+
+    def test_products_without_created_date_do_not_break_paging(self):
+        Product.objects.filter(pk=self.products[0].pk).update(created_date=None)
+        self.assertEqual(self.pages('page_size=2'), [product.pk for product in reversed(self.products[1:])])
+
+
+class CatalogCacheTest(StoreTestCase):
+    def test_category_tree_is_cached_per_version_and_language(self):
+        self.assertEqual(self.client.get(url('category_list')).data[0]['category_name'], 'Kitchen')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url('category_list')).data[0]['category_name'], 'Kitchen')
+        Category.objects.filter(pk=self.category.pk).update(category_name_ru='Кухня')
+        with translation.override('ru'):
+            path = reverse('category_list')
+        self.assertEqual(self.client.get(path).data[0]['category_name'], 'Кухня')
+
+    def test_version_is_bumped_after_commit(self):
+        version = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subcategory.subcategory_name = 'Teapots'
+            self.subcategory.save()
+            # a concurrent read before the commit still sees, and caches, the old tree under the old version
+            self.assertEqual(catalog_version(), version)
+        self.assertGreater(catalog_version(), version)
+        self.assertEqual(self.client.get(url('sub_category_list')).data[0]['subcategory_name'], 'Teapots')
+
+    def test_edit_replaces_the_cached_tree(self):
+        self.client.get(url('category_detail', self.category.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            SubCategory.objects.create(category=self.category, subcategory_name='Toasters')
+        names = [row['subcategory_name'] for row in self.client.get(url('category_detail', self.category.pk)).data[
+            'sub_categories']]
+        self.assertEqual(sorted(names), ['Kettles', 'Toasters'])
+
+
+class SearchTest(StoreTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.teapots = SubCategory.objects.create(category=cls.category, subcategory_name='Teapots')
+        cls.kettle = create_product(cls.subcategory, 1, product_name='Electric kettle', product_name_ru='Чайник',
+                                    description='Boils water fast', description_ru='Быстро кипятит воду')
+        cls.described = create_product(cls.subcategory, 2, product_name='Steel jug',
+                                       description='Works like a kettle')
+        # better matches outside the filtered subcategory, to fill a limit applied too early
+        cls.kettles = [create_product(cls.subcategory, number, product_name=f'Kettle {number}') for number in range(3, 6)]
+        cls.teapot_kettles = [create_product(cls.teapots, number, product_name=f'Teapot {number}',
+                                             description='Stove top kettle') for number in range(6, 9)]
+
+    def search(self, query, language='en'):
+        with translation.override(language):
+            response = self.client.get(f'{reverse("product_search")}?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data]
+
+    def test_stemmed_and_prefix_matches(self):
+        self.assertIn(self.kettle.pk, self.search('q=kettles'))
+        self.assertIn(self.kettle.pk, self.search('q=elect'))
+        self.assertEqual(self.search('q=чайники', 'ru'), [self.kettle.pk])
+        self.assertEqual(self.search('q=кипятить воды', 'ru'), [self.kettle.pk])
+        self.assertEqual(self.search('q=toaster'), [])
+        self.assertEqual(self.search('q='), [])
+
+    def test_name_matches_rank_above_description_matches(self):
+        ids = self.search(f'q=kettle&subcategory={self.subcategory.pk}')
+        self.assertEqual(ids[-1], self.described.pk)
+        self.assertEqual(set(ids[:-1]), {self.kettle.pk, *(product.pk for product in self.kettles)})
+
+    def test_filters_apply_before_the_limit(self):
+        expected = {product.pk for product in self.teapot_kettles}
+        self.assertEqual(set(self.search(f'q=kettle&limit=3&subcategory={self.teapots.pk}')), expected)
+        self.assertEqual(len(self.search(f'q=kettle&limit=2&subcategory={self.teapots.pk}')), 2)
+        self.assertEqual(self.search(f'q=kettle&limit=1&subcategory={self.subcategory.pk}&price__lt=10'), [])
+
+    def test_simple_backend_applies_filters_before_the_limit(self):
+        get_search_backend.cache_clear()
+        try:
+            with override_settings(PRODUCT_SEARCH_BACKEND='store.search.SimpleSearchBackend'):
+                ids = self.search(f'q=kettle&limit=3&subcategory={self.teapots.pk}')
+        finally:
+            get_search_backend.cache_clear()
+        self.assertEqual(set(ids), {product.pk for product in self.teapot_kettles})
+
+    def test_index_follows_saves_and_deletes(self):
+        self.kettle.product_name = 'Toaster'
+        self.kettle.save()
+        self.assertEqual(self.search('q=toaster'), [self.kettle.pk])
+        self.kettle.delete()
+        self.assertEqual(self.search('q=toaster'), [])
+
+
+class FacetsTest(StoreTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.teapots = SubCategory.objects.create(category=cls.category, subcategory_name='Teapots')
+        create_product(cls.subcategory, 1, price=300, product_type=True)
+        create_product(cls.subcategory, 2, price=300, product_type=True)
+        create_product(cls.subcategory, 3, price=1200, product_type=False)
+        create_product(cls.teapots, 4, price=700, product_type=True)
+
+    def facets(self, query='', user=None):
+        client = self.client_for(user) if user else self.client
+        response = client.get(url('product_facets', query=query))
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        return (data['count'], {row['id']: row['count'] for row in data['subcategory']},
+                {row['value']: row['count'] for row in data['product_type']},
+                [row['count'] for row in data['price']][:4])
+
+    def test_counts_without_filters(self):
+        self.assertEqual(self.facets(), (4, {self.subcategory.pk: 3, self.teapots.pk: 1}, {True: 3, False: 1},
+                                         [2, 1, 1, 0]))
+
+    def test_each_facet_ignores_its_own_filter(self):
+        self.assertEqual(self.facets(f'subcategory={self.teapots.pk}'),
+                         (1, {self.subcategory.pk: 3, self.teapots.pk: 1}, {True: 1}, [0, 1, 0, 0]))
+        self.assertEqual(self.facets(f'subcategory={self.subcategory.pk}&price__lt=1000'),
+                         (2, {self.subcategory.pk: 2, self.teapots.pk: 1}, {True: 2}, [2, 0, 1, 0]))
+        self.assertEqual(self.facets('product_type=false'),
+                         (1, {self.subcategory.pk: 1}, {True: 3, False: 1}, [0, 0, 1, 0]))
+
+    def test_price_buckets_follow_the_tier_price(self):
+        gold = create_user('gold', status='gold')
+        self.assertEqual(self.facets(user=gold)[3], [4, 0, 0, 0])
+
+    def test_invalid_filter_is_a_bad_request(self):
+        self.assertEqual(self.client.get(url('product_facets', query='price__lt=abc')).status_code, 400)
+
+
+def image_file(width=800, height=400, fmt='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, fmt)
+    return ContentFile(buffer.getvalue())
+
+
+class TemporaryMediaMixin:
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root))
+        super().setUpClass()
+
+
+@override_settings(IMAGE_DERIVATIVE_FORMATS=['webp'], IMAGE_DERIVATIVE_WIDTHS=[320, 640, 1280],
+                   IMAGE_DERIVATIVES_ASYNC=False)
+class ImageDerivativesTest(TemporaryMediaMixin, StoreTestCase):
+    def test_widths_never_upscale_and_names_carry_the_content_hash(self):
+        name = default_storage.save('image/photo.png', image_file(800, 400))
+        derivatives = build_derivatives(name)
+        self.assertEqual(derivatives['width'], 800)
+        entries = derivatives['formats']['webp']
+        self.assertEqual([width for path, width in entries], [320, 640])
+        for path, width in entries:
+            self.assertRegex(path, r'^derivatives/photo-[0-9a-f]{16}-\d+w\.webp$')
+            with default_storage.open(path) as stored:
+                self.assertEqual(Image.open(stored).size, (width, width // 2))
+        self.assertEqual(build_derivatives(default_storage.save('image/tiny.png', image_file(100, 50)))[
+            'formats']['webp'][0][1], 100)
+
+    def test_saving_a_product_builds_derivatives_after_commit(self):
+        name = default_storage.save('image/kettle.png', image_file())
+        with self.captureOnCommitCallbacks(execute=True):
+            product = create_product(self.subcategory, 1, image=name)
+            self.assertEqual(product.version, 1)
+        product.refresh_from_db()
+        self.assertEqual(product.image_derivatives['source'], name)
+        # the touch invalidates the product's ETag
+        self.assertEqual(product.version, 2)
+
+        image = ProductImage.objects.create(product=product, image=name)
+        self.assertEqual(image.image_derivatives, {})
+        generate_derivatives(ProductImage, image.pk, 'image', name)
+        srcset = self.client.get(url('productimage-detail', image.pk)).data['srcset']['webp']
+        self.assertRegex(srcset, r'^http://testserver/media/derivatives/kettle-[0-9a-f]{16}-320w\.webp 320w, ')
+
+    def test_a_newer_upload_is_not_overwritten_by_a_slower_job(self):
+        old, new = (default_storage.save(f'image/{name}.png', image_file()) for name in ('old', 'new'))
+        product = create_product(self.subcategory, 1, image=new)
+        generate_derivatives(Product, product.pk, 'image', old)
+        product.refresh_from_db()
+        self.assertEqual(product.image_derivatives, {})
+
+    def test_missing_file_is_logged_not_raised(self):
+        with self.assertLogs('store.images', 'ERROR'):
+            self.assertIsNone(generate_derivatives(Product, 0, 'image', 'image/missing.png'))
+
+
+class MediaServingTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        self.name = default_storage.save('video/clip.mp4', ContentFile(bytes(range(256)) * 4))
+        self.path = f'/media/{self.name}'
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_body_with_validators(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), bytes(range(256)) * 4)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertRegex(response['ETag'], r'^"[0-9a-f]+-[0-9a-f]+-400"$')
+        self.assertEqual(self.client.get(self.path, headers={'If-None-Match': response['ETag']}).status_code, 304)
+
+    def test_the_etag_follows_the_file_version(self):
+        etag = self.client.get(self.path)['ETag']
+        full_path = default_storage.path(self.name)
+        stat = os.stat(full_path)
+        os.utime(full_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        response = self.client.get(self.path, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_ranges(self):
+        response = self.client.get(self.path, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(self.body(response), bytes(range(10, 20)))
+        response = self.client.get(self.path, headers={'Range': 'bytes=-4'})
+        self.assertEqual(response['Content-Range'], 'bytes 1020-1023/1024')
+        self.assertEqual(self.body(response), bytes(range(252, 256)))
+        response = self.client.get(self.path, headers={'Range': 'bytes=1000-'})
+        self.assertEqual(response['Content-Length'], '24')
+        response = self.client.get(self.path, headers={'Range': 'bytes=2000-'})
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */1024'))
+        # several ranges are not supported, so the whole file is sent
+        self.assertEqual(self.client.get(self.path, headers={'Range': 'bytes=0-1,5-6'}).status_code, 200)
+
+    def test_if_range_falls_back_to_the_full_body_when_the_file_changed(self):
+        etag = self.client.get(self.path)['ETag']
+        self.assertEqual(self.client.get(self.path, headers={'Range': 'bytes=0-9', 'If-Range': etag}).status_code, 206)
+        self.assertEqual(self.client.get(self.path, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'}).status_code,
+                         200)
+
+    def test_cache_control_and_paths(self):
+        derivative = default_storage.save('derivatives/photo-0123456789abcdef-320w.webp', ContentFile(b'webp'))
+        self.assertIn('immutable', self.client.get(f'/media/{derivative}')['Cache-Control'])
+        self.assertNotIn('immutable', self.client.get(self.path)['Cache-Control'])
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/video/missing.mp4').status_code, 404)
+        self.assertEqual(self.client.post(self.path).status_code, 405)
+
+    @override_settings(MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_accel_redirect_leaves_the_body_to_the_proxy(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+
+
+class ConditionalGetTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(self.subcategory, 1)
+
+    def revalidate(self, path, client=None):
+        client = client or self.client
+        response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return client.get(path, headers={'If-None-Match': response['ETag']}).status_code, response['ETag']
+
+    def test_catalog_304_until_an_edit(self):
+        self.assertEqual(self.revalidate(url('category_list'))[0], 304)
+        etag = self.client.get(url('category_list'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.category_name = 'Cookware'
+            self.category.save()
+        self.assertEqual(self.client.get(url('category_list'), headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_product_detail_304_until_the_product_changes(self):
+        path = url('product_detail', self.product.pk)
+        status, etag = self.revalidate(path)
+        self.assertEqual(status, 304)
+        self.product.price = 900
+        self.product.save()
+        response = self.client.get(path, headers={'If-None-Match': etag})
+        self.assertEqual((response.status_code, response.data['price']), (200, 900))
+        ProductImage.objects.create(product=self.product, image='image/test.jpg')
+        self.assertEqual(self.client.get(path, headers={'If-None-Match': response['ETag']}).status_code, 200)
+
+    def test_saves_and_rating_rebuilds_bump_the_stored_version(self):
+        path = url('product_detail', self.product.pk)
+        stale = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, user=self.user, comment='Good', stars=5)
+        etag = self.client.get(path)['ETag']
+        stale.price = 200
+        stale.save()
+        self.assertEqual(stale.version, 3)
+        self.assertEqual(self.client.get(path, headers={'If-None-Match': etag}).status_code, 200)
+
+        etag = self.client.get(path)['ETag']
+        Product.objects.filter(pk=self.product.pk).update(review_count=0, stars_sum=0, stars_5=0)
+        self.assertEqual(rebuild_ratings(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).version, 4)
+        response = self.client.get(path, headers={'If-None-Match': etag})
+        self.assertEqual((response.status_code, response.data['count_people']), (200, 1))
+
+    def test_etags_differ_per_tier(self):
+        path = url('product_detail', self.product.pk)
+        gold = self.client_for(create_user('gold', status='gold'))
+        self.assertNotEqual(self.revalidate(path)[1], self.revalidate(path, gold)[1])
+        self.assertEqual(gold.get(path, headers={'If-None-Match': self.client.get(path)['ETag']}).status_code, 200)
+
+    def test_product_list_etag_follows_the_page_and_the_flags(self):
+        client = self.client_for(self.user)
+        status, etag = self.revalidate(url('product_list'), client)
+        self.assertEqual(status, 304)
+        self.assertIn('Authorization', self.client.get(url('product_list'))['Vary'])
+        client.post(url('favorite_item_list'), {'product_id': self.product.pk})
+        response = client.get(url('product_list'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['is_favorite'])
+        create_product(self.subcategory, 2)
+        self.assertEqual(client.get(url('product_list'), headers={'If-None-Match': response['ETag']}).status_code, 200)
+
+
+class ProductReviewsTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(self.subcategory, 1)
+        self.reviews = [Review.objects.create(product=self.product, user=self.user, comment=f'Review {stars}',
+                                              stars=stars) for stars in (3, 5, 1, 4)]
+
+    def test_detail_embeds_the_latest_reviews_and_links_the_rest(self):
+        data = self.client.get(url('product_detail', self.product.pk)).data
+        self.assertEqual([row['id'] for row in data['reviews']], [review.pk for review in self.reviews[:0:-1]])
+        self.assertEqual(data['rating'], {'avg': 3.2, 'count': 4, 'histogram': {1: 1, 2: 0, 3: 1, 4: 1, 5: 1}})
+        response = self.client.get(data['reviews_url'], {'ordering': '-stars', 'page_size': 3})
+        self.assertEqual([row['stars'] for row in response.data['results']], [5, 4, 3])
+        self.assertEqual([row['stars'] for row in self.client.get(response.data['next']).data['results']], [1])
+
+    def test_comment_edit_changes_the_detail_etag(self):
+        path = url('product_detail', self.product.pk)
+        etag = self.client.get(path)['ETag']
+        review = self.reviews[-1]
+        review.comment = 'Edited'
+        review.save()
+        response = self.client.get(path, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['reviews'][0]['comment'], 'Edited')
+
+        # the same through the review endpoint
+        etag = response['ETag']
+        response = self.client_for(self.user).patch(url('review-detail', review.pk), {'comment': 'Edited again'},
+                                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(path, headers={'If-None-Match': etag})
+        self.assertEqual((response.status_code, response.data['reviews'][0]['comment']), (200, 'Edited again'))
+        self.assertEqual(self.client.get(path, headers={'If-None-Match': response['ETag']}).status_code, 304)
+
+
+class CartTotalsTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user('gold', status='gold')
+        self.cart = Cart.objects.create(user=self.user)
+        self.products = [create_product(self.subcategory, index, price=1000 + index) for index in range(1, 21)]
+
+    def add(self, products, quantity=3):
+        CartItem.objects.bulk_create([CartItem(cart=self.cart, product=product, quantity=quantity)
+                                      for product in products])
+
+    def test_totals_are_computed_at_the_callers_tier(self):
+        self.add(self.products[:2])
+        data = self.client_for(self.user).get(url('cart_detail')).data
+        # 75% off, rounded to the nearest som: 1001 -> 250, 1002 -> 251
+        self.assertEqual([item['total_price'] for item in data['items']], [750, 753])
+        self.assertEqual(data['total_price'], 1503)
+        self.assertEqual(Cart.objects.with_totals('gold').get().total_price, 1503)
+        self.assertEqual(Cart.objects.with_totals().get().total_price, 3 * 1001 + 3 * 1002)
+        items = self.client_for(self.user).get(url('cart_items_list')).data
+        self.assertEqual(sorted(item['total_price'] for item in items), [750, 753])
+
+    def test_empty_cart_totals_zero(self):
+        self.assertEqual(self.client_for(self.user).get(url('cart_detail')).data['total_price'], 0)
+
+    def test_cart_reads_take_a_fixed_number_of_queries(self):
+        client = self.client_for(self.user)
+        counts = {}
+        for size, products in (('one', self.products[:1]), ('twenty', self.products[1:])):
+            self.add(products)
+            for name in ('cart_detail', 'cart_items_list'):
+                client.get(url(name))  # warm the membership caches
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(client.get(url(name)).status_code, 200)
+                counts[name, size] = len(queries)
+        for name in ('cart_detail', 'cart_items_list'):
+            self.assertEqual(counts[name, 'one'], counts[name, 'twenty'], name)
+
+
+class CartBatchTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = [create_product(self.subcategory, index) for index in range(1, 5)]
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=5)
+
+    def post(self, operations):
+        return self.client_for(self.user).post(url('cart_batch'), {'operations': operations},
+                                               content_type='application/json')
+
+    def quantities(self):
+        return dict(self.cart.items.values_list('product_id', 'quantity'))
+
+    def test_operations_are_folded_and_the_cart_returned(self):
+        first, second, third, fourth = (product.pk for product in self.products)
+        response = self.post([
+            {'op': 'add', 'product_id': first, 'quantity': 3},
+            {'op': 'remove', 'product_id': second},
+            {'op': 'add', 'product_id': third},
+            {'op': 'add', 'product_id': third, 'quantity': 2},
+            {'op': 'set', 'product_id': fourth, 'quantity': 7},
+            {'op': 'set', 'product_id': fourth, 'quantity': 0},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {first: 5, third: 3})
+        self.assertEqual({item['product']['id']: item['quantity'] for item in response.data['items']},
+                         {first: 5, third: 3})
+        self.assertEqual(response.data['total_price'], 8000)
+
+    def test_quantities_are_capped(self):
+        self.post([{'op': 'set', 'product_id': self.products[0].pk, 'quantity': CartItem.MAX_QUANTITY},
+                   {'op': 'add', 'product_id': self.products[0].pk, 'quantity': 10}])
+        self.assertEqual(self.quantities()[self.products[0].pk], CartItem.MAX_QUANTITY)
+
+    def test_unknown_products_reject_the_whole_batch(self):
+        response = self.post([{'op': 'add', 'product_id': self.products[2].pk},
+                              {'op': 'remove', 'product_id': self.products[0].pk},
+                              {'op': 'add', 'product_id': 999999}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('999999', str(response.data))
+        self.assertEqual(self.quantities(), {self.products[0].pk: 2, self.products[1].pk: 5})
+
+    def test_batch_writes_take_a_fixed_number_of_queries(self):
+        # each batch adds new lines, bumps existing ones and removes one: the same three writes at any size
+        extra = [create_product(self.subcategory, index) for index in range(5, 25)]
+        counts = []
+        for added, existing in ((extra[:1], self.products[:2]), (extra[1:], [self.products[1]] + extra[:1])):
+            operations = ([{'op': 'add', 'product_id': product.pk} for product in added + existing[1:]]
+                          + [{'op': 'remove', 'product_id': existing[0].pk}])
+            with CaptureQueriesContext(connection) as queries:
+                self.cart.apply_operations(operations)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class CartUpsertTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cart = Cart.objects.create(user=self.user)
+        self.kettle, self.teapot = create_product(self.subcategory, 1), create_product(self.subcategory, 2)
+
+    def test_adds_merge_into_one_capped_line(self):
+        client = self.client_for(self.user)
+        for quantity, total in ((2, 2), (3, 5)):
+            response = client.post(url('cart_items_list'), {'product_id': self.kettle.pk, 'quantity': quantity})
+            self.assertEqual((response.status_code, response.data['quantity']), (201, total))
+        self.assertEqual(CartItem.objects.add_quantity(self.cart.pk, self.kettle.pk, CartItem.MAX_QUANTITY),
+                         response.data['id'])
+        self.assertEqual(list(self.cart.items.values_list('quantity', flat=True)), [CartItem.MAX_QUANTITY])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(cart=self.cart, product=self.kettle)
+
+    def test_moving_a_line_onto_another_product_merges_them(self):
+        kettle = CartItem.objects.create(cart=self.cart, product=self.kettle, quantity=2)
+        teapot = CartItem.objects.create(cart=self.cart, product=self.teapot, quantity=3)
+        client = self.client_for(self.user)
+        response = client.put(url('cart_items_detail', kettle.pk), {'product_id': self.teapot.pk, 'quantity': 4},
+                              content_type='application/json')
+        self.assertEqual((response.status_code, response.data['id'], response.data['quantity']), (200, teapot.pk, 7))
+        self.assertEqual(list(self.cart.items.values_list('product_id', 'quantity')), [(self.teapot.pk, 7)])
+        response = client.put(url('cart_items_detail', teapot.pk), {'product_id': self.teapot.pk, 'quantity': 1},
+                              content_type='application/json')
+        self.assertEqual((response.status_code, response.data['quantity']), (200, 1))
+
+
+class ConcurrentCartUpsertTest(SimpleTestCase):
+    # the in-memory test database fails concurrent writers with "table is locked" instead of
+    # queueing them, so the race runs against a throwaway SQLite file configured like production
+    alias = 'concurrent'
+    threads, adds = 8, 10
+
+    @classmethod
+    def setUpClass(cls):
+        directory = cls.enterClassContext(tempfile.TemporaryDirectory())
+        connections.settings[cls.alias] = sqlite_database(f'{directory}/db.sqlite3', conn_max_age=0, timeout=30)
+        connections.configure_settings(connections.settings)
+        cls.addClassCleanup(connections.settings.pop, cls.alias)
+        cls.addClassCleanup(connections.close_all)
+        cls.databases = {cls.alias}
+        super().setUpClass()
+        # tables straight from the models: the data migrations query the default database
+        with override_settings(MIGRATION_MODULES={app.label: None for app in apps.get_app_configs()}):
+            call_command('migrate', database=cls.alias, run_syncdb=True, verbosity=0)
+
+    def test_concurrent_adds_never_duplicate_a_line(self):
+        user = UserProfile.objects.using(self.alias).create(username='buyer')
+        cart = Cart.objects.using(self.alias).create(user=user)
+        # bulk_create skips the signal handlers, which write to the default database
+        category = Category.objects.using(self.alias).bulk_create([Category(category_name_en='Kitchen')])[0]
+        subcategory = SubCategory.objects.using(self.alias).bulk_create([
+            SubCategory(category=category, subcategory_name_en='Kettles')])[0]
+        product = Product.objects.using(self.alias).bulk_create([
+            Product(subcategory=subcategory, article_number=1, product_name_en='Kettle', price=1000)])[0]
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def add():
+            try:
+                barrier.wait()
+                for _ in range(self.adds):
+                    CartItem.objects.using(self.alias).add_quantity(cart.pk, product.pk)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections[self.alias].close()
+
+        workers = [threading.Thread(target=add) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(list(CartItem.objects.using(self.alias).values_list('quantity', flat=True)),
+                         [self.threads * self.adds])
+
+
+class MembershipFlagsTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = [create_product(self.subcategory, index) for index in range(1, 11)]
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.products[0])
+        favorite = Favorite.objects.create(user=self.user)
+        self.liked = FavoriteItem.objects.create(favorite=favorite, product=self.products[1])
+
+    def flags(self, response):
+        return {row['id']: (row['is_favorite'], row['in_cart']) for row in response.data['results']
+                if row['is_favorite'] or row['in_cart']}
+
+    def test_anonymous_listing_flags_nothing(self):
+        self.assertEqual(self.flags(self.client.get(url('product_list'))), {})
+
+    def test_listing_flags_the_callers_items_at_a_fixed_cost(self):
+        client = self.client_for(self.user)
+        self.assertEqual(self.flags(client.get(url('product_list'))),
+                         {self.products[0].pk: (False, True), self.products[1].pk: (True, False)})
+        # one cached membership read answers every row
+        with CaptureQueriesContext(connection) as few:
+            client.get(url('product_list', query='page_size=2'))
+        with CaptureQueriesContext(connection) as many:
+            client.get(url('product_list', query='page_size=10'))
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(self.flags(self.client_for(create_user('other')).get(url('product_list'))), {})
+
+    def test_cart_and_favorite_writes_refresh_the_flags_and_etag(self):
+        client = self.client_for(self.user)
+        etag = client.get(url('product_list'))['ETag']
+        client.post(url('cart_items_list'), {'product_id': self.products[2].pk})
+        response = client.get(url('product_list'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.flags(response)[self.products[2].pk], (False, True))
+
+        client.delete(url('favorite_item_detail', self.liked.pk))
+        client.post(url('cart_batch'), {'operations': [{'op': 'remove', 'product_id': self.products[0].pk}]},
+                    content_type='application/json')
+        self.assertEqual(self.flags(client.get(url('product_list'))), {self.products[2].pk: (False, True)})
+
+    def test_flags_live_in_the_configured_cache(self):
+        # pointing MEMBERSHIP_CACHE_ALIAS at a shared cache is what lets every worker see an invalidation
+        client = self.client_for(self.user)
+        key = membership_key(self.user.pk)
+        with override_settings(MEMBERSHIP_CACHE_ALIAS='catalog'):
+            client.get(url('product_list'))
+            self.assertIsNotNone(caches['catalog'].get(key))
+            self.assertIsNone(caches['membership'].get(key))
+            client.post(url('cart_items_list'), {'product_id': self.products[2].pk})
+            self.assertIsNone(caches['catalog'].get(key))
+
+
+class TokenClaimsTest(StoreTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user.set_password('secret')
+        cls.user.save()
+        cls.product = create_product(cls.subcategory, 1)
+
+    def login(self):
+        return self.client.post(url('login_list'), {'username': 'buyer', 'password': 'secret'}).data
+
+    def test_requests_are_served_from_the_claims_without_a_user_query(self):
+        client = Client(headers={'authorization': f'Bearer {self.login()["access"]}'})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.get(url('cart_detail')).status_code, 200)
+            self.assertEqual(client.get(url('favorite_detail')).status_code, 200)
+        self.assertFalse([query for query in queries if 'FROM "store_userprofile"' in query['sql']])
+        self.assertEqual([row['username'] for row in client.get(url('userprofile-list')).data], ['buyer'])
+
+    def test_the_status_claim_prices_the_catalog_until_the_next_refresh(self):
+        tokens = self.login()
+        client = Client(headers={'authorization': f'Bearer {tokens["access"]}'})
+        self.user.status = 'gold'
+        self.user.save()
+        self.assertEqual(client.get(url('product_detail', self.product.pk)).data['effective_price'], 1000)
+
+        access = self.client.post(url('token_refresh'), {'refresh': tokens['refresh']}).data['access']
+        client = Client(headers={'authorization': f'Bearer {access}'})
+        self.assertEqual(client.get(url('product_detail', self.product.pk)).data['effective_price'], 250)
+
+    def test_refresh_rejects_deactivated_users(self):
+        refresh = self.login()['refresh']
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(url('token_refresh'), {'refresh': refresh})
+        self.assertEqual((response.status_code, response.data['detail'].code), (401, 'no_active_account'))
+
+    def test_user_cache_is_bounded_and_invalidated_on_save(self):
+        cache = UserCache(maxsize=2, timeout=60)
+        users = [self.user, create_user('second'), create_user('third')]
+        for user in users:
+            cache.get(user.pk)
+        self.assertEqual(list(cache.entries), [users[1].pk, users[2].pk])
+        with self.assertNumQueries(0):
+            cache.get(users[2].pk)
+        self.assertIsNone(cache.get(0))
+
+        user_cache.get(self.user.pk)
+        UserProfile.objects.filter(pk=self.user.pk).update(first_name='Stale')
+        self.assertEqual(user_cache.get(self.user.pk).first_name, '')
+        self.user.first_name = 'Fresh'
+        self.user.save()
+        self.assertEqual(user_cache.get(self.user.pk).first_name, 'Fresh')
+
+
+class TokenRevocationTest(StoreTestCase):
+    def refresh(self, token):
+        return self.client.post(url('token_refresh'), {'refresh': str(token)}).status_code
+
+    def revoke_elsewhere(self, token):
+        # what LogoutView does in another process: a blacklist row, but no entry in this process's set
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))
+
+    def test_logout_revokes_the_refresh_token(self):
+        token = StoreRefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token), 200)
+        response = self.client_for(self.user).post(url('logout_list'), {'refresh': str(token)})
+        self.assertEqual(response.status_code, 205)
+        self.assertEqual(self.refresh(token), 401)
+
+    def test_revocations_from_other_processes_arrive_within_the_sync_interval(self):
+        token, other = StoreRefreshToken.for_user(self.user), StoreRefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(token), 200)
+        self.revoke_elsewhere(token)
+        with self.assertNumQueries(0):
+            self.assertNotIn(token['jti'], revoked_tokens)
+        # a new process loads every live revocation on its first check
+        self.assertIn(token['jti'], RevokedTokens(settings.TOKEN_BLACKLIST_SYNC_INTERVAL))
+
+        revoked_tokens.synced_at -= settings.TOKEN_BLACKLIST_SYNC_INTERVAL
+        self.assertEqual(self.refresh(token), 401)
+        self.revoke_elsewhere(other)
+        revoked_tokens.synced_at -= settings.TOKEN_BLACKLIST_SYNC_INTERVAL
+        with self.assertNumQueries(1):
+            self.assertIn(other['jti'], revoked_tokens)
+        self.assertEqual(revoked_tokens.last_id, BlacklistedToken.objects.get(token__jti=other['jti']).pk)
+
+    def test_expired_tokens_are_forgotten_and_pruned(self):
+        expired, live = StoreRefreshToken.for_user(self.user), StoreRefreshToken.for_user(self.user)
+        for token in (expired, live):
+            token.blacklist()
+        OutstandingToken.objects.filter(jti=expired['jti']).update(expires_at=timezone.now() - timedelta(seconds=1))
+        revoked_tokens.expiry[expired['jti']] = timezone.now() - timedelta(seconds=1)
+        revoked_tokens.sync(force=True)
+        self.assertEqual(set(revoked_tokens.expiry), {live['jti']})
+
+        output = io.StringIO()
+        call_command('prune_tokens', stdout=output)
+        self.assertIn('Deleted 1 expired tokens', output.getvalue())
+        self.assertEqual(list(BlacklistedToken.objects.values_list('token__jti', flat=True)), [live['jti']])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportUsersTest(TestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        create_user('taken')
+
+    def write(self, name, text):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(text)
+        return path
+
+    def run_import(self, path, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_users', path, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv_rows_are_validated_hashed_and_given_a_cart_and_favorites(self):
+        path = self.write('users.csv', (
+            'username,password,password_hash,phone_number,status,age\n'
+            'anna,secret,,+996555000001,gold,30\n'
+            'bek,,{hash},+996555000002,,\n'
+            'taken,secret,,+996555000003,,\n'
+            'anna,secret,,+996555000004,,\n'
+            'dana,secret,,12345,,\n'
+            'erke,secret,,+996555000005,platinum,\n'
+            'farida,,,+996555000006,,\n'
+        ).format(hash=make_password('prehashed')))
+        stdout, stderr = self.run_import(path, '--batch-size', '3', '--workers', '1')
+        self.assertIn('Imported 2 users, skipped 5 rows', stdout)
+        self.assertEqual(sorted(re.findall(r'line (\d+)', stderr)), ['4', '5', '6', '7', '8'])
+        self.assertIn("username 'taken' already exists", stderr)
+
+        anna, bek = UserProfile.objects.filter(username__in=['anna', 'bek']).order_by('username')
+        self.assertEqual((anna.status, anna.age, str(anna.phone_number)), ('gold', 30, '+996555000001'))
+        self.assertTrue(anna.check_password('secret'))
+        self.assertTrue(bek.check_password('prehashed'))
+        self.assertEqual(Cart.objects.filter(user__in=[anna, bek]).count(), 2)
+        self.assertEqual(Favorite.objects.filter(user__in=[anna, bek]).count(), 2)
+
+    def test_jsonl_passwords_hash_in_a_process_pool(self):
+        path = self.write('users.jsonl', '\n'.join([
+            json.dumps({'username': f'user{index}', 'password': f'secret{index}', 'phone_number': '+996555000007'})
+            for index in range(4)
+        ] + ['{not json', '', json.dumps(['a', 'list'])]) + '\n')
+        stdout, stderr = self.run_import(path, '--workers', '2')
+        self.assertIn('Imported 4 users, skipped 2 rows', stdout)
+        self.assertEqual(re.findall(r'line (\d+)', stderr), ['5', '7'])
+        for index in range(4):
+            self.assertTrue(UserProfile.objects.get(username=f'user{index}').check_password(f'secret{index}'))
+
+
+class TierPricingTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gold = create_user('gold', status='gold')
+        self.products = [create_product(self.subcategory, index, price=price)
+                         for index, price in enumerate((1000, 400, 2000), start=1)]
+
+    def prices(self, client, query=''):
+        response = client.get(url('product_list', query=query))
+        return [(row['id'], row['effective_price']) for row in response.data['results']]
+
+    def test_listing_orders_and_filters_on_the_callers_tier_price(self):
+        cheap, mid, dear = self.products[1], self.products[0], self.products[2]
+        client = self.client_for(self.gold)
+        self.assertEqual(self.prices(client, 'ordering=-price'), [(dear.pk, 500), (mid.pk, 250), (cheap.pk, 100)])
+        self.assertEqual(self.prices(client, 'ordering=price&price__gt=100&price__lt=500'), [(mid.pk, 250)])
+        self.assertEqual(self.prices(self.client, 'ordering=price&price__lt=500'), [(cheap.pk, 400)])
+
+    def test_the_tier_price_is_joined_not_queried_per_row(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client_for(self.gold).get(url('product_list', query='ordering=price'))
+        products = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and
+                    'FROM "store_product"' in query['sql'] and 'ORDER BY' in query['sql']]
+        self.assertTrue(products)
+        for sql in products:
+            self.assertIn('INNER JOIN "store_tierprice"', sql)
+            self.assertNotIn('(SELECT', sql)
+
+    def test_deep_price_pages_seek_on_the_tier_index(self):
+        # no sort of the whole catalog: the page is read off (status, price, product) in order
+        client = self.client_for(self.gold)
+        cursor = client.get(url('product_list', query='ordering=price&page_size=1')).data['next']
+        for query in ('ordering=price&price__gt=100&price__lt=500', f'{cursor.split("?", 1)[1]}'):
+            with self.subTest(query=query), CaptureQueriesContext(connection) as queries:
+                client.get(url('product_list', query=query))
+            sql = next(query['sql'] for query in queries if 'ORDER BY' in query['sql']
+                       and 'FROM "store_product"' in query['sql'])
+            with connection.cursor() as cursor_:
+                cursor_.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = ' '.join(row[-1] for row in cursor_.fetchall())
+            self.assertIn('store_tierp_status_b2d5a3_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_cart_totals_fall_back_to_the_list_price_without_tier_rows(self):
+        TierPrice.objects.filter(product=self.products[1]).delete()
+        item = CartItem(cart=Cart.objects.create(user=self.gold), product=self.products[1], quantity=2)
+        self.assertEqual((item.get_total_price(), item.get_total_price('gold')), (800, 200))
+        # the catalog inner-joins the rows, which rebuild_tier_prices restores
+        self.assertFalse(Product.objects.with_effective_price('gold').filter(pk=self.products[1].pk).exists())
+        call_command('rebuild_tier_prices', stdout=io.StringIO())
+        product = Product.objects.with_effective_price('gold').get(pk=self.products[1].pk)
+        self.assertEqual(product.effective_price, 100)
+
+    def test_users_cannot_set_their_own_status(self):
+        response = self.client.post(url('register_list'), {
+            'username': 'newcomer', 'password': 'secret', 'phone_number': '+996555000009', 'status': 'gold',
+        })
+        self.assertEqual((response.status_code, response.data['status']), (201, 'simple'))
+        self.assertEqual(UserProfile.objects.get(username='newcomer').status, 'simple')
+
+        response = self.client_for(self.user).patch(url('userprofile-detail', self.user.pk), {'status': 'gold'},
+                                                    content_type='application/json')
+        self.assertEqual((response.status_code, response.data['status']), (200, 'simple'))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.status, 'simple')
+
+
+def reload_urls():
+    # store.urls picks the catalog views when it is imported, and the root urlconf keeps its resolver
+    for module in (store_urls, importlib.import_module(settings.ROOT_URLCONF)):
+        importlib.reload(module)
+    clear_url_caches()
+
+
+@contextmanager
+def async_catalog_views():
+    try:
+        with override_settings(ASYNC_CATALOG_VIEWS=True):
+            reload_urls()
+            yield
+    finally:
+        reload_urls()
+
+
+class AsyncCatalogViewsTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.gold = create_user('gold', status='gold')
+        self.products = [create_product(self.subcategory, index, price=1000 + index) for index in range(1, 6)]
+        Review.objects.create(product=self.products[0], user=self.user, comment='Good', stars=4)
+        CartItem.objects.create(cart=Cart.objects.create(user=self.gold), product=self.products[1])
+
+    def paths(self):
+        product = self.products[0]
+        return [
+            url('category_list'), url('category_detail', self.category.pk),
+            url('sub_category_list'), url('sub_category_detail', self.subcategory.pk),
+            url('product_list'), url('product_list', query='ordering=-price&price__lt=1004&page_size=2'),
+            url('product_list', query=f'subcategory={self.subcategory.pk}&ordering=price'),
+            url('product_detail', product.pk), url('product_detail', 0), url('product_list', query='price__gt=x'),
+        ]
+
+    def responses(self, get, headers):
+        return {path: (response.status_code, response.get('ETag'), response.json())
+                for path in self.paths() for response in [get(path, headers=headers)]}
+
+    def test_async_views_answer_like_their_sync_twins(self):
+        for headers in ({}, auth_headers(self.gold)):
+            with self.subTest(authenticated=bool(headers)):
+                expected = self.responses(Client().get, headers)
+                # drop the cached payloads, but keep the version the ETags carry
+                version = catalog_version()
+                for cache in caches.all():
+                    cache.clear()
+                catalog_cache().set(VERSION_KEY, version, timeout=None)
+                with async_catalog_views():
+                    self.assertEqual(resolve(url('product_list')).func.__module__, 'store.async_views')
+                    client = AsyncClient()
+                    actual = self.responses(lambda path, headers: async_to_sync(client.get)(path, headers=headers),
+                                            headers)
+                    # served from the catalog cache the second time round
+                    self.assertEqual(self.responses(
+                        lambda path, headers: async_to_sync(client.get)(path, headers=headers), headers), actual)
+                self.assertEqual(actual, expected)
+                self.assertEqual(actual[url('product_detail', 0)][0], 404)
+                self.assertEqual(actual[url('product_list', query='price__gt=x')][0], 400)
+
+    def test_async_views_revalidate_with_the_sync_etags(self):
+        path = url('category_list')
+        etag = self.client.get(path)['ETag']
+        with async_catalog_views():
+            response = async_to_sync(AsyncClient().get)(path, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+
+class DatabaseLayerTest(SimpleTestCase):
+    databases = {'default'}
+
+    def test_connections_apply_the_pragmas_and_replicas_are_read_only(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        path = f'{directory}/db.sqlite3'
+        handler = ConnectionHandler({'default': sqlite_database(path), 'replica': sqlite_database(path, True)})
+        self.addCleanup(handler.close_all)
+        with handler['default'].cursor() as cursor:
+            pragmas = {name: cursor.execute(f'PRAGMA {name}').fetchone()[0] for name in SQLITE_PRAGMAS}
+            cursor.execute('CREATE TABLE kettle (id integer PRIMARY KEY)')
+            cursor.execute('INSERT INTO kettle VALUES (1)')
+        # SQLite reads the journal mode back in lower case, and synchronous and temp_store as numbers
+        self.assertEqual(pragmas, {**SQLITE_PRAGMAS, 'journal_mode': 'wal', 'synchronous': 1, 'temp_store': 2})
+        self.assertEqual((handler['default'].settings_dict['CONN_MAX_AGE'],
+                          handler['default'].settings_dict['OPTIONS']['transaction_mode']), (60, 'IMMEDIATE'))
+
+        with handler['replica'].cursor() as cursor:
+            self.assertEqual(cursor.execute('SELECT id FROM kettle').fetchall(), [(1,)])
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            with self.assertRaises(OperationalError):
+                cursor.execute('INSERT INTO kettle VALUES (2)')
+
+    def test_router_sends_catalog_reads_outside_transactions_to_the_replica(self):
+        router = ReadReplicaRouter()
+        self.assertEqual([router.db_for_read(model) for model in (Product, TierPrice, Review, Cart, UserProfile)],
+                         ['replica', 'replica', 'replica', None, None])
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Product), 'default')
+        self.assertEqual(router.db_for_write(Product), 'default')
+        self.assertEqual((router.allow_migrate('default', 'store'), router.allow_migrate('replica', 'store')),
+                         (True, False))
+
+
+class ImportCatalogTest(TemporaryMediaMixin, StoreTestCase):
+    feed = (
+        'article_number,subcategory,category,price,product_type,product_name_en,product_name_ru,description,image,images\n'
+        '1,Kettles,Kitchen,1200,true,Steel kettle,Стальной чайник,Boils water,photo.png,photo.png|side.png\n'
+        '7,чайники,,900,,,,,,\n'
+        '8,Toasters,,100,,Toaster,,,,\n'
+        '9,Kettles,Garden,100,,Kettle,,,,\n'
+        '10,Kettles,,cheap,,Kettle,,,,\n'
+        '11,Kettles,,100,,Kettle,,,missing.png,\n'
+        '12,Kettles,,100,,,,,,\n'
+    )
+
+    def setUp(self):
+        super().setUp()
+        SubCategory.objects.filter(pk=self.subcategory.pk).update(subcategory_name_ru='Чайники')
+        self.feed_dir = self.enterContext(tempfile.TemporaryDirectory())
+        for name in ('photo.png', 'side.png'):
+            with open(f'{self.feed_dir}/{name}', 'wb') as stream:
+                stream.write(image_file().read())
+        self.existing = create_product(self.subcategory, 7, price=500, product_name='Old kettle')
+
+    def run_import(self, text, name='feed.csv'):
+        path = f'{self.feed_dir}/{name}'
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(text)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_catalog', path, '--images-dir', self.feed_dir, '--batch-size', '3',
+                     stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def gallery(self, product):
+        # stored names without their content hash
+        return sorted(re.sub(r'-[0-9a-f]{16}(?=\.)', '', name)
+                      for name in product.product_image.values_list('image', flat=True))
+
+    def test_feed_upserts_products_with_translations_files_and_derived_rows(self):
+        stdout, stderr = self.run_import(self.feed)
+        self.assertIn('Imported 2 products', stdout)
+        self.assertIn('rejected 5 rows, stored 2 files, changed 2 gallery rows', stdout)
+        self.assertEqual(sorted(re.findall(r'line (\d+)', stderr)), ['4', '5', '6', '7', '8'])
+
+        product = Product.objects.get(article_number=1)
+        self.assertEqual((product.product_name_en, product.product_name_ru, product.description_en, product.price,
+                          product.product_type), ('Steel kettle', 'Стальной чайник', 'Boils water', 1200, True))
+        self.assertRegex(product.image.name, r'^image/photo-[0-9a-f]{16}\.png$')
+        self.assertTrue(default_storage.exists(product.image.name))
+        self.assertEqual(self.gallery(product), ['image/photo.png', 'image/side.png'])
+        self.assertEqual(TierPrice.objects.get(product=product, status='gold').price, 300)
+        self.assertEqual(get_search_backend().search('steel', 'en'), [product.pk])
+
+        previous = self.existing.updated_date
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.price, self.existing.product_name), (900, 'Old kettle'))
+        self.assertGreater(self.existing.updated_date, previous)
+
+    def test_reimporting_the_same_feed_stores_and_changes_nothing(self):
+        self.run_import(self.feed)
+        images = list(ProductImage.objects.values_list('pk', 'image'))
+        stdout, stderr = self.run_import(self.feed)
+        self.assertIn('Imported 2 products', stdout)
+        self.assertIn('stored 0 files, changed 0 gallery rows', stdout)
+        self.assertEqual(list(ProductImage.objects.values_list('pk', 'image')), images)
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_jsonl_feeds_and_gallery_replacement(self):
+        rows = [{'article_number': 1, 'subcategory': 'Kettles', 'price': 100, 'product_name_en': 'Kettle',
+                 'images': ['photo.png', 'side.png']},
+                {'article_number': 1, 'subcategory': 'Kettles', 'price': 150, 'images': ['side.png']}]
+        self.run_import('\n'.join(json.dumps(row) for row in rows[:1]) + '\n', 'feed.jsonl')
+        self.run_import('\n'.join(json.dumps(row) for row in rows[1:]) + '\n', 'feed.jsonl')
+        product = Product.objects.get(article_number=1)
+        self.assertEqual((product.price, product.product_name_en), (150, 'Kettle'))
+        self.assertEqual(self.gallery(product), ['image/side.png'])
+
+    def test_article_numbers_past_the_small_int_range(self):
+        # the synthetic catalogs number products 1..n, and n reaches a million
+        self.run_import(json.dumps({'article_number': 1_000_000, 'subcategory': 'Kettles', 'price': 100,
+                                    'product_name_en': 'Kettle'}) + '\n', 'feed.jsonl')
+        Product.objects.get(article_number=1_000_000).clean_fields(exclude=['description', 'image'])
+
+
+class ProductExportTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = create_user('staff', is_staff=True)
+        self.old, self.new = create_product(self.subcategory, 1), create_product(self.subcategory, 2)
+        self.stamp(self.old, hours=2)
+        self.stamp(self.new, hours=1)
+
+    def stamp(self, product, **delta):
+        Product.objects.filter(pk=product.pk).update(updated_date=timezone.now() - timedelta(**delta))
+
+    def export(self, since=None, compress=False):
+        response = self.client_for(self.staff).get(url('product_export', query=f'since={since}' if since else ''),
+                                                   headers={'Accept-Encoding': 'gzip'} if compress else {})
+        body = b''.join(response.streaming_content)
+        self.assertEqual(response.get('Content-Encoding'), 'gzip' if compress else None)
+        if compress:
+            body = gzip.decompress(body)
+        return [json.loads(line) for line in body.decode().splitlines()], response['X-Export-Cursor']
+
+    def test_only_staff_can_export(self):
+        self.assertEqual(self.client.get(url('product_export')).status_code, 401)
+        self.assertEqual(self.client_for(self.user).get(url('product_export')).status_code, 403)
+        records, cursor = self.export(compress=True)
+        self.assertEqual([record['id'] for record in records], [self.old.pk, self.new.pk])
+        self.assertEqual(records[0]['subcategory']['name']['en'], 'Kettles')
+
+    def test_users_cannot_promote_themselves_to_export(self):
+        response = self.client_for(self.user).patch(url('userprofile-detail', self.user.pk), {
+            'is_staff': True, 'is_superuser': True, 'is_active': False, 'password': 'plain', 'groups': [1],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse({'is_staff', 'is_superuser', 'password', 'groups'} & set(response.data))
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.is_staff, self.user.is_superuser, self.user.is_active),
+                         (False, False, True))
+        self.assertFalse(self.user.check_password('plain'))
+        self.assertEqual(self.client_for(self.user).get(url('product_export')).status_code, 403)
+
+    @override_settings(PRODUCT_EXPORT_CURSOR_LAG=600)
+    def test_the_cursor_trails_the_clock_so_late_commits_reach_the_next_run(self):
+        # a row stamped inside the window may belong to a transaction that has not committed yet
+        self.stamp(self.new, minutes=5)
+        records, cursor = self.export()
+        self.assertEqual([record['id'] for record in records], [self.old.pk])
+        self.assertLess(parse_since(cursor), timezone.now() - timedelta(minutes=9))
+        with override_settings(PRODUCT_EXPORT_CURSOR_LAG=0):
+            records, cursor = self.export(cursor)
+        self.assertEqual([record['id'] for record in records], [self.new.pk])
+
+    def test_tier_price_rebuilds_and_renames_move_products_past_the_cursor(self):
+        records, cursor = self.export()
+        self.assertEqual(self.export(cursor)[0], [])
+        with override_settings(PRODUCT_EXPORT_CURSOR_LAG=0):
+            TierPrice.objects.filter(product=self.old, status='gold').update(price=1)
+            call_command('rebuild_tier_prices', stdout=io.StringIO())
+            self.assertEqual([(record['id'], record['tier_prices']['gold']) for record in self.export(cursor)[0]],
+                             [(self.old.pk, 250)])
+
+            cursor = self.export()[1]
+            self.subcategory.save()
+            self.category.save(update_fields=['category_image_derivatives'])
+            self.assertEqual(self.export(cursor)[0], [])
+            self.category.category_name_ru = 'Кухня'
+            self.category.save()
+            records = self.export(cursor)[0]
+        self.assertEqual({record['id']: record['category']['name']['ru'] for record in records},
+                         {self.old.pk: 'Кухня', self.new.pk: 'Кухня'})
+
+
+    @override_settings(PRODUCT_EXPORT_CURSOR_LAG=0)
+    def test_incremental_exports_list_deleted_products(self):
+        cursor = self.export()[1]
+        old_pk = self.old.pk
+        self.old.delete()
+        records, cursor = self.export(cursor)
+        self.assertEqual([(record['id'], record.get('deleted')) for record in records], [(old_pk, True)])
+        self.assertEqual(self.export(cursor)[0], [])
+        # a full export is the whole catalog and needs no tombstones
+        self.assertEqual([record['id'] for record in self.export()[0]], [self.new.pk])
+
+    def test_asgi_export_streams_an_async_iterator(self):
+        # a sync iterator would be read into a list by the ASGI handler before anything is sent
+        headers = auth_headers(self.staff)
+
+        async def export():
+            response = await AsyncClient().get(url('product_export'), headers=headers)
+            return response, b''.join([block async for block in response.streaming_content])
+
+        response, body = async_to_sync(export)()
+        self.assertTrue(response.is_async)
+        self.assertEqual([json.loads(line)['id'] for line in body.decode().splitlines()], [self.old.pk, self.new.pk])
+        self.assertFalse(self.client_for(self.staff).get(url('product_export')).is_async)
+
+
+class InstrumentationTest(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    @override_settings(SERVER_TIMING=True)
+    def test_server_timing_reports_the_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url('category_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'desc="{len(queries)} queries"', response['Server-Timing'])
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serializer;dur=[\d.]+, '
+                                                    r'total;dur=[\d.]+$')
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_can_be_turned_off(self):
+        self.assertNotIn('Server-Timing', self.client.get(url('category_list')))
+
+    def test_requests_are_recorded_per_view(self):
+        response = self.client.get(url('category_list'))
+        self.client.get(url('category_detail', 0))
+        metrics = registry.render()
+        self.assertIn('store_requests_total{view="category_list",method="GET",status="200"} 1', metrics)
+        self.assertIn('store_requests_total{view="category_detail",method="GET",status="404"} 1', metrics)
+        self.assertIn(f'store_response_bytes_total{{view="category_list"}} {len(response.content)}', metrics)
+        self.assertIn('store_request_duration_seconds_count{view="category_list"} 1', metrics)
+        self.assertIn('store_query_budget_exceeded_total{view="category_list"} 0', metrics)
+
+    @override_settings(QUERY_BUDGETS={'category_list': 0}, QUERY_BUDGET_MODE='log')
+    def test_over_budget_is_logged(self):
+        with self.assertLogs('store.instrumentation', 'WARNING') as logs:
+            response = self.client.get(url('category_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('category_list ran 1 queries, over its budget of 0', logs.output[0])
+        self.assertIn('store_query_budget_exceeded_total{view="category_list"} 1', registry.render())
+
+    @override_settings(QUERY_BUDGETS={'category_list': 0}, QUERY_BUDGET_MODE='raise')
+    def test_over_budget_raises_in_raise_mode(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'over its budget of 0'):
+            self.client.get(url('category_list'))
+
+    @override_settings(QUERY_BUDGETS={'category_list': 1}, QUERY_BUDGET_MODE='raise')
+    def test_within_budget_passes(self):
+        self.assertEqual(self.client.get(url('category_list')).status_code, 200)
+
+    @override_settings(QUERY_BUDGET_MODE='raise')
+    def test_budgets_can_be_set_per_method(self):
+        with override_settings(QUERY_BUDGETS={'category_list': {'GET': 0}}):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'HEAD category_list ran 1 queries'):
+                self.client.head(url('category_list'))
+        with override_settings(QUERY_BUDGETS={'category_list': {'POST': 0}}):
+            self.assertEqual(self.client.get(url('category_list')).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='', DEBUG=False)
+    def test_metrics_without_a_token_are_hidden_in_production(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 404)
+
+    @override_settings(METRICS_TOKEN='', DEBUG=True)
+    def test_metrics_without_a_token_are_open_in_debug(self):
+        self.client.get(url('category_list'))
+        response = self.client.get('/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('store_requests_total{view="category_list",method="GET",status="200"} 1',
+                      response.content.decode())
+
+    @override_settings(METRICS_TOKEN='secret', DEBUG=False)
+    def test_metrics_need_the_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/metrics/', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        self.assertEqual(self.client.get('/metrics/', headers={'Authorization': 'Bearer secret'}).status_code, 200)
+
+
+class BenchmarkSmokeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        generate_catalog(products=30, users=3, categories=2, subcategories=2, reviews=3, images=1,
+                         cart_items=2, favorites=2, batch_size=10)
+        cls.user = UserProfile.objects.get(username=SYNTHETIC_USER)
+
+    def test_every_scenario_succeeds(self):
+        results = {}
+        for scenario in build_scenarios(self.user):
+            with self.subTest(scenario=scenario.name):
+                results[scenario.name] = run_scenario(scenario, self.user, requests=1, warmup=0)
+                self.assertTrue(all(int(status) < 400 for status in results[scenario.name]['statuses']),
+                                results[scenario.name]['statuses'])
+        self.assertEqual(compare(results, results)[1], [])
+
+
+def query_shapes(queries):
+    # the same statement with other parameters is one shape, so an N+1 shows up as one growing line
+    return Counter(re.sub(r'\b\d+\b', 'N', query['sql']) for query in queries)
+
+
+def scaling_report(name, sizes, small, large):
+    small_shapes, large_shapes = query_shapes(small), query_shapes(large)
+    grown = [f'  {small_shapes[shape]} -> {count}x {shape}'
+             for shape, count in large_shapes.most_common() if count > small_shapes[shape]]
+    return (f'{name}: {len(small)} queries with {sizes[0]} rows, {len(large)} with {sizes[1]} rows; '
+            f'statements that grew:\n' + '\n'.join(grown))
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class QueryCountScalingTest(TestCase):
+    # every endpoint is rendered over a small and a large data set, each built and rolled back
+    # inside the test; the number of queries must not depend on the number of related rows, and
+    # with cold caches it must stay within QUERY_BUDGETS
+    sizes = (5, 50)
+
+    def build(self, size):
+        # staff, for the export
+        user = UserProfile.objects.create(username='buyer', status='gold', is_staff=True)
+        reviewers = UserProfile.objects.bulk_create([UserProfile(username=f'reviewer{index}') for index in range(size)])
+        # bulk_create skips the image derivative handlers: the files do not exist
+        categories = Category.objects.bulk_create([
+            Category(category_name_en=f'Category {index}', category_image='category_image/test.jpg')
+            for index in range(size)
+        ])
+        subcategories = SubCategory.objects.bulk_create([
+            SubCategory(category=categories[0], subcategory_name_en=f'Subcategory {index}') for index in range(size)
+        ])
+        products = Product.objects.bulk_create([
+            Product(subcategory=subcategories[0], article_number=index + 1, product_name_en=f'Kettle {index}',
+                    description_en='Kettle', price=1000 + index, product_type=True, image='image/test.jpg',
+                    review_count=1, stars_sum=5, stars_5=1)
+            for index in range(size)
+        ])
+        product = products[0]
+        ProductImage.objects.bulk_create(
+            [ProductImage(product=item, image='image/test.jpg') for item in products]
+            + [ProductImage(product=product, image='image/test.jpg') for index in range(size)]
+        )
+        Review.objects.bulk_create([Review(product=product, user=reviewer, comment='Good', stars=5)
+                                    for reviewer in reviewers])
+        TierPrice.refresh(products)
+        get_search_backend().index_products(products)
+        cart = Cart.objects.create(user=user)
+        items = CartItem.objects.bulk_create([CartItem(cart=cart, product=item, quantity=1) for item in products])
+        favorite = Favorite.objects.create(user=user)
+        liked = FavoriteItem.objects.bulk_create([FavoriteItem(favorite=favorite, product=item) for item in products])
+        return {'user': user, 'category': categories[0], 'subcategory': subcategories[0], 'product': product,
+                'products': products, 'cart_item': items[0], 'favorite_item': liked[0]}
+
+    def endpoints(self, data):
+        # name -> (method, path, body); every list asks for a page big enough to hold all rows
+        product, item = data['product'], data['cart_item']
+        return {
+            'category_list': ('GET', url('category_list'), None),
+            'category_detail': ('GET', url('category_detail', data['category'].pk), None),
+            'sub_category_list': ('GET', url('sub_category_list'), None),
+            'sub_category_detail': ('GET', url('sub_category_detail', data['subcategory'].pk), None),
+            'product_list': ('GET', url('product_list', query=f'subcategory={data["subcategory"].pk}&page_size=100'),
+                             None),
+            'product_search': ('GET', url('product_search', query='q=kettle&limit=100'), None),
+            'product_facets': ('GET', url('product_facets'), None),
+            'product_export': ('GET', url('product_export'), None),
+            'product_detail': ('GET', url('product_detail', product.pk), None),
+            'product_reviews': ('GET', url('product_reviews', product.pk, query='page_size=100'), None),
+            'productimage-list': ('GET', url('productimage-list', query='page_size=100'), None),
+            'review-list': ('GET', url('review-list', query='page_size=100'), None),
+            'userprofile-list': ('GET', url('userprofile-list'), None),
+            'cart_detail': ('GET', url('cart_detail'), None),
+            'cartitem-list': ('GET', url('cartitem-list'), None),
+            'cart_items_list': ('GET', url('cart_items_list'), None),
+            'cart_items_list add': ('POST', url('cart_items_list'), {'product_id': product.pk, 'quantity': 1}),
+            'cart_items_detail': ('PUT', url('cart_items_detail', item.pk), {'product_id': product.pk, 'quantity': 2}),
+            'cart_batch': ('POST', url('cart_batch'), {'operations': [
+                {'op': 'set', 'product_id': line.pk, 'quantity': 2} for line in data['products']
+            ]}),
+            'favorite_detail': ('GET', url('favorite_detail'), None),
+            'favorite_item_list': ('GET', url('favorite_item_list'), None),
+            'favorite_item_list add': ('POST', url('favorite_item_list'), {'product_id': product.pk}),
+            'favorite_item_detail delete': ('DELETE', url('favorite_item_detail', data['favorite_item'].pk), None),
+        }
+
+    def measure(self, size, name):
+        with transaction.atomic():
+            data = self.build(size)
+            method, path, body = self.endpoints(data)[name]
+            headers = auth_headers(data['user'])
+            for cache in caches.all():
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = send(Client(), method, path, body, headers)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertLess(response.status_code, 400, f'{name}: {response.status_code}')
+            transaction.set_rollback(True)
+        for cache in caches.all():
+            cache.clear()
+        return queries.captured_queries
+
+    def test_query_count_does_not_grow_with_rows(self):
+        # login, register, token refresh and logout render no related rows; QUERY_BUDGETS covers them
+        with transaction.atomic():
+            names = list(self.endpoints(self.build(1)))
+            transaction.set_rollback(True)
+        for name in names:
+            with self.subTest(endpoint=name):
+                small, large = (self.measure(size, name) for size in self.sizes)
+                if len(small) != len(large):
+                    self.fail(scaling_report(name, self.sizes, small, large))
@@ -1,9 +1,11 @@
 from rest_framework import routers
+from django.conf import settings
 from django.urls import path, include
+from . import async_views
 from .views import (UserProfileViewSet, ProductImageViewSet, ReviewViewSet, CartItemViewSet,
                    CategoryListAPIView, CategoryDetailAPIView, SubCategoryListAPIView, SubCategoryDetailAPIView,
-                    ProductListAPIView, ProductDetailAPIView, RegisterView, CustomLoginView,
-                    LogoutView, CartViewSet, FavoriteItemViewSet, FavoriteViewSet)
+                    ProductListAPIView, ProductDetailAPIView, ProductSearchAPIView, ProductFacetsAPIView, ProductExportAPIView, ProductReviewListAPIView, RegisterView, CustomLoginView,
+                    CustomTokenRefreshView, LogoutView, CartViewSet, CartBatchAPIView, FavoriteItemViewSet, FavoriteViewSet)
 
 
 
@@ -17,30 +19,38 @@ router.register(r'cart_item', CartItemViewSet)
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register_list'),
     path('login/', CustomLoginView.as_view(), name='login_list'),
+    path('token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
     path('logout/', LogoutView.as_view(), name='logout_list'),
 
     path('', include(router.urls)),
-    path('category/', CategoryListAPIView.as_view(), name='category_list'),
-    path('category/<int:pk>/', CategoryDetailAPIView.as_view(), name='category_detail'),
-    path('sub_category/', SubCategoryListAPIView.as_view(), name='sub_category_list'),
-    path('sub_category/<int:pk>/', SubCategoryDetailAPIView.as_view(), name='sub_category_detail'),
-    path('product/', ProductListAPIView.as_view(), name='product_list'),
-    path('product/<int:pk>/', ProductDetailAPIView.as_view(), name='product_detail'),
+    path('product/search/', ProductSearchAPIView.as_view(), name='product_search'),
+    path('product/facets/', ProductFacetsAPIView.as_view(), name='product_facets'),
+    path('product/export/', ProductExportAPIView.as_view(), name='product_export'),
+    path('product/<int:pk>/reviews/', ProductReviewListAPIView.as_view(), name='product_reviews'),
     path('cart/', CartViewSet.as_view(), name='cart_detail'),
-    path('cart_items/', CartItemViewSet.as_view({'get': 'list', 'post': 'create'})),
-    path('cart_items/<int:pk>/', CartItemViewSet.as_view({'put': 'update', 'delete': 'destroy'})),
+    path('cart_items/', CartItemViewSet.as_view({'get': 'list', 'post': 'create'}), name='cart_items_list'),
+    path('cart_items/batch/', CartBatchAPIView.as_view(), name='cart_batch'),
+    path('cart_items/<int:pk>/', CartItemViewSet.as_view({'put': 'update', 'delete': 'destroy'}), name='cart_items_detail'),
     path('favorite/', FavoriteViewSet.as_view(), name='favorite_detail'),
-    path('favorite_item/', FavoriteItemViewSet.as_view({'get': 'list', 'post': 'create'})),
-    path('favorite_item/<int:pk>/', FavoriteItemViewSet.as_view({'put': 'update', 'delete': 'destroy'})),
+    path('favorite_item/', FavoriteItemViewSet.as_view({'get': 'list', 'post': 'create'}), name='favorite_item_list'),
+    path('favorite_item/<int:pk>/', FavoriteItemViewSet.as_view({'put': 'update', 'delete': 'destroy'}), name='favorite_item_detail'),
 ]
 
-
-
-
-
-
-
-
-
-
-
+if settings.ASYNC_CATALOG_VIEWS:
+    urlpatterns += [
+        path('category/', async_views.category_list, name='category_list'),
+        path('category/<int:pk>/', async_views.category_detail, name='category_detail'),
+        path('sub_category/', async_views.sub_category_list, name='sub_category_list'),
+        path('sub_category/<int:pk>/', async_views.sub_category_detail, name='sub_category_detail'),
+        path('product/', async_views.product_list, name='product_list'),
+        path('product/<int:pk>/', async_views.product_detail, name='product_detail'),
+    ]
+else:
+    urlpatterns += [
+        path('category/', CategoryListAPIView.as_view(), name='category_list'),
+        path('category/<int:pk>/', CategoryDetailAPIView.as_view(), name='category_detail'),
+        path('sub_category/', SubCategoryListAPIView.as_view(), name='sub_category_list'),
+        path('sub_category/<int:pk>/', SubCategoryDetailAPIView.as_view(), name='sub_category_detail'),
+        path('product/', ProductListAPIView.as_view(), name='product_list'),
+        path('product/<int:pk>/', ProductDetailAPIView.as_view(), name='product_detail'),
+    ]
@@ -0,0 +1,94 @@
+import os
+
+import django
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.db import transaction
+from phonenumber_field.phonenumber import to_python
+
+from .models import Cart, Favorite, UserProfile
+
+STATUSES = {value for value, label in UserProfile.STATUS_CHOICE}
+
+
+def clean_row(row):
+    if not isinstance(row, dict):
+        raise ValueError('not a JSON object')
+    username = (row.get('username') or '').strip()
+    if not username:
+        raise ValueError('username is required')
+    phone_number = to_python(str(row.get('phone_number') or '').strip())
+    if not phone_number or not phone_number.is_valid():
+        raise ValueError(f'invalid phone number {row.get("phone_number")!r}')
+    status = row.get('status') or 'simple'
+    if status not in STATUSES:
+        raise ValueError(f'unknown status {status!r}')
+    age = int(row['age']) if row.get('age') not in (None, '') else None
+    if age is not None and not 15 <= age <= 70:
+        raise ValueError(f'age {age} is out of range')
+
+    password, password_hash = row.get('password') or '', row.get('password_hash') or ''
+    if password_hash:
+        # raises ValueError for hashes no configured hasher can verify
+        identify_hasher(password_hash)
+    elif not password:
+        raise ValueError('password or password_hash is required')
+
+    user = UserProfile(username=username, email=row.get('email') or '', first_name=row.get('first_name') or '',
+                       last_name=row.get('last_name') or '', age=age, status=status,
+                       phone_number=phone_number, password=password_hash)
+    return user, password
+
+
+def init_worker(settings_module):
+    # spawned workers start without Django; forked ones already have it set up
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def hash_passwords(passwords, pool=None, workers=1):
+    if pool is None:
+        return [make_password(password) for password in passwords]
+    return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def import_batch(chunk, pool=None, workers=1):
+    # returns (created users, [(line, message), ...]) for one chunk of (line, row) pairs
+    users, passwords, lines, errors = [], [], [], []
+    for line, row in chunk:
+        try:
+            user, password = clean_row(row)
+        except (ValueError, TypeError) as error:
+            errors.append((line, str(error)))
+            continue
+        users.append(user)
+        passwords.append(password)
+        lines.append(line)
+
+    taken = set(UserProfile.objects.filter(username__in=[user.username for user in users])
+                .values_list('username', flat=True))
+    keep = []
+    for index, user in enumerate(users):
+        if user.username in taken:
+            errors.append((lines[index], f'username {user.username!r} already exists'))
+        else:
+            taken.add(user.username)
+            keep.append(index)
+    users = [users[index] for index in keep]
+    passwords = [passwords[index] for index in keep]
+
+    pending = [index for index, user in enumerate(users) if not user.password]
+    hashes = hash_passwords([passwords[index] for index in pending], pool, workers)
+    for index, password in zip(pending, hashes):
+        users[index].password = password
+
+    with transaction.atomic():
+        UserProfile.objects.bulk_create(users)
+        if users and users[0].pk is None:
+            # backends without RETURNING leave the primary keys unset
+            ids = dict(UserProfile.objects.filter(username__in=[user.username for user in users])
+                       .values_list('username', 'id'))
+            for user in users:
+                user.pk = ids[user.username]
+        Cart.objects.bulk_create([Cart(user=user) for user in users])
+        Favorite.objects.bulk_create([Favorite(user=user) for user in users])
+    return users, errors
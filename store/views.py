@@ -1,5 +1,14 @@
+import hashlib
+
+from django.core.handlers.asgi import ASGIRequest
 from django.core.serializers import serialize
-from rest_framework import viewsets, generics, status
+from django.http import StreamingHttpResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.text import compress_sequence
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.db import transaction
+from django.db.models import Case, When
+from rest_framework import viewsets, generics, status, permissions
 from .models import (UserProfile, Cart, Category, SubCategory,
                      Product, Review, ProductImage, CartItem,
                      Favorite, FavoriteItem)
@@ -7,13 +16,23 @@ from .serializers import (UserProfileSerializer, CategoryListSerializer, SubCate
                           ProductListSerializer,ProductDetailSerializer, SubCategoryDetailSerializer,
                           CategoryDetailSerializer, ProductImageSerializer, ReviewSerializer,
                           CartSerializer, CartItemSerializer, UserSerializer, LoginSerializer,
-                          FavoriteItemSerializer, FavoriteSerializer)
+                          FavoriteItemSerializer, FavoriteSerializer, CartBatchSerializer,
+                          TokenRefreshSerializer)
 from django_filters.rest_framework import DjangoFilterBackend
+from django_filters.utils import translate_validation
 from .filters import ProductFilter
-
+from .pagination import ProductPagination, ReviewPagination, ProductReviewPagination, ProductImagePagination
+from .cache import catalog_cache_key, catalog_etag, catalog_version, get_cached, set_cached
+from .search import get_search_backend
+from .facets import product_facets
+from .export import aiterate, export_catalog, export_until, format_cursor, parse_since
+from .membership import get_membership, invalidate_membership
+from .pricing import request_status
+
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .authentication import StoreRefreshToken
 
 class RegisterView(generics.CreateAPIView):
     serializer_class = UserSerializer
@@ -39,17 +58,71 @@ class CustomLoginView(TokenObtainPairView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class CustomTokenRefreshView(TokenRefreshView):
+    serializer_class = TokenRefreshSerializer
+
+
 class LogoutView(generics.GenericAPIView):
     def post(self, request, *args, **kwargs):
         try:
             refresh_token = request.data["refresh"]
-            token = RefreshToken(refresh_token)
+            token = StoreRefreshToken(refresh_token)
             token.blacklist()
             return Response(status=status.HTTP_205_RESET_CONTENT)
         except Exception:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+def product_list_etag(page, membership, status):
+    # the keyset page reduced to (id, version) pairs, plus the caller's tier and flags
+    flags = [(pk in membership['favorites'], pk in membership['cart']) for pk, version in page]
+    return f'W/"products-{status}-{hashlib.md5(repr((page, flags)).encode()).hexdigest()}"'
+
+
+def product_etag(pk, version, status, catalog=None):
+    catalog = catalog_version() if catalog is None else catalog
+    return f'W/"product-{pk}-{version}-{catalog}-{status}"'
+
+
+class QueryPlanMixin:
+    def get_queryset(self):
+        return self.get_serializer_class().query_plan(super().get_queryset())
+
+
+class ConditionalGetMixin:
+    # get_etag() must be cheap: it runs before the serializer and answers 304 on a match
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag()
+        if etag is not None:
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return not_modified
+        response = super().get(request, *args, **kwargs)
+        if etag is not None and response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
+
+class MembershipInvalidationMixin:
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (request.method not in permissions.SAFE_METHODS and response.status_code < 400
+                and request.user.is_authenticated):
+            invalidate_membership(request.user.id)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class CatalogCacheMixin:
+    def get(self, request, *args, **kwargs):
+        key = catalog_cache_key(request)
+        data = get_cached(key)
+        if data is not None:
+            return Response(data)
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            set_cached(key, response.data)
+        return response
+
+
 class UserProfileViewSet(viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileSerializer
@@ -58,91 +131,241 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         return UserProfile.objects.filter(id=self.request.user.id)
 
 
-class CategoryListAPIView(generics.ListAPIView):
+class CategoryListAPIView(ConditionalGetMixin, CatalogCacheMixin, QueryPlanMixin, generics.ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategoryListSerializer
 
-class CategoryDetailAPIView(generics.RetrieveAPIView):
+    def get_etag(self):
+        return catalog_etag()
+
+class CategoryDetailAPIView(ConditionalGetMixin, CatalogCacheMixin, QueryPlanMixin, generics.RetrieveAPIView):
     queryset = Category.objects.all()
     serializer_class = CategoryDetailSerializer
 
-class SubCategoryListAPIView(generics.ListAPIView):
+    def get_etag(self):
+        return catalog_etag()
+
+class SubCategoryListAPIView(ConditionalGetMixin, CatalogCacheMixin, QueryPlanMixin, generics.ListAPIView):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategoryListSerializer
 
-class SubCategoryDetailAPIView(generics.RetrieveAPIView):
+    def get_etag(self):
+        return catalog_etag()
+
+class SubCategoryDetailAPIView(QueryPlanMixin, generics.RetrieveAPIView):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategoryDetailSerializer
 
 
-class ProductListAPIView(generics.ListAPIView):
+class ProductListAPIView(ConditionalGetMixin, QueryPlanMixin, generics.ListAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductListSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = ProductFilter
+    pagination_class = ProductPagination
+
+    def get_queryset(self):
+        return super().get_queryset().with_effective_price(request_status(self.request))
+
+    def get_etag(self):
+        queryset = self.filter_queryset(Product.objects.all())
+        page = list(self.pagination_class().get_page_queryset(queryset, self.request).values_list('id', 'version'))
+        return product_list_etag(page, get_membership(self.request), request_status(self.request))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        patch_vary_headers(response, ['Authorization'])
+        return super().finalize_response(request, response, *args, **kwargs)
 
 
-class ProductDetailAPIView(generics.RetrieveAPIView):
+class ProductSearchAPIView(QueryPlanMixin, generics.ListAPIView):
+    queryset = Product.objects.all()
+    serializer_class = ProductListSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductFilter
+    default_limit = 20
+    max_limit = 100
+
+    def get_queryset(self):
+        query = self.request.query_params.get('q', '')
+        try:
+            limit = min(max(int(self.request.query_params.get('limit', self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+        backend = get_search_backend()
+        language = self.request.LANGUAGE_CODE if self.request.LANGUAGE_CODE in backend.languages else backend.languages[0]
+        queryset = super().get_queryset().with_effective_price(request_status(self.request))
+        candidates = super().filter_queryset(queryset)
+        ids = backend.search(query, language, limit=limit,
+                             candidates=candidates if candidates.query.has_filters() else None)
+        if not ids:
+            return Product.objects.none()
+        rank = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ids)])
+        return queryset.filter(pk__in=ids).order_by(rank)
+
+    def filter_queryset(self, queryset):
+        # the filters already narrowed the candidates in get_queryset
+        return queryset
+
+
+class ProductFacetsAPIView(generics.GenericAPIView):
+    queryset = Product.objects.all()
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductFilter
+
+    def get_queryset(self):
+        return super().get_queryset().with_effective_price(request_status(self.request))
+
+    def get(self, request, *args, **kwargs):
+        # the facets apply the filters themselves, each leaving out its own
+        filterset = DjangoFilterBackend().get_filterset(request, self.get_queryset(), self)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        return Response(product_facets(filterset))
+
+
+class ProductExportAPIView(generics.GenericAPIView):
+    # the whole catalog (or what changed and was deleted since a cursor) as NDJSON, streamed in
+    # chunks; X-Export-Cursor is the since= value for the next incremental run
+    permission_classes = [permissions.IsAdminUser]
+    chunk_size = 1000
+
+    def get(self, request, *args, **kwargs):
+        until = export_until()
+        try:
+            since = parse_since(request.query_params.get('since'))
+        except ValueError:
+            raise ValidationError({'since': 'Неверная дата, ожидается ISO 8601'})
+        lines = export_catalog(until, since, self.chunk_size, request.build_absolute_uri)
+        compress = re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if compress:
+            lines = compress_sequence(lines)
+        if isinstance(request._request, ASGIRequest):
+            lines = aiterate(lines)
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        response['X-Export-Cursor'] = format_cursor(until)
+        return response
+
+
+class ProductDetailAPIView(ConditionalGetMixin, QueryPlanMixin, generics.RetrieveAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductDetailSerializer
 
+    def get_queryset(self):
+        return super().get_queryset().with_effective_price(request_status(self.request))
 
-class ProductImageViewSet(viewsets.ModelViewSet):
+    def get_etag(self):
+        version = Product.objects.filter(pk=self.kwargs['pk']).values_list('version', flat=True).first()
+        if version is None:
+            return None
+        return product_etag(self.kwargs['pk'], version, request_status(self.request))
+
+
+class ProductReviewListAPIView(QueryPlanMixin, generics.ListAPIView):
+    queryset = Review.objects.all()
+    serializer_class = ReviewSerializer
+    pagination_class = ProductReviewPagination
+
+    def get_queryset(self):
+        return super().get_queryset().filter(product_id=self.kwargs['pk'])
+
+
+class ProductImageViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = ProductImage.objects.all()
     serializer_class = ProductImageSerializer
+    pagination_class = ProductImagePagination
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(QueryPlanMixin, viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination
 
 
 class CartViewSet(generics.RetrieveAPIView):
     serializer_class = CartSerializer
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        return CartSerializer.query_plan(Cart.objects.filter(user_id=self.request.user.id), request_status(self.request))
 
     def retrieve(self, request, *args, **kwargs):
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        cart = self.get_queryset().first()
+        if cart is None:
+            Cart.objects.get_or_create(user_id=request.user.id)
+            cart = self.get_queryset().get()
         serializer = self.get_serializer(cart)
         return Response(serializer.data)
 
 
-class CartItemViewSet(viewsets.ModelViewSet):
+class CartItemViewSet(MembershipInvalidationMixin, viewsets.ModelViewSet):
     queryset = CartItem.objects.all()
     serializer_class = CartItemSerializer
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart__user=self.request.user)
+        return CartItemSerializer.query_plan(super().get_queryset().filter(cart__user_id=self.request.user.id),
+                                             request_status(self.request))
 
     def perform_create(self, serializer):
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
-        serializer.save(cart=cart)
+        cart, created = Cart.objects.get_or_create(user_id=self.request.user.id)
+        item_id = CartItem.objects.add_quantity(cart.pk, serializer.validated_data['product'].pk,
+                                                serializer.validated_data.get('quantity', 1))
+        serializer.instance = self.get_queryset().get(pk=item_id)
+
+    def perform_update(self, serializer):
+        item = serializer.instance
+        product = serializer.validated_data.get('product')
+        if product is None or product.pk == item.product_id:
+            serializer.save()
+            return
+        # moving a line onto a product already in the cart merges the two lines instead of
+        # breaking the unique (cart, product) constraint
+        with transaction.atomic():
+            item.delete()
+            item_id = CartItem.objects.add_quantity(item.cart_id, product.pk,
+                                                    serializer.validated_data.get('quantity', item.quantity))
+        serializer.instance = self.get_queryset().get(pk=item_id)
+
+
+class CartBatchAPIView(MembershipInvalidationMixin, generics.GenericAPIView):
+    serializer_class = CartBatchSerializer
 
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart, created = Cart.objects.get_or_create(user_id=request.user.id)
+        cart.apply_operations(serializer.validated_data['operations'])
+        cart = CartSerializer.query_plan(Cart.objects.filter(pk=cart.pk), request_status(request)).get()
+        return Response(CartSerializer(cart, context=self.get_serializer_context()).data)
 
 
 class FavoriteViewSet(generics.RetrieveAPIView):
     serializer_class = FavoriteSerializer
 
     def get_queryset(self):
-        return Favorite.objects.filter(user=self.request.user)
+        return FavoriteSerializer.query_plan(Favorite.objects.filter(user_id=self.request.user.id),
+                                             request_status(self.request))
 
     def retrieve(self, request, *args, **kwargs):
-        favorite, created = Favorite.objects.get_or_create(user=request.user)
+        favorite = self.get_queryset().first()
+        if favorite is None:
+            Favorite.objects.get_or_create(user_id=request.user.id)
+            favorite = self.get_queryset().get()
         serializer = self.get_serializer(favorite)
         return Response(serializer.data)
 
 
-class FavoriteItemViewSet(viewsets.ModelViewSet):
+class FavoriteItemViewSet(MembershipInvalidationMixin, viewsets.ModelViewSet):
     queryset = FavoriteItem.objects.all()
     serializer_class = FavoriteItemSerializer
 
     def get_queryset(self):
-        return FavoriteItem.objects.filter(favorite__user=self.request.user)
+        return FavoriteItemSerializer.query_plan(
+            super().get_queryset().filter(favorite__user_id=self.request.user.id), request_status(self.request))
 
     def perform_create(self, serializer):
-        favorite, created = Favorite.objects.get_or_create(user=self.request.user)
+        favorite, created = Favorite.objects.get_or_create(user_id=self.request.user.id)
         serializer.save(favorite=favorite)
 
 